@@ -0,0 +1,67 @@
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from src.sources import read_excel_sheets
+from src.utils import excel_engine
+
+# Benchmark of the EOSL workbook ingestion on a synthetic workbook
+# baseline: pd.read_excel(sheet_name=None) + concat (openpyxl, one thread), against read_excel_sheets
+# run from the repository root: python -m benchmarks.bench_eosl_ingest --sheets 12 --rows 20000
+
+
+# synthetic EOSL style workbook: one sheet per component category, same columns on every sheet
+def build_workbook(path, sheets, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    vendors = np.array(['Microsoft', 'Red Hat', 'Oracle', 'VMware', 'Cisco', 'Dell'])
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for sheet in range(sheets):
+            df = pd.DataFrame({
+                'Asset Name': [f'host{sheet:02d}{i:06d}.comp.pge.com' for i in range(rows)],
+                'Vendor': vendors[rng.integers(0, len(vendors), rows)],
+                'Product': [f'Product {i % 50}' for i in range(rows)],
+                'Version': [f'{a}.{b}.{c}' for a, b, c in rng.integers(1, 20, (rows, 3))],
+                'EOSL Date': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 3650, rows), unit='D'),
+                'Instances': rng.integers(1, 500, rows),
+                'APP-ID': [f'APP-{i % 9000:04d}' for i in range(rows)],
+            })
+            df.to_excel(writer, sheet_name=f'Category {sheet}', index=False)
+
+
+def timed(label, func, repeat):
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    print(f'{label:<45} {best:>8.2f}s  ({len(result)} rows)')
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark multi sheet Excel ingestion (load_eosl_aaset)')
+    parser.add_argument('--sheets', type=int, default=12)
+    parser.add_argument('--rows', type=int, default=20000, help='rows per sheet')
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'eosl_synthetic.xlsx')
+        start_time = time.perf_counter()
+        build_workbook(path, args.sheets, args.rows)
+        print(f'Built {args.sheets} sheets x {args.rows} rows ({os.path.getsize(path) / 1024 ** 2:.1f} MB) '
+              f'in {time.perf_counter() - start_time:.1f}s')
+
+        dtypes = {'Version': 'str'}
+        timed('read_excel(sheet_name=None) + concat', lambda: pd.concat(
+            pd.read_excel(path, sheet_name=None).values(), ignore_index=True), args.repeat)
+        timed('read_excel_sheets openpyxl', lambda: pd.concat(
+            read_excel_sheets(path, dtypes, 'openpyxl').values(), ignore_index=True), args.repeat)
+        if excel_engine == 'calamine':
+            timed('read_excel_sheets calamine', lambda: pd.concat(
+                read_excel_sheets(path, dtypes, 'calamine').values(), ignore_index=True), args.repeat)
+        else:
+            print('python-calamine not installed, calamine run skipped')
@@ -0,0 +1,64 @@
+import time
+import random
+import argparse
+import pandas as pd
+from src.transform import flatten_vrops_data, compile_transform_spec, resource_id_column
+from config import vmware_properties_names, vmware_transform_spec
+
+# Microbenchmark of flatten_vrops_data on synthetic vROps payloads
+# baseline: the previous row-wise flattener (list of per-VM dicts, DataFrame, rename, reindex)
+# run from the repository root: python -m benchmarks.bench_flatten_vrops --sizes 10000 100000
+
+
+# synthetic payload: every wanted property (a few missing at random) plus metrics the table does not use
+def build_payload(resources, extra=20, seed=0):
+    rng = random.Random(seed)
+    names = list(vmware_properties_names) + [f'extra|metric_{i}' for i in range(extra)]
+    results = []
+    for vm in range(resources):
+        data = [{'name': name, 'value': rng.random() * 1000 if '|' in name and rng.random() < 0.5 else f'vm{vm}-{name}'}
+                for name in names if rng.random() > 0.02]
+        results.append({'vm_id': f'vm-{vm}', 'data': data})
+    return results
+
+
+# the previous implementation, kept here as the baseline
+def flatten_rowwise(metric_names, results, column_mapping):
+    flattened_data = [{item['name']: item['value'] for item in vm_props['data'] if item['name'] in metric_names} for vm_props in results]
+    df = pd.DataFrame(flattened_data)
+    df.rename(columns=column_mapping, inplace=True)
+    return df.reindex(columns=list(column_mapping.values()))
+
+
+# without the resource id column, which the baseline does not produce
+def flatten_columnar(metric_names, results, column_mapping):
+    return pd.DataFrame(flatten_vrops_data(metric_names, results, column_mapping)).drop(columns=[resource_id_column])
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark flatten_vrops_data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='number of resources')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # the columns the VMware transform reads (source name -> column)
+    vmware_column_mapping = compile_transform_spec(vmware_transform_spec, 'VirtualMachine').source_mapping
+
+    print(f'{"resources":>10} {"row-wise":>10} {"columnar":>10} {"speedup":>8}')
+    for size in args.sizes:
+        results = build_payload(size)
+        rowwise, expected = timed(lambda: flatten_rowwise(vmware_properties_names, results, vmware_column_mapping), args.repeat)
+        columnar, actual = timed(lambda: flatten_columnar(vmware_properties_names, results, vmware_column_mapping), args.repeat)
+        # both flatteners must give the same frame
+        pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+        print(f'{size:>10} {rowwise:>9.3f}s {columnar:>9.3f}s {rowwise / columnar:>7.1f}x')
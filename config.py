@@ -86,144 +86,340 @@ esxi_properties_names = ['config|name',
 'diskspace|total_usage']
 
 # --------------------------------------------------------------------------------
-# Column Mapping Dictionaries (used to rename attributes to sheet headings)
-# --------------------------------------------------------------------------------
-
-## VMware Column Mapping
-vmware_column_mapping = {
-    "config|name": "VM Name",
-    "summary|runtime|powerState": "Power State",
-    "summary|folder": "VCenter Folder",
-    "summary|customTag:PGE-AppID|customTagValue": "App ID",
-    "config|version": "VM Hardware Version",
-    "summary|guest|toolsVersion": "VM Tools Version",
-    "summary|guest|fullName": "Operating System",
-    "summary|guest|ipAddress": "Guest IP Address",
-    "net:4000|mac_address": "MAC Address",
-    "config|hardware|memoryKB": "Memory",
-    "mem|consumed_average": "Memory Utilization",
-    "config|hardware|numCpu": "Virtual CPU",
-    "config|hardware|numCoresPerSocket": "Cores Per Socket",
-    "cpu|usage_average": "CPU Usage",
-    "config|hardware|diskSpace": "Total Disk Space",
-    "guestfilesystem|usage_total": "Disk Utlization (TB)",
-    "guestfilesystem|capacity_total": "Disk Capacity",
-    "summary|parentHost": "Current Host",
-    "summary|parentCluster": "Cluster",
-    "summary|parentVcenter": "vCenter",
-    "summary|datastore": "Datastore",
-    "summary|customTag:Last Dell PowerProtect Backup|customTagValue": "PPDM Backup",
-    "summary|tagJson": "Vsphere",
-    "summary|customTag:LastSuccessfulBackup-com.dellemc.avamar|customTagValue": "Last Successful Backup"
+# Transform Specs (one entry per table column, in table order, compiled by compile_transform_spec)
+# --------------------------------------------------------------------------------
+# column: column name, source: vROps property/metric it is read from
+# dtype 'float': convert to numbers, split: (separator, index) keep one part of a string,
+# parse: column parser ('vsphere_tags', its frame is keyed on the vROps resource id, label: column copied next to the id),
+# minus: column subtracted first, unit: (from, to) storage units (b, k, M, G, T, P), scale: divide by, round: decimals
+# sql_type: type of the column in the table (default FLOAT for numeric columns, NVARCHAR(255) otherwise)
+# every source must be in the properties or metrics names above, the table and insert are generated from the spec
+
+## VMware Transform Spec
+vmware_transform_spec = [
+    {'column': "VM Name", 'source': "config|name"},
+    {'column': "Power State", 'source': "summary|runtime|powerState", 'sql_type': 'NVARCHAR(50)'},
+    {'column': "VCenter Folder", 'source': "summary|folder"},
+    {'column': "App ID", 'source': "summary|customTag:PGE-AppID|customTagValue"},
+    {'column': "VM Hardware Version", 'source': "config|version"},
+    {'column': "VM Tools Version", 'source': "summary|guest|toolsVersion"},
+    {'column': "Operating System", 'source': "summary|guest|fullName"},
+    {'column': "Guest IP Address", 'source': "summary|guest|ipAddress"},
+    {'column': "MAC Address", 'source': "net:4000|mac_address"},
+    # Memory in KB, converting in MB
+    {'column': "Memory", 'source': "config|hardware|memoryKB", 'dtype': 'float', 'scale': 1024 ** 2},
+    {'column': "Memory Utilization", 'source': "mem|consumed_average", 'scale': 1024 ** 2, 'round': 2},
+    {'column': "Virtual CPU", 'source': "config|hardware|numCpu"},
+    {'column': "Cores Per Socket", 'source': "config|hardware|numCoresPerSocket", 'sql_type': 'NVARCHAR(50)'},
+    {'column': "CPU Usage", 'source': "cpu|usage_average", 'round': 4},
+    # disk sizes in GB converting into TB
+    {'column': "Total Disk Space", 'source': "config|hardware|diskSpace", 'unit': ('G', 'T'), 'round': 2},
+    {'column': "Disk Utlization (TB)", 'source': "guestfilesystem|usage_total", 'unit': ('G', 'T'), 'round': 2},
+    {'column': "Disk Capacity Remaining", 'source': "guestfilesystem|capacity_total", 'minus': "Disk Utlization (TB)",
+     'unit': ('G', 'T'), 'round': 2},
+    {'column': "Current Host", 'source': "summary|parentHost"},
+    {'column': "Cluster", 'source': "summary|parentCluster"},
+    {'column': "vCenter", 'source': "summary|parentVcenter"},
+    {'column': "Datastore", 'source': "summary|datastore"},
+    {'column': "PPDM Backup", 'source': "summary|customTag:Last Dell PowerProtect Backup|customTagValue", 'sql_type': 'NVARCHAR(500)'},
+    {'column': "Last Successful Backup", 'source': "summary|customTag:LastSuccessfulBackup-com.dellemc.avamar|customTagValue"},
+    {'column': "Vsphere Tags", 'source': "summary|tagJson", 'parse': 'vsphere_tags', 'label': "VM Name", 'sql_type': 'NVARCHAR(500)'}
+]
+
+## ESXi Host Transform Spec
+esxi_transform_spec = [
+    {'column': "Name", 'source': 'config|name'},
+    {'column': "Cert END", 'source': 'Certificate Summary|ESXi Host Certificate|End Date'},
+    {'column': "vCenter", 'source': 'summary|parentVcenter'},
+    {'column': "Datacenter", 'source': 'summary|parentDatacenter'},
+    {'column': "Cluster", 'source': 'summary|parentCluster'},
+    # last address of the ip list
+    {'column': "Mgm IP", 'source': 'net|mgmt_address', 'split': (',', -1)},
+    {'column': "ESXi Version", 'source': 'summary|version'},  # Note: This seems mismatched; consider verifying
+    {'column': "HW Model", 'source': 'hardware|vendorModel'},  # Also seems mismatched
+    {'column': "HW Serial no", 'source': 'hardware|serialNumberTag'},
+    {'column': "Maintenance state", 'source': 'runtime|maintenanceState'},
+    {'column': "Connection state", 'source': 'runtime|connectionState'},
+    {'column': "Datastore Disk Space", 'source': 'config|diskSpace', 'unit': ('b', 'T'), 'round': 2},
+    {'column': "Socket", 'source': 'cpu|numCpuSockets'},
+    {'column': "Cores", 'source': 'hardware|cpuInfo|numCpuCores'},
+    {'column': "vCPU Allocated", 'source': 'summary|number_running_vcpus', 'dtype': 'float'},
+    {'column': "Host CPU Usage %", 'source': 'cpu|usage_average', 'round': 2},
+    {'column': "Host Memory | GB", 'source': 'hardware|memorySize', 'scale': 1024 ** 2, 'round': 2},
+    {'column': "Memory Allocated | GB", 'source': 'mem|granted_average', 'dtype': 'float'},
+    {'column': "Host Mem Usage %", 'source': 'mem|host_usagePct', 'round': 2},
+    {'column': "Memory Reserved %", 'source': 'mem|reservedCapacityPct', 'round': 2},
+    {'column': "Memory Overhead", 'source': 'mem|overhead_average', 'dtype': 'float'},
+    {'column': "CPU Model", 'source': 'cpu|cpuModel'},
+    # uptime in seconds into days
+    {'column': "System|Uptime (Day(s))", 'source': 'sys|uptime_latest', 'scale': 60 * 60 * 24, 'round': 2},
+    # sub domain name from the host name
+    {'column': "SD_Name", 'source': 'config|name', 'split': ('.', 0)},
+    {'column': "Disk Utilization", 'source': 'diskspace|total_usage', 'unit': ('G', 'T'), 'round': 2}
+]
+
+
+# --------------------------------------------------------------------------------
+# vROps Extraction Settings (used by run_vrops_extraction)
+# --------------------------------------------------------------------------------
+
+# bounds for the adaptive (AIMD) concurrency of in-flight vROps requests
+vrops_max_concurrent = 40
+vrops_min_concurrent = 4
+# p95 request latency (seconds) under which the concurrency keeps growing
+vrops_latency_target = 5.0
+# per request timeout (seconds), a timeout counts as an overload signal
+vrops_request_timeout = 120
+# failed resources are retried after the main sweep, backing off retry_backoff * 2^n seconds (with jitter)
+vrops_max_retries = 3
+vrops_retry_backoff = 5.0
+# local resource state store (SQLite), static properties fetched within the max age are reused
+vrops_state_path = 'data/vrops_state.sqlite'
+vrops_property_max_age_hours = 24
+# ignore the state store and fetch properties for every resource
+vrops_full_refresh = False
+# only these properties are cached in the state store, they change rarely (name, OS, folder, tags, cluster, hardware)
+# every other property (power state, host, IP, maintenance/connection state, backup tags...) is fetched with the stats
+vrops_static_properties = [
+    'config|name',
+    'summary|folder',
+    'summary|customTag:PGE-AppID|customTagValue',
+    'summary|guest|fullName',
+    'summary|tagJson',
+    'summary|parentCluster',
+    'summary|parentVcenter',
+    'summary|parentDatacenter',
+    'config|version',
+    'config|hardware|memoryKB',
+    'config|hardware|numCpu',
+    'config|hardware|numCoresPerSocket',
+    'hardware|vendorModel',
+    'hardware|serialNumberTag',
+    'hardware|cpuInfo|numCpuCores',
+    'hardware|memorySize',
+    'cpu|numCpuSockets',
+    'cpu|cpuModel'
+]
+
+# use the bulk query endpoints (stats/latest/query, properties/latest/query) instead of two GETs per resource
+vrops_bulk_mode = True
+# number of resource ids posted in one bulk query request
+vrops_bulk_batch_size = 500
+# extract, transform and load vROps resources in bounded batches instead of all at once
+vrops_stream_mode = True
+# number of resources transformed and inserted per streamed batch
+vrops_stream_batch_size = 2000
+# also load the vSphere tags as one (Resource ID, VM Name, Category, Tag) row per tag into this table (None = off)
+vmware_tags_table = None
+
+
+# --------------------------------------------------------------------------------
+# AMPs Extraction Settings (used by fetch_amps_data)
+# --------------------------------------------------------------------------------
+
+# rows per skip/take window
+amps_page_size = 1000
+# windows fetched at the same time
+amps_max_workers = 4
+# attempts per window before the view fails
+amps_max_retries = 3
+# append each page to a staging table as it arrives instead of loading the whole view at once
+amps_stream_mode = True
+
+
+# --------------------------------------------------------------------------------
+# DPA Extraction Settings (used by run_dpa_extraction)
+# --------------------------------------------------------------------------------
+
+# look up nodes, submit and poll reports concurrently instead of one at a time with fixed sleeps
+dpa_async_mode = True
+# requests in flight per DPA host (DPA answers bigger bursts with 503s and connection resets)
+dpa_max_concurrent = 4
+# nodes per report job, nodes of several servers share a report and the CSV is split back by its Server column
+# (1 = one report per node)
+dpa_max_nodes_per_report = 50
+# attempts for node lookups and report submissions on 5xx/429/connection errors
+dpa_max_retries = 3
+dpa_retry_backoff = 2.0
+# report polling: first delay, largest delay and how long (seconds) to wait for a report to be ready
+dpa_poll_initial_delay = 2.0
+dpa_poll_max_delay = 30.0
+dpa_poll_timeout = 600
+# column types of the "Backup All Jobs" CSV, declared columns skip type inference and keep the same type in every report
+# (columns not listed are inferred), the reports are parsed with src.utils.read_csv so an empty 'str' cell stays null
+dpa_report_dtypes = {
+    'Server': 'str'
+}
+
+
+# --------------------------------------------------------------------------------
+# NAS Extraction Settings (used by fetch_nas_data)
+# --------------------------------------------------------------------------------
+
+# columns read from the share CSVs and their types, the other columns are skipped
+nas_csv_dtypes = {
+    'Path': 'str',
+    'Allocated Size': 'float64',
+    'Allocated Unit': 'category',
+    'Used Size': 'float64',
+    'Used Unit': 'category',
+    'APP-IDs from Share Descriptions': 'str',
+    'Clients': 'str',
+    'Cluster': 'category'
+}
+# files read at the same time
+nas_max_workers = 4
+# read copies of the CSVs from this local directory instead of the UNC shares (None = shares)
+nas_local_dir = None
+
+
+# --------------------------------------------------------------------------------
+# Master Workbook Settings (used by read_excel_cached)
+# --------------------------------------------------------------------------------
+
+nas_master_path = 'data/raw/NAS/NAS Master sheet.xlsx'
+san_master_path = 'data/raw/SAN/SAN Master.xlsx'
+# Parquet copies of the master workbooks, rebuilt when a workbook changes
+excel_cache_dir = 'data/cache'
+
+
+# --------------------------------------------------------------------------------
+# File Load Registry Settings (used by load_eosl_aaset and load_storage)
+# --------------------------------------------------------------------------------
+
+# file loads are skipped when the file and the loaded table are unchanged since the last load (--force reloads)
+load_registry_path = 'data/load_registry.sqlite'
+
+
+# --------------------------------------------------------------------------------
+# EOSL Ingestion Settings (used by load_eosl_aaset)
+# --------------------------------------------------------------------------------
+
+# column types declared for every sheet, so concatenating the sheets does not change them
+# (columns not listed are inferred)
+eosl_dtypes = {
+    'Version': 'str'
 }
 
-## ESXi Host Column Mapping
-esxi_column_mapping = {
-    'config|name': "Name",
-    'Certificate Summary|ESXi Host Certificate|End Date': "Cert END",
-    'summary|parentVcenter': "vCenter",
-    'summary|parentDatacenter': "Datacenter",
-    'summary|parentCluster': "Cluster",
-    'net|mgmt_address': "Mgm IP",
-    'summary|version': "ESXi Version",  # Note: This seems mismatched; consider verifying
-    'hardware|vendorModel': "HW Model",          # Also seems mismatched
-    'hardware|serialNumberTag': "HW Serial no",
-    'runtime|maintenanceState': "Maintenance state",
-    'runtime|connectionState': "Connection state",
-    'config|diskSpace': "Datastore Disk Space",
-    'cpu|numCpuSockets': "Socket",
-    'hardware|cpuInfo|numCpuCores': "Cores",
-    'summary|number_running_vcpus': "vCPU Allocated",
-    'cpu|usage_average': "Host CPU Usage %",
-    'hardware|memorySize': "Host Memory | GB",
-    'mem|granted_average': "Memory Allocated | GB",
-    'mem|host_usagePct': "Host Mem Usage %",
-    'mem|reservedCapacityPct': "Memory Reserved %",
-    'mem|overhead_average': "Memory Overhead",
-    'cpu|cpuModel': "CPU Model",
-    'sys|uptime_latest': "System|Uptime (Day(s))",
-    'diskspace|total_usage': "Disk Utilization | GB"
+
+# --------------------------------------------------------------------------------
+# AIOPS Extraction Settings (used by fetch_aiops_data)
+# --------------------------------------------------------------------------------
+
+# storage groups per page
+aiops_page_size = 500
+# pages fetched at the same time
+aiops_max_workers = 4
+# attempts per page
+aiops_max_retries = 3
+# load the pages that were fetched when some pages keep failing, instead of failing the SAN load
+aiops_allow_partial = False
+
+
+# --------------------------------------------------------------------------------
+# Snapshot Settings (used by the SnapshotWriter)
+# --------------------------------------------------------------------------------
+
+# the processed data of every source is exported here by a background thread
+snapshot_dir = 'data/processed'
+# 'xlsx' (the files the reports have always been exported as, xlsxwriter constant_memory when installed),
+# 'parquet' (fastest, but the exports become .parquet files: readers of the .xlsx files must be moved first) or 'csv'
+snapshot_format = 'xlsx'
+# set a source to False to turn its snapshots off
+snapshot_sources = {
+    'vmware': True,
+    'esxi': True,
+    'nas': True,
+    'aiops': True,
+    'ibm': True,
+    'san': True
 }
 
 
+# --------------------------------------------------------------------------------
+# Table Schema Settings (used by apply_schema and the CREATE TABLE generator)
+# --------------------------------------------------------------------------------
+
+# declared column types per table: 'string', 'category', 'int', 'float', 'datetime', 'date'
+# ints and floats are downcast to the smallest type holding the values, columns not listed keep their type
+table_schemas = {
+    'nas_report': {
+        'Path': 'string',
+        'Allocated': 'float',
+        'Used': 'float',
+        'APP-ID': 'category',
+        'Clients': 'string',
+        'Cluster': 'category',
+        'Frame Name': 'category'
+    },
+    'san_report': {
+        'StorageGroupName': 'string',
+        'ServerName': 'string',
+        'SystemDisplayName': 'string',
+        'APP -ID': 'category',
+        'Application Name': 'category',
+        'Total Size (TB)': 'float',
+        'Used (TB)': 'float'
+    },
+    'avamar_servers': {'Server': 'category'},
+    'ppdm_servers': {'Server': 'category'},
+    'view_itassets': {
+        'CS_Installation_Date': 'datetime',
+        'Assumed HW Expiration Date': 'date'
+    },
+    'view_database_assets': {'DB_Version_Short': 'category'},
+    'EOSL_assets': {
+        'Version': 'string',
+        'Short_Version': 'category'
+    },
+    # table of vmware_tags_table, when it is set to 'vmware_tags'
+    'vmware_tags': {
+        'Resource ID': 'string',
+        'VM Name': 'string',
+        'Category': 'category',
+        'Tag': 'category'
+    }
+}
+# text columns not declared above become categoricals when at most this share of their values are distinct (None = off)
+schema_category_ratio = 0.5
+# columns indexed in the CREATE TABLE of the tables loaded by load_amps_data_into_db and of the VMware/ESXi tables
+table_indexes = {
+    'san_report': ['SystemDisplayName'],
+    'ESXi': ['SD_Name'],
+    'vmware_tags': ['Resource ID']
+}
+
+
+# --------------------------------------------------------------------------------
+# Token Settings (used by TokenManager)
+# --------------------------------------------------------------------------------
+
+# tokens are refreshed this many seconds before they expire
+token_refresh_margin = 300
+# lifetime (seconds) used when the login response does not tell the expiry
+token_default_ttl = {
+    'vrops': 6 * 3600,
+    'amps': 3600,
+    'aiops': 3600,
+    'ibm': 900
+}
+
+
+# --------------------------------------------------------------------------------
+# Orchestrator Settings (used by run_tasks in main.py)
+# --------------------------------------------------------------------------------
+
+# number of load tasks (sources) running at the same time
+orchestrator_max_workers = 4
+
+
 # --------------------------------------------------------------------------------
 # SQL Queries (used for table creation and data insertion)
 # --------------------------------------------------------------------------------
 
-## VMware Table Creation Query
-vmware_create_table_query = """
-IF OBJECT_ID('dbo.VMware', 'U') IS NOT NULL DROP TABLE dbo.VMware;
-
-CREATE TABLE dbo.VMware (
-    [VM Name] NVARCHAR(255),
-    [Power State] NVARCHAR(50),
-    [VCenter Folder] NVARCHAR(255),
-    [App ID] NVARCHAR(255),
-    [VM Hardware Version] NVARCHAR(255),
-    [VM Tools Version] NVARCHAR(255),
-    [Operating System] NVARCHAR(255),
-    [Guest IP Address] NVARCHAR(255),
-    [MAC Address] NVARCHAR(255),
-    [Memory] FLOAT,
-    [Memory Utilization] FLOAT,
-    [Virtual CPU] NVARCHAR(255),
-    [Cores Per Socket] NVARCHAR(50),
-    [CPU Usage] FLOAT,
-    [Total Disk Space] FLOAT,
-    [Disk Utlization (TB)] FLOAT,
-    [Disk Capacity Remaining] FLOAT,
-    [Current Host] NVARCHAR(255),
-    [Cluster] NVARCHAR(255),
-    [vCenter] NVARCHAR(255),
-    [Datastore] NVARCHAR(255),
-    [PPDM Backup] NVARCHAR(500),
-    [Last Successful Backup] NVARCHAR(255),
-    [Vsphere Tags] NVARCHAR(500)
-)
-"""
-
-## ESXi Table Creation Query
-esxi_create_table_query = """
-IF OBJECT_ID('dbo.ESXi', 'U') IS NOT NULL DROP TABLE dbo.ESXi;
-
-CREATE TABLE dbo.ESXi (
-    [Name] NVARCHAR(255),
-    [Cert END] NVARCHAR(255),
-    [vCenter] NVARCHAR(255),
-    [Datacenter] NVARCHAR(255),
-    [Cluster] NVARCHAR(255),
-    [Mgm IP] NVARCHAR(255),
-    [ESXi Version] NVARCHAR(255),
-    [HW Model] NVARCHAR(255),
-    [HW Serial no] NVARCHAR(255),
-    [Maintenance state] NVARCHAR(255),
-    [Connection state] NVARCHAR(255),
-    [Datastore Disk Space] FLOAT,
-    [Socket] NVARCHAR(255),
-    [Cores] NVARCHAR(255),
-    [vCPU Allocated] FLOAT,
-    [Host CPU Usage %] FLOAT,
-    [Host Memory | GB] FLOAT,
-    [Memory Allocated | GB] FLOAT,
-    [Host Mem Usage %] FLOAT,
-    [Memory Reserved %] FLOAT,
-    [Memory Overhead] FLOAT,
-    [CPU Model] NVARCHAR(255),
-    [System|Uptime (Day(s))] FLOAT,
-    [SD_Name] NVARCHAR(255),
-    [Disk Utilization] FLOAT
-);
-"""
-
-## VMware Insert Query
-vmware_insert_sql_query = """
-INSERT INTO dbo.VMware VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-"""
-
-## ESXi Insert Query
-esxi_insert_sql_query = """
-INSERT INTO dbo.ESXi VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-"""
+## VMware and ESXi tables, their columns, SQL types and insert come from the transform specs (generate_table_queries)
+vmware_table_name = 'VMware'
+esxi_table_name = 'ESXi'
 
 ## Avamar Server List
 avamar_list = ['ffav01.comp.pge.com',
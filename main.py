@@ -1,4 +1,5 @@
 import os
+import argparse
 import logging
 import asyncio
 import aiohttp
@@ -11,16 +12,38 @@ from dotenv import load_dotenv
 from pandas import json_normalize
 from src.utils import get_vrops_auth_token, get_amps_auth_token, convert_lists_to_json, get_dpa_token, create_session_with_retries
 from src.utils import remove_duplicate_cols, get_aiops_auth_token, get_ibm_auth_token
-from src.extract import get_vrops_identifiers, run_vrops_extraction, get_amps_view_names, fetch_amps_data, fetch_ddboost_data
+from src.utils import TokenManager, acquire_vrops_token, acquire_amps_token, acquire_aiops_token, acquire_ibm_token
+from src.extract import get_vrops_identifiers, run_vrops_extraction, stream_vrops_extraction, iter_amps_pages, get_amps_view_names, fetch_amps_data, fetch_ddboost_data
 from src.extract import get_node_id, get_report_url, get_dpa_report, fetch_nas_data, fetch_aiops_data, fetch_ibm_data
+from src.extract import run_dpa_extraction, PartialFetchError
 from src.transform import flatten_vrops_data, transform_vmware_data, transform_esxi_data, transform_nas_data
-from src.transform import transform_aiops_data, transform_ibm_data, transform_amps_data
-from src.load import load_vmware_data_into_db, load_amps_data_into_db, run_custom_query, create_index
+from src.transform import transform_aiops_data, transform_ibm_data, transform_amps_data, DPAReportStore, compile_transform_spec
+from src.load import load_vmware_data_into_db, load_amps_data_into_db, run_custom_query, generate_table_queries
+from src.load import create_vrops_table, insert_vrops_batch, staging_query, swap_staging_table, drop_staging_table, load_amps_pages_into_db, get_table_checksum
+from src.orchestrator import task, run_tasks
+from src.cache import read_excel_cached, hash_file
+from src.sources import read_excel_sheets
+from src.snapshots import configure_snapshots, save_snapshot, save_snapshot_batch, finish_snapshot, close_snapshots
+from src.schema import configure_schemas, log_memory_report, apply_schema, parser_dtypes, concat_frames
+from src.state import open_load_registry, get_loaded_file, save_loaded_file
 # Local application imports from config.py
 from config import vmware_metrics_names, esxi_metrics_names, vmware_properties_names, esxi_properties_names
-from config import  vmware_column_mapping, esxi_column_mapping, vmware_create_table_query, esxi_create_table_query
-from config import  vmware_insert_sql_query, esxi_insert_sql_query
+from config import  vmware_transform_spec, esxi_transform_spec, vmware_table_name, esxi_table_name
 from config import avamar_list, ppdm_list, nas_file_paths, ddboost_host
+from config import vrops_bulk_mode, vrops_bulk_batch_size, vrops_stream_mode, vrops_stream_batch_size
+from config import vrops_max_concurrent, vrops_min_concurrent, vrops_latency_target, vrops_request_timeout
+from config import token_refresh_margin, token_default_ttl, orchestrator_max_workers
+from config import amps_page_size, amps_max_workers, amps_max_retries, amps_stream_mode
+from config import vrops_max_retries, vrops_retry_backoff, vrops_state_path, vrops_property_max_age_hours, vrops_full_refresh
+from config import vrops_static_properties
+from config import dpa_async_mode, dpa_max_concurrent, dpa_max_retries, dpa_retry_backoff, dpa_max_nodes_per_report
+from config import dpa_poll_initial_delay, dpa_poll_max_delay, dpa_poll_timeout, dpa_report_dtypes
+from config import aiops_page_size, aiops_max_workers, aiops_max_retries, aiops_allow_partial
+from config import nas_csv_dtypes, nas_max_workers, nas_local_dir
+from config import nas_master_path, san_master_path, excel_cache_dir, load_registry_path
+from config import eosl_dtypes
+from config import snapshot_dir, snapshot_format, snapshot_sources, vmware_tags_table
+from config import table_schemas, schema_category_ratio, table_indexes
 
 
 # Configure logging to write to a file
@@ -80,23 +103,111 @@ amps_view_list = ['view_database_assets']
 
 ## Using other variables from config.py
 
+# transform specs compiled once (every source must be fetched), every batch and run reuses the same column plan
+# the VMware/ESXi tables and inserts are generated from the compiled columns
+vmware_transform = compile_transform_spec(vmware_transform_spec, 'VirtualMachine', vmware_properties_names + vmware_metrics_names)
+esxi_transform = compile_transform_spec(esxi_transform_spec, 'HostSystem', esxi_properties_names + esxi_metrics_names)
+vmware_create_table_query, vmware_insert_sql_query = generate_table_queries(vmware_transform.sql_columns, vmware_table_name,
+                                                                            table_indexes.get(vmware_table_name))
+esxi_create_table_query, esxi_insert_sql_query = generate_table_queries(esxi_transform.sql_columns, esxi_table_name,
+                                                                        table_indexes.get(esxi_table_name))
+
+
+# Extract, flatten, transform and load vROps resources batch by batch
+# each batch is transformed and inserted in a worker thread, so the next batch keeps downloading meanwhile
+# batches go into dbo.{table_name}_staging, which replaces dbo.{table_name} once every batch is loaded:
+# readers keep the previous table during the run and a failed extraction leaves it untouched
+# snapshot: (source, name) of the snapshot, every batch is appended to it by the snapshot writer (kept only when the table is swapped in)
+async def stream_vrops_data(vrops_token, identifiers, vrops_host, metrics_names, properties_names, transform, transform_func,
+                            resourceKind, create_table_query, insert_sql_query, table_name, db_username, db_password, db_name, db_host, db_port,
+                            tags_table=None, snapshot=None):
+    start_time = time.time()
+    staging_name = f'{table_name}_staging'
+    conn, cursor = create_vrops_table(db_username, db_password, db_name, db_host, db_port, staging_query(create_table_query, table_name))
+    staging_insert_query = staging_query(insert_sql_query, table_name)
+    # normalized vSphere tags of every batch, loaded into tags_table at the end
+    tags_frames = []
+
+    def load_batch(batch):
+        flatten_data = flatten_vrops_data(properties_names + metrics_names, batch, transform.source_mapping, resourceKind)
+        if tags_table:
+            df_batch, tags_df = transform_func(flatten_data, transform, snapshot=False, tags_frame=True)
+            tags_frames.append(apply_schema(tags_df, tags_table))
+        else:
+            df_batch = transform_func(flatten_data, transform, snapshot=False)
+        if snapshot:
+            save_snapshot_batch(snapshot[0], snapshot[1], df_batch)
+        return insert_vrops_batch(conn, cursor, df_batch, staging_insert_query)
+
+    total_rows = 0
+    try:
+        async for batch in stream_vrops_extraction(vrops_token, identifiers, vrops_host, metrics_names, vrops_max_concurrent, resourceKind,
+                                                   properties_names, vrops_bulk_mode, vrops_bulk_batch_size, vrops_stream_batch_size,
+                                                   vrops_min_concurrent, vrops_latency_target, vrops_request_timeout,
+                                                   vrops_max_retries, vrops_retry_backoff,
+                                                   vrops_state_path, vrops_property_max_age_hours * 3600, vrops_full_refresh,
+                                                   vrops_static_properties):
+            total_rows += await asyncio.to_thread(load_batch, batch)
+            logger.info(f'Streamed {total_rows} {resourceKind} rows into {staging_name}')
+
+        if not total_rows:
+            logger.info(f'No {resourceKind} rows fetched, {table_name} left unchanged')
+            drop_staging_table(conn, cursor, staging_name)
+            return
+        swap_staging_table(conn, cursor, table_name)
+        logger.info(f'{staging_name} swapped in as {table_name}')
+    except BaseException:
+        drop_staging_table(conn, cursor, staging_name)
+        if snapshot:
+            finish_snapshot(snapshot[0], snapshot[1], keep=False)
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+    if snapshot:
+        finish_snapshot(snapshot[0], snapshot[1])
+
+    if tags_table and tags_frames:
+        load_amps_data_into_db(concat_frames(tags_frames, ignore_index=True), tags_table, db_username, db_password, db_name, db_host, db_port)
+
+    end_time = time.time() - start_time
+    logger.info(f'Time taken to stream {total_rows} {resourceKind} rows: {end_time:.2f} seconds')
+
 
 # Get and load the VirtualMachine data into database table
-def load_vmware_data(vrops_token, vrops_host, vmware_metrics_names, vmware_properties_names, vmware_column_mapping, db_username, db_password, db_name, db_host, db_port):
+def load_vmware_data(vrops_token, vrops_host, vmware_metrics_names, vmware_properties_names, vmware_transform, db_username, db_password, db_name, db_host, db_port):
     # get the identifiers for the VMware(vROps)
     vmware_ids = get_vrops_identifiers(vrops_token, vrops_host, resourceKind='VirtualMachine')
 
+    if vrops_stream_mode:
+        asyncio.run(stream_vrops_data(vrops_token, vmware_ids, vrops_host, vmware_metrics_names, vmware_properties_names, vmware_transform,
+                                      transform_vmware_data, 'VirtualMachine', vmware_create_table_query, vmware_insert_sql_query, vmware_table_name,
+                                      db_username, db_password, db_name, db_host, db_port, vmware_tags_table, ('vmware', 'new_fetched_vm')))
+        return
+
     # fetch metrics and properties for VMWARE (ids)
-    vmware_data = asyncio.run(run_vrops_extraction(vrops_token, vmware_ids, vrops_host, vmware_metrics_names, 40, 'VirtualMachine'))
+    vmware_data = asyncio.run(run_vrops_extraction(vrops_token, vmware_ids, vrops_host, vmware_metrics_names, vrops_max_concurrent, 'VirtualMachine',
+                                                   vmware_properties_names, vrops_bulk_mode, vrops_bulk_batch_size,
+                                                   vrops_min_concurrent, vrops_latency_target, vrops_request_timeout,
+                                                   vrops_max_retries, vrops_retry_backoff,
+                                                   vrops_state_path, vrops_property_max_age_hours * 3600, vrops_full_refresh,
+                                                   vrops_static_properties))
 
     # Allow cleanup to finish
     asyncio.sleep(1)
 
-    # flatten the result(properties, metrics) into dictionary
-    flatten_vmware_data = flatten_vrops_data(vmware_properties_names, vmware_data, 'VirtualMachine')
+    # flatten the result(properties, metrics) into columns
+    flatten_vmware_data = flatten_vrops_data(vmware_properties_names + vmware_metrics_names, vmware_data, vmware_transform.source_mapping, 'VirtualMachine')
 
     # transform and get vmware data as DataFrame
-    df_vmware = transform_vmware_data(flatten_vmware_data, vmware_column_mapping)
+    if vmware_tags_table:
+        df_vmware, tags_df = transform_vmware_data(flatten_vmware_data, vmware_transform, tags_frame=True)
+        tags_df = apply_schema(tags_df, vmware_tags_table)
+        # one row per (VM, vSphere tag), cheaper to filter on than the Vsphere Tags column
+        load_amps_data_into_db(tags_df, vmware_tags_table, db_username, db_password, db_name, db_host, db_port)
+    else:
+        df_vmware = transform_vmware_data(flatten_vmware_data, vmware_transform)
 
     # load vmware data into mysql server database
     load_vmware_data_into_db(df_vmware, db_username, db_password, db_name, db_host, db_port, vmware_create_table_query, vmware_insert_sql_query)
@@ -104,48 +215,85 @@ def load_vmware_data(vrops_token, vrops_host, vmware_metrics_names, vmware_prope
 
 
 # Get and load the ESXi Host data into database table
-def load_esxi_data(vrops_token, vrops_host, esxi_metrics_names, esxi_properties_names, esxi_column_mapping, db_username, db_password, db_name, db_host, db_port):
+def load_esxi_data(vrops_token, vrops_host, esxi_metrics_names, esxi_properties_names, esxi_transform, db_username, db_password, db_name, db_host, db_port):
     # get the identifiers for the ESXi Host(vROps)
     esxi_ids = get_vrops_identifiers(vrops_token, vrops_host, resourceKind='HostSystem')
 
+    if vrops_stream_mode:
+        asyncio.run(stream_vrops_data(vrops_token, esxi_ids, vrops_host, esxi_metrics_names, esxi_properties_names, esxi_transform,
+                                      transform_esxi_data, 'HostSystem', esxi_create_table_query, esxi_insert_sql_query, esxi_table_name,
+                                      db_username, db_password, db_name, db_host, db_port, snapshot=('esxi', 'new_fetched_esxi')))
+        return
+
     # fetch metrics and properties for VMWARE (ids)
-    esxi_data = asyncio.run(run_vrops_extraction(vrops_token, esxi_ids, vrops_host, esxi_metrics_names, 40, 'HostSystem'))
+    esxi_data = asyncio.run(run_vrops_extraction(vrops_token, esxi_ids, vrops_host, esxi_metrics_names, vrops_max_concurrent, 'HostSystem',
+                                                 esxi_properties_names, vrops_bulk_mode, vrops_bulk_batch_size,
+                                                 vrops_min_concurrent, vrops_latency_target, vrops_request_timeout,
+                                                 vrops_max_retries, vrops_retry_backoff,
+                                                 vrops_state_path, vrops_property_max_age_hours * 3600, vrops_full_refresh,
+                                                 vrops_static_properties))
 
     # Allow cleanup to finish
     asyncio.sleep(0.5)
 
-    # flatten the result(properties, metrics) into dictionary
-    flatten_esxi_data = flatten_vrops_data(esxi_properties_names, esxi_data, 'HostSystem')
+    # flatten the result(properties, metrics) into columns
+    flatten_esxi_data = flatten_vrops_data(esxi_properties_names + esxi_metrics_names, esxi_data, esxi_transform.source_mapping, 'HostSystem')
 
     # transform and get vmware data as DataFrame
-    df_esxi = transform_esxi_data(flatten_esxi_data, esxi_column_mapping)
+    df_esxi = transform_esxi_data(flatten_esxi_data, esxi_transform)
 
     # load vmware data into mysql server database
     load_vmware_data_into_db(df_esxi, db_username, db_password, db_name, db_host, db_port, esxi_create_table_query, esxi_insert_sql_query)
 
-    # create index on the SD Name column in table
-    create_index(table='ESXi', column='SD_Name', user=db_username, password=db_password, db_name=db_name, host=db_host, port=db_port)
+    # index on the SD Name column is declared in the generated esxi_create_table_query (table_indexes)
+
+
+# Normalize, convert, transform and type each AMPs page (list of records) as it arrives
+# columns of earlier pages missing from a page are added empty (the transforms expect them), and columns first seen
+# in a later page are kept, load_amps_pages_into_db adds them to the table
+def amps_frames(pages, view_type):
+    columns = []
+    for page in pages:
+        df_page = json_normalize(page)
+        columns += [col for col in df_page.columns if col not in columns]
+        df_page = df_page.reindex(columns=columns)
+
+        # convert list type columns into json for databse compatibality
+        df_page = convert_lists_to_json(df_page)
+
+        # Trasnsform AMPs data, then type the page with the schema of the view
+        yield apply_schema(transform_amps_data(df_page, view_type), view_type)
+
+
+# AMPs pages as DataFrames, downloaded while the previous pages are loaded
+def iter_amps_frames(token, view_type):
+    return amps_frames(iter_amps_pages(token, view_type, amps_page_size, amps_max_workers, amps_max_retries), view_type)
 
 
 # Get and load the AMPs data into database table
 def load_amps_data(token, view_type, db_username, db_password, db_name, db_host, db_port):
+    if amps_stream_mode:
+        start_time = time.time()
+        # each page is appended to a staging table while the next pages download
+        load_amps_pages_into_db(iter_amps_frames(token, view_type), view_type, db_username, db_password, db_name, db_host, db_port)
+        end_time = time.time() - start_time
+        logger.info(f'Time Taken to fetch and load data for {view_type}: {end_time}')
+        return
+
     try:
         start_time = time.time() 
         # fetch amps data
-        all_data = fetch_amps_data(token, view_type, 0, 1000)
+        all_data = fetch_amps_data(token, view_type, 0, amps_page_size, amps_max_workers, amps_max_retries)
         time.sleep(1)
         
         if all_data:
-            # make dataframe from the data, once all data fetched
-            df_view = json_normalize(all_data)
-            
-            # convert list type columns into json for databse compatibality
-            df_view = convert_lists_to_json(df_view)
+            # make dataframes from the data page by page, once all data fetched, so the schema types each page
+            # before the next one is normalized (the untyped frame of the whole view is never built)
+            pages = (all_data[offset:offset + amps_page_size] for offset in range(0, len(all_data), amps_page_size))
+            df_view = concat_frames(amps_frames(pages, view_type), ignore_index=True)
+            del all_data, pages
             time.sleep(1)
 
-            # Trasnsform AMPs data
-            df_view = transform_amps_data(df_view, view_type)
-
             # save the data as excel file
             # df_view.to_excel(f'data/processed/{view_type}.xlsx', index=False)
 
@@ -162,10 +310,45 @@ def load_amps_data(token, view_type, db_username, db_password, db_name, db_host,
     except Exception as e:
         logger.info(f'Error while loading amps data for {view_type}: {e}')
 
+# Get and load the DPA data into database table, all servers are looked up, submitted and polled concurrently
+# the servers without a report after the first pass (failed or timed out) are driven through once more, as the sync path does
+def load_dpa_data_async(token, query_values: list, server='avamar_servers'):
+    store = DPAReportStore(dpa_report_dtypes, server)
+    pending_servers = list(query_values)
+    for retry in range(2): # so that it will retry for non fetched servers
+        if retry:
+            logger.info(f'Unfetched servers in {retry} try: {pending_servers}')
+        reports = asyncio.run(run_dpa_extraction(
+            token, pending_servers, max_concurrent=dpa_max_concurrent, max_retries=dpa_max_retries, retry_backoff=dpa_retry_backoff,
+            poll_initial_delay=dpa_poll_initial_delay, poll_max_delay=dpa_poll_max_delay, poll_timeout=dpa_poll_timeout,
+            max_nodes_per_report=dpa_max_nodes_per_report
+        ))
+        store.add_all(reports)
+        # a server is fetched once one of its reports is parsed
+        fetched = {query_value for query_value, _ in store.frames}
+        pending_servers = [i for i in pending_servers if i not in fetched]
+        if not pending_servers:
+            break
+
+    if not store.frames:
+        logger.info(f"No report content retrieved for {query_values}")
+        return None
+    final_df = store.to_frame()
+    if final_df.empty:
+        logger.info(f"No report could be parsed for {query_values}")
+        return None
+    # logging to check which server is not fetched
+    fetched_servers = final_df['Server'].unique()
+    unfetched_servers = [i for i in query_values if i not in fetched_servers]
+    logger.info(f'Unfetched servers: {unfetched_servers}')
+
+    # load data into databae table
+    load_amps_data_into_db(final_df, server, db_username, db_password, db_name, db_host, db_port)
+
 # Get and load the DPA data into database table
 def load_dpa_data(token, query_values: list, server='avamar_servers'):
-    # create a list to store all reports
-    all_reports = []
+    if dpa_async_mode:
+        return load_dpa_data_async(token, query_values, server)
     all_node_ids = [] 
     # Iterate through all the query_values
     for query_value in query_values:
@@ -189,7 +372,7 @@ def load_dpa_data(token, query_values: list, server='avamar_servers'):
         logger.info(f"total node ids: {len(all_node_ids)}")
 
     # generate the report urls for the node_ids
-    report_urls = get_report_url(token, session, all_node_ids)
+    report_urls = get_report_url(token, session, all_node_ids, dpa_max_nodes_per_report)
     logger.info(f"All report urls: {report_urls}")
     
     # only go ahead if having report_urls
@@ -198,64 +381,46 @@ def load_dpa_data(token, query_values: list, server='avamar_servers'):
         return None
 
     
-    # Step 3: Get DPA report content
-    dfs = []
-    for retry in range(2): # so that it will retry for non fetched servers
+    # Step 3: Get DPA report content, a retry only fetches the reports that are still missing
+    store = DPAReportStore(dpa_report_dtypes, server)
+    for retry in range(2): # so that it will retry for non fetched reports
+        pending_urls = store.missing(report_urls)
+        if not pending_urls:
+            break
+        if retry:
+            logger.info(f'Unfetched reports in {retry} try for URLs: {pending_urls}')
         print('try:',retry+1)
         # create session
         session = create_session_with_retries()
-        dpa_reports = get_dpa_report(token, session, report_urls)
+        dpa_reports = get_dpa_report(token, session, pending_urls)
         time.sleep(1)
+        # Step 4: parse the new reports into DataFrames
+        store.add_all(dpa_reports)
+
+    if not store.frames:
+        logger.info(f"No report content retrieved from URLs: {report_urls}")
+        return None
+    final_df = store.to_frame()
+
+    # logging to check which server is not fetched
+    fetched_servers = final_df['Server'].unique()
+    unfetched_servers = [i for i in query_values if i not in fetched_servers]
+    logger.info(f'Unfetched servers: {unfetched_servers}')
 
-        if not dpa_reports:
-            logger.info(f"No report content retrieved from URLs: {report_urls}")
-            return None
-        # Extend fetched reports into all_reports
-        all_reports.extend(dpa_reports)
-    
-        # Step 4: Convert CSV string to DataFrame
-        try:
-            for dpa_report in all_reports: 
-                df = pd.read_csv(StringIO(dpa_report))
-                dfs.append(df)
-            logger.info("Report successfully converted to DataFrame.")
-
-            # Final dataframe
-            final_df = pd.concat(dfs, ignore_index=True)
-            # logger.info(f'Total rows fetched: {final_df.shape[0]}')
-            
-            # logging to check which server is not fetched
-            # get unique servers from generated report
-            fetched_servers = final_df['Server'].unique()
-            unfetched_servers = [i for i in query_values if i not in fetched_servers]
-            logger.info(f'Unfetched servers: {unfetched_servers}')
-            
-            # if its our first try and also having some non fetched servers, we will retry and use only non fetched report urls instead of all
-            if unfetched_servers: 
-                report_urls = [i for i in report_urls if i['query_value'] in unfetched_servers]
-                logger.info(f'Unfetched reports in {retry+1} try for URLs: {report_urls}')
-            else:
-                # if all server fetched, do not retry
-                break
-
-        except Exception as e:
-            logger.info(f"Failed to parse report CSV: {e}")
-            return None
-    
     # Step 5 load data into databae table
     load_amps_data_into_db(final_df, server, db_username, db_password, db_name, db_host, db_port)
     
 # Get and load the NAS data into database table
 def load_nas_data(username, password, file_paths, domain='PGE', table_name='nas_report'):
     # fetch nas data (list of dataframes NAS) 
-    dataframes = fetch_nas_data(username, domain, password, file_paths)
+    dataframes = fetch_nas_data(username, domain, password, file_paths, nas_csv_dtypes, nas_max_workers, nas_local_dir)
     # load master excel file as df to do Vlookup
-    master_df = pd.read_excel('data/raw/NAS/NAS Master sheet.xlsx')
+    master_df = read_excel_cached(nas_master_path, excel_cache_dir)
 
-    nas_data_df = transform_nas_data(dataframes, master_df)
+    nas_data_df = apply_schema(transform_nas_data(dataframes, master_df), table_name)
 
-    # before loading into db, save it as excel file
-    nas_data_df.to_excel('data/processed/nas_data.xlsx', index=False)
+    # before loading into db, save a snapshot of it (written in the background)
+    save_snapshot('nas', 'nas_data', nas_data_df)
 
 
     # load data into databae table
@@ -265,11 +430,18 @@ def load_nas_data(username, password, file_paths, domain='PGE', table_name='nas_
 # Get and load the SAN data into database table
 def load_san_data(aiops_token, ibm_token, ibm_tenant_id, table_name='san_report'):
     # fetch aiops data  
-    aiops_df = fetch_aiops_data(aiops_token)
+    try:
+        aiops_df = fetch_aiops_data(aiops_token, aiops_page_size, aiops_max_workers, aiops_max_retries)
+    except PartialFetchError as e:
+        # a truncated SAN report is only loaded when it is allowed in config
+        if not aiops_allow_partial:
+            raise
+        logger.warning(f'Loading partial AIOPS data ({len(e.data)} rows): {e}')
+        aiops_df = e.data
     # fetch ibm data  
     ibm_df = fetch_ibm_data(ibm_token, ibm_tenant_id)
     # open SAN Master excel file as dataframe
-    master_df = pd.read_excel('data/raw/SAN/SAN Master.xlsx')
+    master_df = read_excel_cached(san_master_path, excel_cache_dir)
     # transform aiops_df
     merged_aiops = transform_aiops_data(aiops_df, master_df)
     # transform ibm_df
@@ -282,50 +454,90 @@ def load_san_data(aiops_token, ibm_token, ibm_tenant_id, table_name='san_report'
         on=['StorageGroupName', 'ServerName', 'SystemDisplayName', 'APP -ID', 'Application Name', 'Total Size (TB)', 'Used (TB)'],
         how='outer'
     )
+    san_df = apply_schema(san_df, table_name)
 
-    # before loading into db, save it as excel file
-    san_df.to_excel('data/processed/san_data.xlsx', index=False)
+    # before loading into db, save a snapshot of it (written in the background)
+    save_snapshot('san', 'san_data', san_df)
 
     # load data into databae table
     load_amps_data_into_db(san_df, table_name, db_username, db_password, db_name, db_host, db_port)
 
-    # create index on the SystemDisplayName column in table
-    create_index(table_name,'SystemDisplayName', db_username, db_password, db_name, db_host, db_port)
+    # index on the SystemDisplayName column is declared at create time (table_indexes)
     
 
 def load_ddboost_data(hostname, port, username, password, script_path, output_path, table_name='ddboost_report'):
     # fetch ddboost data
-    ddboost_df = fetch_ddboost_data(hostname, port, username, password, script_path, output_path)
+    ddboost_df = apply_schema(fetch_ddboost_data(hostname, port, username, password, script_path, output_path), table_name)
     # load into the database table
     load_amps_data_into_db(ddboost_df, table_name, db_username, db_password, db_name, db_host, db_port)
 
-def load_eosl_aaset(file_path, db_username, db_password, db_name, db_host, db_port, table_name = 'EOSL_assets'):
+# check if the file is already loaded into the table: same file hash and same table checksum as after the last load
+def file_load_unchanged(file_path, file_hash, table_name, db_username, db_password, db_name, db_host, db_port):
+    conn = open_load_registry(load_registry_path)
+    try:
+        loaded = get_loaded_file(conn, table_name)
+    finally:
+        conn.close()
+    if loaded is None or loaded['file_hash'] != file_hash:
+        return False
+    if get_table_checksum(table_name, db_username, db_password, db_name, db_host, db_port) != loaded['table_checksum']:
+        logger.info(f'{table_name} changed since it was loaded from {file_path}, reloading')
+        return False
+    return True
+
+# remember the file hash and the table checksum after a successful load
+def record_file_load(file_path, file_hash, table_name, db_username, db_password, db_name, db_host, db_port):
+    table_checksum = get_table_checksum(table_name, db_username, db_password, db_name, db_host, db_port)
+    if table_checksum is None:
+        return
+    conn = open_load_registry(load_registry_path)
+    try:
+        save_loaded_file(conn, table_name, file_path, file_hash, table_checksum)
+    finally:
+        conn.close()
+
+def load_eosl_aaset(file_path, db_username, db_password, db_name, db_host, db_port, table_name = 'EOSL_assets', force=False):
     try:
+        # skip the read and the load when neither the file nor the table changed
+        file_hash = hash_file(file_path)
+        if not force and file_load_unchanged(file_path, file_hash, table_name, db_username, db_password, db_name, db_host, db_port):
+            logger.info(f'{file_path} unchanged since it was loaded into {table_name}, skipping')
+            return
+
         # Load all sheets into a dictionary of DataFrames
         # all_sheets = pd.read_excel('data/raw/Component_Category_COMC_554__Windows.xlsx', sheet_name=None)
-        all_sheets = pd.read_excel(file_path, sheet_name=None)
+        all_sheets = read_excel_sheets(file_path, {**eosl_dtypes, **parser_dtypes(table_name)})
 
         # Concatenate all DataFrames into one
-        merged_df = pd.concat(all_sheets.values(), ignore_index=True)
+        merged_df = concat_frames(all_sheets.values(), ignore_index=True)
 
         # Transformation (creatin new column from existing one)
         merged_df['Short_Version'] = merged_df['Version'].str.split(".").str[:2].str.join(".")
+        merged_df = apply_schema(merged_df, table_name)
 
         
         # load into database
-        load_amps_data_into_db(merged_df, table_name, db_username, db_password, db_name, db_host, db_port)
+        if load_amps_data_into_db(merged_df, table_name, db_username, db_password, db_name, db_host, db_port):
+            record_file_load(file_path, file_hash, table_name, db_username, db_password, db_name, db_host, db_port)
 
     except Exception as e:
         logger.info('Something went wrong while reuploading the EOSL Assets file in Database')
         logger.info(e)
 
-def load_storage(file_path, db_username, db_password, db_name, db_host, db_port, table_name = 'storage_analysis'):
+def load_storage(file_path, db_username, db_password, db_name, db_host, db_port, table_name = 'storage_analysis', force=False):
     try:
+        # skip the read and the load when neither the file nor the table changed
+        file_hash = hash_file(file_path)
+        if not force and file_load_unchanged(file_path, file_hash, table_name, db_username, db_password, db_name, db_host, db_port):
+            logger.info(f'{file_path} unchanged since it was loaded into {table_name}, skipping')
+            return
+
         # load the sheet as dataframe
-        storage_df = pd.read_excel(file_path)
+        storage_df = apply_schema(pd.read_excel(file_path, dtype=parser_dtypes(table_name) or None), table_name)
 
         # load into database
-        load_amps_data_into_db(storage_df, table_name, db_username, db_password, db_name, db_host, db_port)
+        if load_amps_data_into_db(storage_df, table_name, db_username, db_password, db_name, db_host, db_port):
+            record_file_load(file_path, file_hash, table_name, db_username, db_password, db_name, db_host, db_port)
     except Exception as e:
         logger.info('Something went wrong while reuploading the storage analysis file in Database')
         logger.info(e)
@@ -333,56 +545,60 @@ def load_storage(file_path, db_username, db_password, db_name, db_host, db_port,
 
 
 if __name__ == "__main__":
-    # get the token for vROps
-    vrops_token = get_vrops_auth_token(vrops_uname, svc_pwd, vrops_auth_url)
-    
-    logger.info('Initialize data fetching and loading into database for VirtualMachine')
-    load_vmware_data(vrops_token, vrops_host, vmware_metrics_names, vmware_properties_names, vmware_column_mapping, db_username, db_password, db_name, db_host, db_port)
-    
-    # get the token for vROps (We Twice fetched the token, as we dont know the expiry of token)
-    vrops_token = get_vrops_auth_token(vrops_uname, svc_pwd, vrops_auth_url)
-
-    logger.info('Initialize data fetching and loading into database for ESXi Host')
-    load_esxi_data(vrops_token, vrops_host, esxi_metrics_names, esxi_properties_names, esxi_column_mapping, db_username, db_password, db_name, db_host, db_port)
+    parser = argparse.ArgumentParser(description='Extract, transform and load the infrastructure reports')
+    parser.add_argument('--force', action='store_true', help='reload the EOSL assets and storage analysis files even when unchanged')
+    args = parser.parse_args()
+
+    # snapshots of the processed data are written by a background thread
+    configure_snapshots(snapshot_dir, snapshot_format, snapshot_sources)
+    # column types applied to the frames where they are created
+    configure_schemas(table_schemas, schema_category_ratio, table_indexes)
+
+    # tokens are cached per source with their expiry, refreshed ahead of expiry and on 401
+    token_manager = TokenManager(token_refresh_margin)
+    token_manager.register('vrops', lambda session: acquire_vrops_token(vrops_uname, svc_pwd, vrops_auth_url, session), token_default_ttl['vrops'])
+    token_manager.register('amps', lambda session: acquire_amps_token(svc_uname, svc_pwd, amps_login_url, amps_portal_url, session), token_default_ttl['amps'])
+    token_manager.register('aiops', lambda session: acquire_aiops_token(aiops_client_id, aiops_client_secret, aiops_auth_url, session), token_default_ttl['aiops'])
+    token_manager.register('ibm', lambda session: acquire_ibm_token(ibm_api_key, ibm_auth_url, session), token_default_ttl['ibm'])
+
+    vrops_token = token_manager.source('vrops')
+    amps_token = token_manager.source('amps')
+    aiops_token = token_manager.source('aiops')
+    ibm_token = token_manager.source('ibm')
+    dpa_token = get_dpa_token(svc_uname, dell_pwd)
 
+    # Fetch & Load data for DPA (Avamar and PPDM one after another, as both hit the same DPA server)
+    def load_dpa_servers():
+        logger.info('Initialize data fetching and loading into database for Avamar Server')
+        load_dpa_data(dpa_token, avamar_list, 'avamar_servers')
+        logger.info('Initialize data fetching and loading into database for PPDM Server')
+        load_dpa_data(dpa_token, ppdm_list, 'ppdm_servers')
+
+    # every source is an independent task, indexes are declared when the tables are created
+    tasks = [
+        task('vmware', load_vmware_data, vrops_token, vrops_host, vmware_metrics_names, vmware_properties_names, vmware_transform,
+             db_username, db_password, db_name, db_host, db_port),
+        task('esxi', load_esxi_data, vrops_token, vrops_host, esxi_metrics_names, esxi_properties_names, esxi_transform,
+             db_username, db_password, db_name, db_host, db_port),
+        task('dpa', load_dpa_servers),
+        task('nas', load_nas_data, username=svc_uname, password=svc_pwd, file_paths=nas_file_paths, domain='PGE', table_name='nas_report'),
+        task('san', load_san_data, aiops_token, ibm_token, ibm_tenant_id, 'san_report'),
+        task('ddboost', load_ddboost_data, hostname=ddboost_host, port=22, username=svc_uname, password=svc_pwd, script_path=ddboost_script_path,
+             output_path=ddboost_script_output_path, table_name='ddboost_report'),
+        task('eosl_assets', load_eosl_aaset, eosl_asset_file_path, db_username, db_password, db_name, db_host, db_port, 'EOSL_assets',
+             force=args.force),
+        task('storage_analysis', load_storage, storage_analysis_file_path, db_username, db_password, db_name, db_host, db_port, 'storage_analysis',
+             force=args.force),
+    ]
     # Fetch & Load data for desired view_types of AMPs, i.e. view_list = ['view_applications', 'view_database_assets', 'view_it_assets']
     for view_type in amps_view_list:
-        # get token for AMPs
-        amps_token = get_amps_auth_token(svc_uname, svc_pwd, amps_login_url, amps_portal_url)
-
-        logger.info(f'Initialize data fetching and loading into database for AMPs: {view_type}')
-        load_amps_data(amps_token, view_type, db_username, db_password, db_name, db_host, db_port)
-    
-    ## Fetch & Load data for DPA
-    # get dpa-token
-    dpa_token = get_dpa_token(svc_uname, dell_pwd)
-    logger.info('Initialize data fetching and loading into database for Avamar Server')
-    load_dpa_data(dpa_token, avamar_list, 'avamar_servers')
-    logger.info('Initialize data fetching and loading into database for PPDM Server')
-    load_dpa_data(dpa_token, ppdm_list, 'ppdm_servers')
+        tasks.append(task(f'amps_{view_type}', load_amps_data, amps_token, view_type, db_username, db_password, db_name, db_host, db_port))
 
-    # load nas data
-    load_nas_data(username=svc_uname, password=svc_pwd, file_paths=nas_file_paths, domain='PGE', table_name='nas_report')
-    
-    # load san data
-    # get the token for AIOPS
-    aiops_token = get_aiops_auth_token(aiops_client_id, aiops_client_secret, aiops_auth_url)
-    # get the token of Dell
-    ibm_token = get_ibm_auth_token(ibm_api_key, ibm_auth_url)
-
-    logger.info('Initialize data fetching and loading into database for SAN storage')
-    load_san_data(aiops_token, ibm_token, ibm_tenant_id, 'san_report')
-    
-    # Load DDBoost Data
-    logger.info('Initialize data fetching and loading into database for DDBoost report')
-    load_ddboost_data(hostname = ddboost_host, port = 22, username = svc_uname, password = svc_pwd, script_path = ddboost_script_path, output_path = ddboost_script_output_path, table_name = 'ddboost_report')
-    
-    # Load EOSL Assets
-    logger.info('Initialize data fetching and loading into database for EOSL Assests')
-    load_eosl_aaset(eosl_asset_file_path, db_username, db_password, db_name, db_host, db_port, 'EOSL_assets')
-
-    # Load Storage Analysis
-    logger.info('Initialize data fetching and loading into database for Storage Analysis')
-    load_storage(storage_analysis_file_path, db_username, db_password, db_name, db_host, db_port, 'storage_analysis')
-
-   
\ No newline at end of file
+    try:
+        run_tasks(tasks, max_workers=orchestrator_max_workers)
+    finally:
+        # wait for the snapshots still being written (the writer thread is a daemon, so they would be lost
+        # if run_tasks raised or was interrupted)
+        close_snapshots()
+        # size of every table as loaded and peak memory of the process
+        log_memory_report()
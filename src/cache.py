@@ -0,0 +1,68 @@
+import os
+import json
+import hashlib
+import logging
+import pandas as pd
+
+# logging setup
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# sha256 of a file, read in chunks
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# path, size and mtime of a file, the content hash is added when the workbook is (re)converted
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+# Read an Excel sheet through a Parquet copy of it in cache_dir
+# the copy is reused while the workbook has the same size and mtime (or, after a touch/copy, the same content hash)
+# and is memory-mapped on read, it is rebuilt with pd.read_excel when the workbook changed
+def read_excel_cached(path, cache_dir='data/cache', sheet_name=0, **read_kwargs):
+    fingerprint = file_fingerprint(path)
+    key = hashlib.sha1(f"{fingerprint['path']}|{sheet_name}|{sorted(read_kwargs.items())}".encode('utf-8')).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(path))[0]
+    parquet_path = os.path.join(cache_dir, f'{name}.{key}.parquet')
+    meta_path = os.path.join(cache_dir, f'{name}.{key}.json')
+
+    meta = None
+    if os.path.exists(parquet_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    if meta is not None:
+        unchanged = meta['size'] == fingerprint['size'] and meta['mtime'] == fingerprint['mtime']
+        if not unchanged and meta['size'] == fingerprint['size'] and meta['sha256'] == hash_file(path):
+            # same content with a new mtime, keep the copy and remember the new mtime
+            meta['mtime'] = fingerprint['mtime']
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+            unchanged = True
+        if unchanged:
+            try:
+                df = pd.read_parquet(parquet_path, memory_map=True)
+                logger.info(f'Read {path} from cache {parquet_path}')
+                return df
+            except Exception as e:
+                logger.info(f'Cache {parquet_path} unreadable, rebuilding: {e}')
+
+    df = pd.read_excel(path, sheet_name=sheet_name, **read_kwargs)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        df.to_parquet(parquet_path, index=False)
+        with open(meta_path, 'w') as f:
+            json.dump({**fingerprint, 'sha256': hash_file(path), 'sheet_name': sheet_name}, f)
+        logger.info(f'Cached {path} as {parquet_path}')
+    except Exception as e:
+        # e.g. mixed types in a column or pyarrow not installed, the workbook is just read every run
+        logger.info(f'Could not cache {path} as Parquet: {e}')
+    return df
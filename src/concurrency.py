@@ -0,0 +1,190 @@
+import time
+import asyncio
+import threading
+import logging
+import aiohttp
+
+# logging setup
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# check if a failed request means the server is overloaded (5xx, 429, timeout, connection reset)
+def is_throttle_error(error):
+    if isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError)):
+        return True
+    status = getattr(error, 'status', None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+# AIMD (additive increase, multiplicative decrease) limit on in-flight requests
+# the limit grows by one per healthy window (p95 latency and error rate under target),
+# and is halved on 5xx/429/timeouts or an unhealthy window
+class AdaptiveLimiter:
+    def __init__(self, initial=10, minimum=2, maximum=40, latency_target=5.0, max_error_rate=0.05, window=50, name='requests'):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.latency_target = latency_target
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.name = name
+
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+        # current window
+        self._latencies = []
+        self._errors = 0
+        # samples since the last decrease, so a burst of failures only halves the limit once
+        self._since_decrease = maximum
+
+        # run statistics for the summary
+        self.requests = 0
+        self.failures = 0
+        self.decreases = 0
+        self.peak = self.limit
+        self.last_p95 = None
+        self._limit_total = 0
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+        return False
+
+    # record the outcome of one request
+    def record(self, latency, error=None):
+        self.requests += 1
+        self._limit_total += self.limit
+        self._since_decrease += 1
+        self._latencies.append(latency)
+        if error is not None:
+            self.failures += 1
+            self._errors += 1
+
+        if error is not None and is_throttle_error(error):
+            self._decrease(f'{type(error).__name__}: {error}')
+            return
+
+        if len(self._latencies) >= self.window:
+            latencies = sorted(self._latencies)
+            self.last_p95 = latencies[int(0.95 * (len(latencies) - 1))]
+            error_rate = self._errors / len(latencies)
+            self._latencies = []
+            self._errors = 0
+
+            if self.last_p95 <= self.latency_target and error_rate <= self.max_error_rate:
+                self.limit = min(self.maximum, self.limit + 1)
+                self.peak = max(self.peak, self.limit)
+            else:
+                self._decrease(f'p95 {self.last_p95:.2f}s, error rate {error_rate:.1%}')
+
+    def _decrease(self, reason):
+        # only one decrease per round of in-flight requests
+        if self._since_decrease < self.limit:
+            return
+        new_limit = max(self.minimum, self.limit // 2)
+        if new_limit != self.limit:
+            logger.debug(f'{self.name}: reducing concurrency {self.limit} -> {new_limit} ({reason})')
+        self.limit = new_limit
+        self.decreases += 1
+        self._since_decrease = 0
+        self._latencies = []
+        self._errors = 0
+
+    # log the concurrency the run settled on
+    def log_summary(self):
+        average = self._limit_total / self.requests if self.requests else self.limit
+        p95 = f'{self.last_p95:.2f}s' if self.last_p95 is not None else 'n/a'
+        logger.info(
+            f'{self.name}: concurrency settled at {self.limit} (peak {self.peak}, average {average:.1f}, '
+            f'{self.decreases} decreases) over {self.requests} requests, {self.failures} failed, last p95 latency {p95}'
+        )
+
+
+# raised instead of sending a request while the circuit for a host is open
+class CircuitOpenError(Exception):
+    pass
+
+
+# per host circuit breaker: after failure_threshold consecutive overload failures (5xx, 429, timeout, reset)
+# requests to the host fail fast for reset_timeout seconds, then a single probe request decides whether to close it again
+# a breaker is shared by the runs of every orchestrator thread (each in its own event loop), so its state changes under a lock
+class CircuitBreaker:
+    def __init__(self, host, failure_threshold=20, reset_timeout=30.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    # seconds until the open circuit lets a probe through
+    def remaining(self):
+        with self._lock:
+            return self._remaining()
+
+    def _remaining(self):
+        if self.state != 'open':
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_request(self):
+        with self._lock:
+            if self.state == 'open':
+                remaining = self._remaining()
+                if remaining > 0:
+                    raise CircuitOpenError(f'Circuit open for {self.host}, retry in {remaining:.0f}s')
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open':
+                if self._probing:
+                    raise CircuitOpenError(f'Circuit half open for {self.host}, waiting on probe request')
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self.state != 'closed':
+            logger.info(f'Circuit closed for {self.host}')
+        self.state = 'closed'
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self, error):
+        with self._lock:
+            if not is_throttle_error(error):
+                # the host answered (4xx, bad payload), so it is not down
+                if self.state == 'half_open':
+                    self._close()
+                return
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f'Circuit opened for {self.host} after {self.failures} failures ({type(error).__name__}: {error})')
+                    self.times_opened += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+# circuit breakers shared by every extraction run against the same host (runs start from several orchestrator threads)
+circuit_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(host, failure_threshold=20, reset_timeout=30.0):
+    with _breakers_lock:
+        if host not in circuit_breakers:
+            circuit_breakers[host] = CircuitBreaker(host, failure_threshold, reset_timeout)
+        return circuit_breakers[host]
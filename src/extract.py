@@ -4,6 +4,8 @@ import logging
 import asyncio
 import aiohttp
 import time
+import random
+import csv
 import xmltodict
 import pandas as pd
 from pandas import json_normalize
@@ -12,11 +14,15 @@ import warnings
 import urllib3
 from requests.exceptions import RequestException
 from urllib3.exceptions import MaxRetryError
-import win32security
-import win32con
-import win32file, win32net, win32netcon
 import paramiko
 from io import StringIO
+from urllib.parse import urlparse, parse_qs
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from src.utils import create_session_with_retries, resolve_token, request_with_token, TokenSource
+from src.concurrency import AdaptiveLimiter, CircuitOpenError, get_circuit_breaker
+from src.state import open_resource_state, load_fresh_properties, save_properties
+from src.sources import UNCFileSource, LocalDirectorySource, read_csv_files
 
 # Suppress only InsecureRequestWarning
 warnings.simplefilter('ignore', urllib3.exceptions.InsecureRequestWarning)
@@ -27,67 +33,104 @@ warnings.simplefilter('ignore', urllib3.exceptions.InsecureRequestWarning)
 logger = logging.getLogger()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# raised when some pages of a source could not be fetched, carries the rows that were fetched
+# so the caller decides whether a partial load is acceptable
+class PartialFetchError(Exception):
+    def __init__(self, source, data, failed):
+        self.source = source
+        self.data = data
+        self.failed = failed
+        super().__init__(f'{source}: {len(failed)} pages could not be fetched ({sorted(failed)})')
+
+# request refused by an open circuit breaker: it was never sent, so it does not count as an attempt
+def circuit_refused(error):
+    return isinstance(error, CircuitOpenError) or isinstance(error.__cause__, CircuitOpenError)
+
+
+# wait for every request of a resource (so a probe request has finished before the circuit state is checked),
+# then raise the first error, a real failure before a request the open circuit refused
+async def gather_requests(*requests):
+    results = await asyncio.gather(*requests, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        raise next((error for error in errors if not circuit_refused(error)), errors[0])
+    return results
+
+
 # get vrops identifiers
-def get_vrops_identifiers(token, vrops_host, resourceKind='VirtualMachine'):
+# page 0 gives pageInfo.totalCount, the remaining pages are then fetched concurrently over one pooled session
+# token can be a plain token or a TokenSource, which is refreshed on 401
+def get_vrops_identifiers(token, vrops_host, resourceKind='VirtualMachine', page_size=1000, max_workers=8):
 
-    # --- Headers ---
+    # --- Headers --- (Authorization is added by request_with_token)
     headers = {
         'Content-Type': 'application/json',
-        'Authorization': token,  
         'Accept': 'application/json'
     }
-    
-    # Pagination
-    page = 0
-    page_size = 1000
-    all_resources = []
 
-    try:
-        while True:
-            url = f'{vrops_host}/suite-api/api/resources?adapterKind=VMWARE&page={page}&pageSize={page_size}&resourceKind={resourceKind}&_no_links=true'
-            try:
-                # --- Make GET Request ---
-                response = requests.get(url, headers=headers, verify=False)
-                response.raise_for_status()
-            except requests.exceptions.RequestException as e:
-                logger.error(f'Error fetching page {page}: {e}')
-
-            # --- Parse Response ---
-            data = response.json().get('resourceList', [])
-            # data = response.json()
-
-            if not data:
-                    logger.info(f"All pages fetched {resourceKind} ids. Total resources: {len(all_resources)}")
-                    # get all the identifiers
-                    identifiers = [res['identifier'] for res in all_resources if 'identifier' in res]
-                    return identifiers
-                    # return statment will terminate the loop as it will terminate whole function
-            
-            all_resources.extend(data)
-            logger.info(f"Fetched page {page} with {len(data)} resources for {resourceKind} ids")
+    # session retries 429/5xx responses with backoff, a page that still fails raises
+    session = create_session_with_retries()
 
-            # increment page
-            page += 1
-            # if page == 1: # for testing only
-            #         logger.info(f"All pages fetched {resourceKind} ids. Total resources: {len(all_resources)}")
-            #         # get all the identifiers
-            #         identifiers = [res['identifier'] for res in all_resources if 'identifier' in res]
-            #         return identifiers
-            #         # return statment will terminate the loop as it will terminate whole function
+    def fetch_page(page):
+        url = f'{vrops_host}/suite-api/api/resources?adapterKind=VMWARE&page={page}&pageSize={page_size}&resourceKind={resourceKind}&_no_links=true'
+        # --- Make GET Request ---
+        response = request_with_token('GET', url, token, session=session, headers=headers, verify=False)
+        response.raise_for_status()
+        # --- Parse Response ---
+        body = response.json()
+        logger.info(f"Fetched page {page} with {len(body.get('resourceList', []))} resources for {resourceKind} ids")
+        return body
+
+    try:
+        first_page = fetch_page(0)
+        pages = [first_page.get('resourceList', [])]
 
+        total_count = first_page.get('pageInfo', {}).get('totalCount')
+        if total_count is not None:
+            page_count = -(-total_count // page_size)
+            if page_count > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                    # map keeps the page order and re-raises the first failed page
+                    pages.extend(body.get('resourceList', []) for body in pool.map(fetch_page, range(1, page_count)))
+        else:
+            # no pageInfo in the response, walk the pages until a short one
+            page = 1
+            while len(pages[-1]) == page_size:
+                pages.append(fetch_page(page).get('resourceList', []))
+                page += 1
 
+        all_resources = [res for data in pages for res in data]
+        logger.info(f"All pages fetched {resourceKind} ids. Total resources: {len(all_resources)}")
+        # get all the identifiers
+        identifiers = [res['identifier'] for res in all_resources if 'identifier' in res]
+        return identifiers
 
     except Exception as exc:
-         logger.info(f'Something went wrong while getting vrops identifiers: {exc}')
+        logger.error(f'Something went wrong while getting vrops identifiers: {exc}')
+        raise
+    finally:
+        session.close()
     
 
 # Fetch Metrics and properties for the
-async def run_vrops_extraction(token, identifiers, vrops_host, desired_metrics, max_concurrent=40, resourceKind='VirtualMachine'):
-    start_time = time.time()
-
+# bulk=True posts batches of identifiers to the vROps bulk query endpoints (stats/latest/query, properties/latest/query)
+# instead of two GETs per resource, a batch that fails in bulk falls back to the per-resource requests
+# Completed resources are yielded in lists of stream_batch_size, so the caller can transform/load a batch
+# while the next one is still downloading
+# In-flight requests are set by an AdaptiveLimiter between min_concurrent and max_concurrent
+# Resources that fail are queued and re-driven after the main sweep (max_retries rounds, exponential backoff with jitter),
+# and a per host circuit breaker fails requests fast while vROps is down: the work it refuses is deferred without counting
+# an attempt, and re-run once a probe has closed the circuit again
+# With state_path set, the static_properties (name, OS, folder, tags, cluster...) fetched within max_property_age seconds
+# are reused from the local state store, and only the latest stats and the other (volatile) properties are pulled for
+# those resources (full_refresh=True fetches everything again, no static_properties turns the store off)
+async def stream_vrops_extraction(token, identifiers, vrops_host, desired_metrics, max_concurrent=40, resourceKind='VirtualMachine',
+                                  desired_properties=None, bulk=False, batch_size=500, stream_batch_size=1000,
+                                  min_concurrent=4, latency_target=5.0, request_timeout=120, max_retries=3, retry_backoff=5.0,
+                                  state_path=None, max_property_age=86400, full_refresh=False, static_properties=None):
     headers = {
         'Content-Type': 'application/json',
-        'Authorization': token,
+        'Authorization': resolve_token(token),
         'Accept': 'application/json'
     }
 
@@ -100,51 +143,334 @@ async def run_vrops_extraction(token, identifiers, vrops_host, desired_metrics,
     #     'guestfilesystem|capacity_total'
     # ]
 
+    limiter = AdaptiveLimiter(initial=max(min_concurrent, max_concurrent // 4), minimum=min_concurrent, maximum=max_concurrent,
+                              latency_target=latency_target, name=f'vROps {resourceKind}')
+    breaker = get_circuit_breaker(vrops_host)
+
+    # ids that failed in the current sweep, and run statistics for the summary
+    retry_ids = []
+    # work units refused by the open circuit, re-run once it closes
+    deferred = []
+    retried_ids = set()
+    attempts = 0
+
+    # static properties cached in the state store, and the freshly fetched ones waiting to be saved
+    # volatile properties (power state, host, IP, backup tags...) are never cached, they are fetched with the stats
+    static_properties = set(static_properties or [])
+    volatile_properties = [name for name in desired_properties or [] if name not in static_properties]
+    state_conn = open_resource_state(state_path) if state_path and static_properties and desired_properties else None
+    cached_properties = {}
+    if state_conn is not None and not full_refresh:
+        # entries saved before the allowlist can still hold volatile keys
+        cached_properties = {
+            vm_id: [item for item in properties if item['name'] in static_properties]
+            for vm_id, properties in load_fresh_properties(state_conn, resourceKind, max_property_age).items()
+        }
+    fetched_properties = []
+
+    def remember_properties(vm_id, properties):
+        if state_conn is None:
+            return
+        properties = [item for item in properties if item['name'] in static_properties]
+        fetched_properties.append((vm_id, properties))
+        if len(fetched_properties) >= stream_batch_size:
+            save_properties(state_conn, resourceKind, fetched_properties)
+            fetched_properties.clear()
+
+    # every request goes through the circuit breaker and the limiter, which times it and adjusts the concurrency
+    async def request_json(session, method, url, payload=None, reauthenticate=True):
+        breaker.before_request()
+        if isinstance(token, TokenSource) and token.needs_refresh():
+            # refresh ahead of expiry on long runs
+            headers['Authorization'] = await asyncio.to_thread(token.get)
+        async with limiter:
+            start = time.monotonic()
+            stale = headers['Authorization']
+            try:
+                async with session.request(method, url, headers=headers, json=payload, ssl=False) as response:
+                    response.raise_for_status()
+                    body = await response.json()
+            except Exception as e:
+                unauthorized = getattr(e, 'status', None) == 401 and reauthenticate and isinstance(token, TokenSource)
+                if not unauthorized:
+                    limiter.record(time.monotonic() - start, e)
+                    breaker.record_failure(e)
+                    raise
+            else:
+                limiter.record(time.monotonic() - start)
+                breaker.record_success()
+                return body
+
+        # token expired or revoked, log in again (once for all the requests that got the 401) and repeat the request
+        headers['Authorization'] = await asyncio.to_thread(token.refresh, stale)
+        return await request_json(session, method, url, payload, reauthenticate=False)
+
     async def fetch_metrics(session, vm_id):
         url = f'{vrops_host}/suite-api/api/resources/{vm_id}/stats/latest?_no_links=true'
         try:
-            async with session.get(url, headers=headers, ssl=False) as response:
-                response.raise_for_status()
-                metrics = await response.json()
-                des_metrics = [
-                    {'name': st['statKey']['key'], 'value': st['data'][0]}
-                    for st in (metrics.get('values', [{}])[0].get('stat-list', {}).get('stat', []))
-                    if st['statKey']['key'] in desired_metrics   # desired_metrics -> list of metrics 
-                ]
-                return des_metrics
+            metrics = await request_json(session, 'GET', url)
         except Exception as e:
-            logger.error(f"Metrics fetch failed for {vm_id}: {e}")
-            return []
+            raise Exception(f"Metrics fetch failed for {vm_id}: {type(e).__name__} {e}") from e
+        # resources without any samples come back with empty 'values'/'data'
+        des_metrics = [
+            {'name': st['statKey']['key'], 'value': st['data'][0]}
+            for st in ((metrics.get('values') or [{}])[0].get('stat-list', {}).get('stat', []))
+            if st['statKey']['key'] in desired_metrics and st.get('data')   # desired_metrics -> list of metrics 
+        ]
+        return des_metrics
 
     async def fetch_properties(session, vm_id):
         url = f'{vrops_host}/suite-api/api/resources/{vm_id}/properties?_no_links=true'
         try:
-            async with session.get(url, headers=headers, ssl=False) as response:
-                response.raise_for_status()
-                properties = (await response.json()).get('property', [])
-                return properties
+            properties = (await request_json(session, 'GET', url)).get('property', [])
         except Exception as e:
-            logger.error(f"Properties fetch failed for {vm_id}: {e}")
-            return None
+            raise Exception(f"Properties fetch failed for {vm_id}: {type(e).__name__} {e}") from e
+        return properties
 
     async def fetch_vm_data(session, vm_id):
         metrics_task = fetch_metrics(session, vm_id)
         properties_task = fetch_properties(session, vm_id)
-        metrics, properties = await asyncio.gather(metrics_task, properties_task)
+        metrics, properties = await gather_requests(metrics_task, properties_task)
+        remember_properties(vm_id, properties)
         return {
             'vm_id': vm_id,
-            'data': (properties or []) + (metrics or [])
+            'data': properties + metrics
+        }
+
+    # fetch one resource, a failed resource is queued for the retry sweep instead of being dropped
+    async def fetch_resource(session, vm_id):
+        nonlocal attempts
+        try:
+            result = await fetch_vm_data(session, vm_id)
+        except Exception as e:
+            if circuit_refused(e):
+                # not sent, re-run without counting an attempt once the circuit closes
+                deferred.append((fetch_single_data, vm_id))
+                return None
+            attempts += 1
+            logger.error(f"{e}, queued for retry")
+            retry_ids.append(vm_id)
+            return None
+        attempts += 1
+        return result
+
+    async def fetch_bulk_metrics(session, vm_ids):
+        url = f'{vrops_host}/suite-api/api/resources/stats/latest/query?_no_links=true'
+        payload = {'resourceId': vm_ids, 'statKey': desired_metrics}
+        values = (await request_json(session, 'POST', url, payload)).get('values', [])
+        # map resourceId -> [{'name', 'value'}], same shape as fetch_metrics
+        return {
+            value['resourceId']: [
+                {'name': st['statKey']['key'], 'value': st['data'][0]}
+                for st in value.get('stat-list', {}).get('stat', [])
+                if st['statKey']['key'] in desired_metrics and st.get('data')
+            ]
+            for value in values
+        }
+
+    async def fetch_bulk_properties(session, vm_ids, property_keys=None):
+        url = f'{vrops_host}/suite-api/api/resources/properties/latest/query?_no_links=true'
+        payload = {'resourceIds': vm_ids, 'propertyKeys': property_keys or desired_properties}
+        values = (await request_json(session, 'POST', url, payload)).get('values', [])
+        # string properties come back under 'values' and numeric ones under 'data'
+        return {
+            value['resourceId']: [
+                {'name': pc['statKey'], 'value': (pc.get('values') or pc.get('data'))[-1]}
+                for pc in value.get('property-contents', {}).get('property-content', [])
+                if pc.get('values') or pc.get('data')
+            ]
+            for value in values
         }
 
-    async def main():
-        connector = aiohttp.TCPConnector(limit=max_concurrent)
-        async with aiohttp.ClientSession(connector=connector) as session:
-            logger.info(f'Fetching Metrics and properties for {resourceKind}')
-            tasks = [fetch_vm_data(session, vm_id) for vm_id in identifiers]
-            results = await asyncio.gather(*tasks)
-            return [r for r in results if r is not None]
+    async def fetch_batch_data(session, vm_ids):
+        try:
+            metrics, properties = await gather_requests(fetch_bulk_metrics(session, vm_ids), fetch_bulk_properties(session, vm_ids))
+        except Exception as e:
+            if circuit_refused(e):
+                deferred.append((fetch_batch_data, vm_ids))
+                return []
+            logger.error(f"Bulk fetch failed for a batch of {len(vm_ids)} {resourceKind}, falling back to per-resource requests: {e}")
+            return await asyncio.gather(*[fetch_resource(session, vm_id) for vm_id in vm_ids])
+        return bulk_results(vm_ids, properties, metrics)
+
+    # resources left out of a bulk properties response are not cached (nor loaded without properties),
+    # they are queued for the per-resource retry sweep
+    def bulk_results(vm_ids, properties, metrics, cached=None):
+        results = []
+        missing = []
+        for vm_id in vm_ids:
+            if vm_id not in properties:
+                missing.append(vm_id)
+                continue
+            if cached is None:
+                remember_properties(vm_id, properties[vm_id])
+                data = properties[vm_id]
+            else:
+                data = cached[vm_id] + properties[vm_id]
+            results.append({'vm_id': vm_id, 'data': data + metrics.get(vm_id, [])})
+        if missing:
+            logger.error(f"{len(missing)} {resourceKind} missing from the bulk properties response, queued for retry")
+            retry_ids.extend(missing)
+        return results
+
+    async def fetch_single_data(session, vm_id):
+        return [await fetch_resource(session, vm_id)]
+
+    # resources with cached static properties only need their latest stats and volatile properties
+    async def fetch_cached_batch_data(session, vm_ids):
+        try:
+            if volatile_properties:
+                metrics, properties = await gather_requests(fetch_bulk_metrics(session, vm_ids),
+                                                            fetch_bulk_properties(session, vm_ids, volatile_properties))
+            else:
+                metrics, properties = await fetch_bulk_metrics(session, vm_ids), {vm_id: [] for vm_id in vm_ids}
+        except Exception as e:
+            if circuit_refused(e):
+                deferred.append((fetch_cached_batch_data, vm_ids))
+                return []
+            logger.error(f"Bulk stats fetch failed for a batch of {len(vm_ids)} {resourceKind}, falling back to per-resource requests: {e}")
+            return await asyncio.gather(*[fetch_resource(session, vm_id) for vm_id in vm_ids])
+        return bulk_results(vm_ids, properties, metrics, cached_properties)
+
+    async def fetch_cached_single_data(session, vm_id):
+        try:
+            if volatile_properties:
+                metrics, properties = await gather_requests(fetch_metrics(session, vm_id),
+                                                            fetch_bulk_properties(session, [vm_id], volatile_properties))
+            else:
+                metrics, properties = await fetch_metrics(session, vm_id), {vm_id: []}
+        except Exception as e:
+            if circuit_refused(e):
+                deferred.append((fetch_cached_single_data, vm_id))
+                return []
+            # fetch_resource queues it for retry if the full fetch fails as well
+            return [await fetch_resource(session, vm_id)]
+        return bulk_results([vm_id], properties, {vm_id: metrics}, cached_properties)
+
+    cached_ids = [vm_id for vm_id in identifiers if vm_id in cached_properties]
+    refresh_ids = [vm_id for vm_id in identifiers if vm_id not in cached_properties]
+    if state_conn is not None:
+        logger.info(f'{resourceKind}: refreshing properties for {len(refresh_ids)} new/stale resources, '
+                    f'stats only for {len(cached_ids)} cached resources')
+
+    # work units: (fetch function, list of ids) per bulk request, or (fetch function, id) per resource
+    if bulk and desired_properties:
+        logger.info(f'Fetching Metrics and properties for {resourceKind} in bulk (batch size: {batch_size})')
+        units = [(fetch_batch_data, refresh_ids[i:i+batch_size]) for i in range(0, len(refresh_ids), batch_size)]
+        units += [(fetch_cached_batch_data, cached_ids[i:i+batch_size]) for i in range(0, len(cached_ids), batch_size)]
+    else:
+        logger.info(f'Fetching Metrics and properties for {resourceKind}')
+        units = [(fetch_single_data, vm_id) for vm_id in refresh_ids]
+        units += [(fetch_cached_single_data, vm_id) for vm_id in cached_ids]
+
+    connector = aiohttp.TCPConnector(limit=max_concurrent)
+    timeout = aiohttp.ClientTimeout(total=request_timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        pending = asyncio.Queue()
+        # bounded queue gives backpressure, workers wait while the caller is still loading the previous batch
+        completed = asyncio.Queue(maxsize=stream_batch_size)
+
+        async def worker():
+            while not pending.empty():
+                fetch_unit, unit = pending.get_nowait()
+                for result in await fetch_unit(session, unit):
+                    if result is not None:
+                        await completed.put(result)
+
+        async def sweep(units):
+            for unit in units:
+                pending.put_nowait(unit)
+            await asyncio.gather(*[worker() for _ in range(max_concurrent)])
+
+        # re-run the deferred units once the circuit lets requests through again
+        # while it is open, one unit goes alone as the probe (its other requests can be refused and deferred again),
+        # the rest waits for the circuit to close; after max_retries failed probes the deferred ids count as failed
+        async def resume_deferred():
+            failed_probes = 0
+            while deferred:
+                delay = breaker.remaining()
+                if delay:
+                    logger.info(f'Circuit open for {vrops_host}, {len(deferred)} {resourceKind} work units wait {delay:.1f} seconds')
+                    await asyncio.sleep(delay)
+                if breaker.state == 'closed':
+                    resumed = list(deferred)
+                    deferred.clear()
+                    await sweep(resumed)
+                    continue
+                await sweep([deferred.pop(0)])
+                if breaker.state == 'open':
+                    failed_probes += 1
+                    if failed_probes >= max_retries:
+                        failed = [vm_id for _, unit in deferred for vm_id in (unit if isinstance(unit, list) else [unit])]
+                        logger.error(f'Circuit still open for {vrops_host} after {failed_probes} probes, '
+                                     f'{len(failed)} deferred {resourceKind} counted as failed')
+                        retry_ids.extend(failed)
+                        deferred.clear()
+
+        async def produce():
+            nonlocal retry_ids
+            try:
+                await sweep(units)
+                await resume_deferred()
+
+                # re-drive the failed ids one by one, backing off exponentially (with jitter) between sweeps
+                for attempt in range(1, max_retries + 1):
+                    if not retry_ids:
+                        break
+                    failed_ids, retry_ids = retry_ids, []
+                    retried_ids.update(failed_ids)
+                    delay = max(retry_backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5), breaker.remaining())
+                    logger.info(f'Retrying {len(failed_ids)} {resourceKind} in {delay:.1f} seconds (attempt {attempt}/{max_retries})')
+                    await asyncio.sleep(delay)
+                    await sweep([(fetch_single_data, vm_id) for vm_id in failed_ids])
+                    await resume_deferred()
+            finally:
+                # None marks the end of the extraction
+                await completed.put(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            batch = []
+            while True:
+                result = await completed.get()
+                if result is None:
+                    break
+                batch.append(result)
+                if len(batch) >= stream_batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+            # re-raise anything that failed inside the workers
+            await producer
+            limiter.log_summary()
+            logger.info(f'{resourceKind} fetch summary: {len(identifiers)} resources, {attempts} per-resource attempts, '
+                        f'{len(retried_ids)} retried, {len(retry_ids)} permanent failures')
+            if retry_ids:
+                logger.error(f'Permanently failed {resourceKind} ids: {retry_ids}')
+            if state_conn is not None:
+                save_properties(state_conn, resourceKind, fetched_properties)
+        finally:
+            if not producer.done():
+                producer.cancel()
+            if state_conn is not None:
+                state_conn.close()
+
+
+# Fetch Metrics and properties for all identifiers at once (collects stream_vrops_extraction)
+async def run_vrops_extraction(token, identifiers, vrops_host, desired_metrics, max_concurrent=40, resourceKind='VirtualMachine',
+                               desired_properties=None, bulk=False, batch_size=500, min_concurrent=4, latency_target=5.0, request_timeout=120,
+                               max_retries=3, retry_backoff=5.0, state_path=None, max_property_age=86400, full_refresh=False,
+                               static_properties=None):
+    start_time = time.time()
+
+    results = []
+    async for batch in stream_vrops_extraction(token, identifiers, vrops_host, desired_metrics, max_concurrent, resourceKind,
+                                               desired_properties, bulk, batch_size, 1000,
+                                               min_concurrent, latency_target, request_timeout, max_retries, retry_backoff,
+                                               state_path, max_property_age, full_refresh, static_properties):
+        results.extend(batch)
 
-    results = await main()
     elapsed = time.time() - start_time
     logger.info(f"Elapsed time for fetching {resourceKind} : {elapsed:.2f} seconds")
     return results
@@ -186,56 +512,112 @@ def get_amps_view_names(token):
     else:
         print(f"Error: {response.status_code} - {response.text}")
 
-# Fetch AMPs Data
-def fetch_amps_data(token, view_type, skip=0, take=1000):
-    try:
-        skip = 0
-        take = take
-        all_data = []
-        base_url = 'https://amps.cloud.pge.com/axe-platform'
-        
-        # fetch data using pagination (skip, take)
-        while True:
-            # route & header
-            route = f'api/data-lake/v1/dataview/{view_type}?skip={skip}&take={take}'
-            headers = {
-                "Authorization": token,
-                "Content-Type": "application/json"
-                # "Accept": "application/json"
-            }
-            
-            # Construct url
-            url = f"{base_url}/{route}"
-            
+# Iterate over the pages of an AMPs view in order
+# skip-windows are fetched max_workers at a time over one pooled session, a failed window is retried (backoff with jitter)
+# the first response's total (when the API returns one) bounds the windows, otherwise an empty window ends the view
+def iter_amps_pages(token, view_type, take=1000, max_workers=4, max_retries=3):
+    base_url = 'https://amps.cloud.pge.com/axe-platform'
+    # header (Authorization is added by request_with_token)
+    headers = {
+        "Content-Type": "application/json"
+        # "Accept": "application/json"
+    }
+    session = create_session_with_retries()
+
+    def fetch_window(skip):
+        # Construct url
+        url = f"{base_url}/api/data-lake/v1/dataview/{view_type}?skip={skip}&take={take}"
+        for attempt in range(1, max_retries + 1):
             try:
-                # --- Make GET Request ---
-                response = requests.post(url, headers=headers, verify=False)
+                # --- Make POST Request --- (token re-authenticated on 401 when it is a TokenSource)
+                response = request_with_token('POST', url, token, session=session, headers=headers, verify=False)
                 response.raise_for_status()
+                return response.json()
             except requests.exceptions.RequestException as e:
-                logger.error(f'Error fetching data for {view_type}: {e}')
-                
-            
-            # --- Parse Response ---
-            data = response.json().get('data', [])
-            # data = response.json()
-            if not data:
-                    logger.info(f"All data fetched for {view_type}. Total data: {len(all_data)}")
-                    # return all data
-                    return all_data
-            
+                if attempt == max_retries:
+                    raise
+                delay = 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.error(f'Error fetching data for {view_type} (skip {skip}): {e}, retrying in {delay:.1f} seconds ({attempt}/{max_retries})')
+                time.sleep(delay)
+
+    try:
+        first = fetch_window(0)
+        data = first.get('data', [])
+        if not data:
+            return
+        logger.info(f"Fetched {view_type} data 0 - {len(data)}")
+        yield data
+
+        # use the total count when the API returns one
+        total = next((first[key] for key in ('total', 'totalCount', 'count') if isinstance(first.get(key), int)), None)
+        if total is not None:
+            logger.info(f"{view_type} has {total} rows")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            skip = take
+            while total is None or skip < total:
+                skips = [skip + i * take for i in range(max_workers)]
+                if total is not None:
+                    skips = [window for window in skips if window < total]
+                # map keeps the window order and re-raises a window that failed every retry
+                for window, body in zip(skips, pool.map(fetch_window, skips)):
+                    data = body.get('data', [])
+                    if not data:
+                        return
+                    logger.info(f"Fetched {view_type} data {window} - {window + len(data)}")
+                    yield data
+                skip += len(skips) * take
+    finally:
+        session.close()
+
+
+# Fetch AMPs Data
+def fetch_amps_data(token, view_type, skip=0, take=1000, max_workers=4, max_retries=3):
+    try:
+        all_data = []
+        for data in iter_amps_pages(token, view_type, take, max_workers, max_retries):
             all_data.extend(data)
-            logger.info(f"Fetched {view_type} data {skip} - {skip + len(data)}")
-            
-            # increment skip -> skip += 2000
-            skip += take
+        logger.info(f"All data fetched for {view_type}. Total data: {len(all_data)}")
+        # return all data
+        return all_data
     except Exception as exception:
-        logger.info("Something went wrong")
+        logger.info(f"Something went wrong while fetching {view_type}: {exception}")
 
 # Fetch DPA Data
+## node ids from the apollo-api nodes response, 'node' is a list or a single dict
+def parse_node_ids(text):
+    data_dict = xmltodict.parse(text)
+    nodes = data_dict['nodes']['node']
+    if type(nodes) == list:
+        return [node['id'] for node in nodes]
+    return [nodes['id']]
+
+## "Backup All Jobs" report request (last day, CSV) for the given node ids
+def build_report_xml(node_ids):
+    nodes_xml = "".join(f"""
+                    <node>
+                        <id>{node_id}</id>
+                    </node>""" for node_id in node_ids)
+    return f"""
+            <runReportParameters>
+                <report>
+                    <name>Backup All Jobs</name>
+                </report>
+                <nodes>{nodes_xml}
+                </nodes>
+                <timeConstraints type="window">
+                    <window>
+                        <name>Last Day</name>
+                    </window>
+                </timeConstraints>
+                <formatParameters>
+                    <formatType>CSV</formatType>
+                </formatParameters>
+            </runReportParameters>
+            """
+
 ## get node_ids
 def get_node_id(token, session, query_value):
-    # create a list to store node ids
-    node_ids = []
     url = f"https://delldpa.utility.pge.com/apollo-api/nodes/?query=name={query_value}"
     headers = {
         "Content-Type": "application/vnd.emc.apollo-v1+xml",
@@ -246,16 +628,7 @@ def get_node_id(token, session, query_value):
         response = session.get(url, headers=headers, verify=False)
         if response.status_code == 200:
             logger.info(f"Successfully retrieved node_ids for {query_value}")
-            data_dict = xmltodict.parse(response.text)
-            nodes =  data_dict['nodes']['node']
-            if type(nodes) == list:
-                for node in nodes:
-                    node_id = node['id']
-                    node_ids.append(node_id)
-                    
-            else:
-                node_id = nodes['id']
-                node_ids.append(node_id)
+            node_ids = parse_node_ids(response.text)
             return [{'query_value':query_value,'node_ids':node_ids}]
         else:
             logger.info(f"Request failed with status code: {response.status_code}")
@@ -271,7 +644,7 @@ def get_node_id(token, session, query_value):
     return None
 
 ## get report url
-def get_report_url(token, session, node_ids):
+def get_report_url(token, session, node_ids, max_nodes_per_report=1):
     # create a list to store report urls
     report_urls = []
     url = "https://delldpa.utility.pge.com/dpa-api/report"
@@ -280,29 +653,12 @@ def get_report_url(token, session, node_ids):
         "Authorization": token
     }
     
+    size = max(1, max_nodes_per_report)
     for ids in node_ids:
-        for node_id in ids['node_ids']:
+        # one report per max_nodes_per_report nodes of the server
+        for i in range(0, len(ids['node_ids']), size):
             # Properly formatted XML payload
-            xml_body = f"""
-            <runReportParameters>
-                <report>
-                    <name>Backup All Jobs</name>
-                </report>
-                <nodes>
-                    <node>
-                        <id>{node_id}</id>
-                    </node>
-                </nodes>
-                <timeConstraints type="window">
-                    <window>
-                        <name>Last Day</name>
-                    </window>
-                </timeConstraints>
-                <formatParameters>
-                    <formatType>CSV</formatType>
-                </formatParameters>
-            </runReportParameters>
-            """
+            xml_body = build_report_xml(ids['node_ids'][i:i+size])
             
             try:
                 response = session.post(url, headers=headers, data=xml_body, verify=False)
@@ -323,7 +679,7 @@ def get_report_url(token, session, node_ids):
     
     return report_urls
 
-# get dpa report
+# get dpa report, returns [{'query_value', 'report_url', 'report'}] for the fetched reports
 def get_dpa_report(token, session, report_urls):
     # create a list to store xml reports
     xml_reports = []
@@ -339,7 +695,7 @@ def get_dpa_report(token, session, report_urls):
             if response.status_code == 200:
                 logger.info("Successfully retrieved the csv report.")
                 # append the report into list
-                xml_reports.append(response.text)
+                xml_reports.append({**report_url, 'report': response.text})
                 time.sleep(2)
             else:
                 logger.info(f"Request failed with status code: {response.status_code}")
@@ -356,73 +712,284 @@ def get_dpa_report(token, session, report_urls):
     
     return xml_reports
 
+# Async DPA client
+# node lookups, report submissions and report polls run concurrently, at most max_concurrent requests per DPA host
+# DPA answers bursts with 503s and connection resets, so transient failures back off exponentially (with jitter)
+def dpa_transient(status):
+    return status == 429 or status >= 500
+
+async def dpa_request(session, limits, method, url, token, data=None):
+    headers = {
+        "Content-Type": "application/vnd.emc.apollo-v1+xml",
+        "Authorization": token
+    }
+    async with limits[urlparse(url).netloc]:
+        async with session.request(method, url, headers=headers, data=data, ssl=False) as response:
+            return response.status, await response.text()
+
+## send a request, retrying 5xx/429/timeouts/connection errors, returns the body or None
+async def dpa_call(session, limits, method, url, token, expected_status, data=None, max_retries=3, backoff=2.0, action='request'):
+    for attempt in range(1, max_retries + 1):
+        try:
+            status, body = await dpa_request(session, limits, method, url, token, data)
+            if status == expected_status:
+                return body
+            if not dpa_transient(status):
+                logger.info(f"DPA {action} failed with status code {status}")
+                logger.debug(body)
+                return None
+            reason = f"status code {status}"
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            reason = f"{type(e).__name__}: {e}"
+        if attempt < max_retries:
+            delay = backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            logger.info(f"DPA {action} attempt {attempt} failed ({reason}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    logger.info(f"DPA {action} failed after {max_retries} attempts ({reason})")
+    return None
+
+## poll a report until DPA has it ready (200 with content), returns the CSV text or None
+## not ready yet (202/204/empty body) grows the delay by 1.5x, overload (5xx/429/reset) doubles it
+async def poll_dpa_report(session, limits, token, report_url, initial_delay=2.0, max_delay=30.0, timeout=600):
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    polls = 0
+    while True:
+        polls += 1
+        try:
+            status, body = await dpa_request(session, limits, 'GET', report_url, token)
+            if status == 200 and body.strip():
+                logger.info("Successfully retrieved the csv report.")
+                return body
+            if status not in (200, 202, 204) and not dpa_transient(status):
+                logger.info(f"Report request failed with status code: {status}")
+                logger.debug(body)
+                return None
+            factor = 2.0 if dpa_transient(status) else 1.5
+            reason = f"status code {status}"
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            factor = 2.0
+            reason = f"{type(e).__name__}: {e}"
+        if time.monotonic() + delay > deadline:
+            logger.info(f"Report not ready after {polls} polls ({reason}): {report_url}")
+            return None
+        await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+        delay = min(max_delay, delay * factor)
+
+## group (query_value, node_id) pairs into report jobs of at most max_nodes_per_report nodes
+## nodes of a server stay together as long as they fit, so most reports cover few servers
+def group_report_nodes(server_nodes, max_nodes_per_report=1):
+    size = max(1, max_nodes_per_report)
+    return [server_nodes[i:i+size] for i in range(0, len(server_nodes), size)]
+
+## split a multi server report CSV into one CSV (with the header) per server, using the Server column
+## a server matches its query value, or the short host name of it; rows of an unknown server, and rows without a Server
+## value (loaded with a null Server), stay with the first server
+def split_report_by_server(report, servers):
+    reader = csv.reader(StringIO(report))
+    header = next(reader, None)
+    if not header or 'Server' not in header:
+        logger.info(f"DPA report has no Server column, kept for {servers[0]}")
+        return {servers[0]: report}
+    server_index = header.index('Server')
+
+    lookup = {}
+    for query_value in servers:
+        lookup[query_value.lower()] = query_value
+        lookup.setdefault(query_value.lower().split('.')[0], query_value)
+
+    outputs = {query_value: StringIO() for query_value in servers}
+    writers = {query_value: csv.writer(output, lineterminator='\n') for query_value, output in outputs.items()}
+    for writer in writers.values():
+        writer.writerow(header)
+    unknown = set()
+    without_server = 0
+    for row in reader:
+        if not row:
+            continue
+        server = row[server_index].strip().lower() if server_index < len(row) else ''
+        if not server:
+            without_server += 1
+            query_value = servers[0]
+        else:
+            query_value = lookup.get(server) or lookup.get(server.split('.')[0])
+            if query_value is None:
+                unknown.add(server)
+                query_value = servers[0]
+        writers[query_value].writerow(row)
+    if unknown:
+        logger.info(f"DPA report rows for unrequested servers {sorted(unknown)} kept with {servers[0]}")
+    if without_server:
+        logger.info(f"{without_server} DPA report rows without a Server value kept with {servers[0]}")
+    return {query_value: output.getvalue() for query_value, output in outputs.items()}
+
+## look up node ids, submit and poll the reports for every server at the same time
+## with max_nodes_per_report > 1 a report covers up to that many nodes (of one or more servers)
+## returns [{'query_value', 'report_url', 'report'}] for the reports that were fetched
+async def run_dpa_extraction(token, query_values, max_concurrent=4, max_retries=3, retry_backoff=2.0,
+                             poll_initial_delay=2.0, poll_max_delay=30.0, poll_timeout=600, request_timeout=120,
+                             max_nodes_per_report=1, dpa_host='https://delldpa.utility.pge.com'):
+    start_time = time.time()
+    # one bound per DPA host, created inside the running event loop
+    limits = defaultdict(lambda: asyncio.Semaphore(max_concurrent))
+
+    async def get_node_ids(session, query_value):
+        url = f"{dpa_host}/apollo-api/nodes/?query=name={query_value}"
+        body = await dpa_call(session, limits, 'GET', url, token, 200, max_retries=max_retries, backoff=retry_backoff,
+                              action=f'node lookup for {query_value}')
+        if body is None:
+            return []
+        try:
+            return parse_node_ids(body)
+        except Exception as e:
+            logger.info(f"Error occurred while parsing node IDs for {query_value}: {e}")
+            return []
+
+    async def submit_report(session, node_ids):
+        body = await dpa_call(session, limits, 'POST', f"{dpa_host}/dpa-api/report", token, 201, data=build_report_xml(node_ids),
+                              max_retries=max_retries, backoff=retry_backoff, action='report submission')
+        if body is None:
+            return None
+        try:
+            return xmltodict.parse(body)['report']['link']
+        except Exception as e:
+            logger.info(f"Error during report_url request: {e}")
+            return None
+
+    timeout = aiohttp.ClientTimeout(total=request_timeout)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        # Step 1: node ids of every server
+        all_node_ids = await asyncio.gather(*(get_node_ids(session, query_value) for query_value in query_values))
+        server_nodes = []
+        for query_value, node_ids in zip(query_values, all_node_ids):
+            if node_ids:
+                server_nodes.extend((query_value, node_id) for node_id in node_ids)
+            else:
+                logger.info(f"Node IDs not found for :{query_value}")
+        logger.info(f"total node ids: {len(server_nodes)}")
+
+        # Step 2: one report job per group of nodes (nodes of several servers can share a report)
+        groups = group_report_nodes(server_nodes, max_nodes_per_report)
+        report_urls = await asyncio.gather(*(submit_report(session, [node_id for _, node_id in group]) for group in groups))
+        submitted = [(group, report_url) for group, report_url in zip(groups, report_urls) if report_url]
+        logger.info(f"Submitted {len(submitted)}/{len(groups)} DPA reports for {len(server_nodes)} nodes")
+
+        # Step 3: poll every report
+        contents = await asyncio.gather(*(
+            poll_dpa_report(session, limits, token, report_url, poll_initial_delay, poll_max_delay, poll_timeout)
+            for _, report_url in submitted
+        ))
+
+    # split multi server reports back into one report per server
+    reports = []
+    for (group, report_url), content in zip(submitted, contents):
+        if content is None:
+            continue
+        servers = list(dict.fromkeys(query_value for query_value, _ in group))
+        server_reports = {servers[0]: content} if len(servers) == 1 else split_report_by_server(content, servers)
+        reports.extend(
+            {'query_value': query_value, 'report_url': report_url, 'report': report}
+            for query_value, report in server_reports.items()
+        )
+
+    fetched = {report['query_value'] for report in reports}
+    missing = [query_value for query_value in query_values if query_value not in fetched]
+    logger.info(f"Fetched {len(contents) - contents.count(None)} DPA reports for {len(query_values) - len(missing)}/{len(query_values)} servers "
+                f"in {time.time() - start_time:.2f} seconds")
+    if missing:
+        logger.info(f"No DPA report fetched for: {missing}")
+    return reports
+
 # Fetch NAS report
-def fetch_nas_data(username, domain, password, file_paths):
-
-    # we are accessing the files from shared resource network using service account
-    # Logon and impersonate
-    # Logon and impersonate
-    handle = win32security.LogonUser(
-        username,
-        domain,
-        password,
-        win32con.LOGON32_LOGON_NEW_CREDENTIALS,
-        win32con.LOGON32_PROVIDER_WINNT50
-    )
-
-    win32security.ImpersonateLoggedOnUser(handle)
-    # create an empty list to store dataframes
-    dataframes = [] 
-    for file_path in file_paths:
-        # Access UNC path directly
-        # file_path = r"\\smb2.fxnas02.pge.com\techopsautomation-fs01\metadata\fxnas02_filesystems.csv"
-        df = pd.read_csv(file_path)
-        dataframes.append(df)
-
-    # Revert impersonation
-    win32security.RevertToSelf()
-    handle.Close()
+# the share CSVs are read in parallel, only the columns in dtypes (the ones transform_nas_data uses)
+# local_dir reads copies of the files from a local directory instead of the shares
+def fetch_nas_data(username, domain, password, file_paths, dtypes, max_workers=4, local_dir=None):
+    if local_dir:
+        source = LocalDirectorySource(local_dir)
+    else:
+        # we are accessing the files from shared resource network using service account
+        source = UNCFileSource(file_paths, username, domain, password)
+    dataframes = read_csv_files(source, dtypes, max_workers)
     print(f'dataframe length: {len(dataframes)}')
     # return dataframe
     return dataframes
 
 # Fetch AIOPS data for SAN report
-def fetch_aiops_data(token):
+def fetch_aiops_data(token, page_size=500, max_workers=4, max_retries=3):
     logger.info('Data fetching for AIOPS(SAN) Initialized....')
-    # --- Configuration ---
-    offset = 0
+    # --- Headers --- (Authorization is added by request_with_token)
+    headers = {}
+    session = create_session_with_retries()
 
-    # --- Headers ---
-    headers = {
-        'Authorization': token,
-    }
-    all_response = []
-    while True:
-        # fetching 500 entries at a time and increasing offset by 1 till getting the last offset
-        url = f'https://apigtwb2c.us.dell.com/aiops/public/rest/v1/storage-groups?select=name,total_size,allocated_size&limit=500&offset={offset}'
-        # --- Make GET Request ---
-        try:
-            response = requests.get(url, headers=headers, verify=False)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-                # if fails in any iteration, return the data till previous iteration
-                logger.info(f'Error fetching data for AIOPS iteration {offset}: {e}')
-                aiops_df = pd.DataFrame(all_response)
-                # return statment
-                return aiops_df
-
-        basic_info = response.json()
-        # --- Parse Response ---
-        result = basic_info.get('results', [])
-        all_response.extend(result)
-        
-        if basic_info.get('paging',[]).get('next', []):
-            offset += 1
+    def fetch_page(offset):
+        url = f'https://apigtwb2c.us.dell.com/aiops/public/rest/v1/storage-groups?select=name,total_size,allocated_size&limit={page_size}&offset={offset}'
+        for attempt in range(1, max_retries + 1):
+            # --- Make GET Request ---
+            try:
+                response = request_with_token('GET', url, token, session=session, headers=headers, verify=False)
+                response.raise_for_status()
+                return response.json()
+            except requests.exceptions.RequestException as e:
+                if attempt == max_retries:
+                    raise
+                delay = 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.info(f'Error fetching data for AIOPS offset {offset}: {e}, retrying in {delay:.1f} seconds ({attempt}/{max_retries})')
+                time.sleep(delay)
+
+    try:
+        # the first page tells how many pages there are
+        first = fetch_page(0)
+        pages = {0: first.get('results', [])}
+        paging = first.get('paging') or {}
+        last_offset = aiops_last_offset(paging, page_size)
+        failed = {}
+
+        if last_offset is not None:
+            logger.info(f'AIOPS has {last_offset + 1} pages of {page_size} storage groups')
+            offsets = list(range(1, last_offset + 1))
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = {offset: pool.submit(fetch_page, offset) for offset in offsets}
+                for offset, future in futures.items():
+                    try:
+                        pages[offset] = future.result().get('results', [])
+                    except requests.exceptions.RequestException as e:
+                        failed[offset] = str(e)
         else:
-            aiops_df = pd.DataFrame(all_response)
-            # return statment
-            return aiops_df
-        
+            # no page count in the metadata, follow the next links one page at a time
+            offset = 0
+            while paging.get('next'):
+                offset += 1
+                try:
+                    body = fetch_page(offset)
+                except requests.exceptions.RequestException as e:
+                    # the pages after this one are unknown as well
+                    failed[offset] = str(e)
+                    break
+                pages[offset] = body.get('results', [])
+                paging = body.get('paging') or {}
+    finally:
+        session.close()
+
+    all_response = [row for offset in sorted(pages) for row in pages[offset]]
+    aiops_df = pd.DataFrame(all_response)
+    if failed:
+        logger.info(f'AIOPS fetch incomplete, {len(failed)} pages failed: {failed}')
+        raise PartialFetchError('AIOPS storage-groups', aiops_df, failed)
+    logger.info(f'Fetched {len(aiops_df)} AIOPS storage groups in {len(pages)} pages')
+    # return statment
+    return aiops_df
+
+# last page offset from the AIOPS paging metadata (offsets count pages), None when it is not given
+def aiops_last_offset(paging, page_size):
+    for key in ('total_instances', 'total', 'totalCount'):
+        if isinstance(paging.get(key), int):
+            return max(0, -(-paging[key] // page_size) - 1)
+    last = paging.get('last')
+    if isinstance(last, str):
+        offset = parse_qs(urlparse(last).query).get('offset')
+        if offset and offset[0].isdigit():
+            return int(offset[0])
+    return None
 
 
 # Fetch DELL data for SAN report
@@ -430,15 +997,14 @@ def fetch_ibm_data(token, ibm_tenant_id):
     logger.info('Data fetching for IBM(SAN) Initialized....')
     # request URL
     url = f"https://insights.ibm.com/restapi/v1/tenants/{ibm_tenant_id}/hosts"
-    # Header
+    # Header (x-api-token is added by request_with_token)
     headers = {
-        "accept": "application/json",
-        "x-api-token": token
+        "accept": "application/json"
     }
 
     try:
         # make request
-        response = requests.get(url, headers=headers, verify=False)
+        response = request_with_token('GET', url, token, auth_header='x-api-token', headers=headers, verify=False)
         response.raise_for_status()
         # parse response data
         data = response.json().get('data')
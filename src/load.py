@@ -4,6 +4,7 @@ import time
 import logging
 import pandas as pd
 from src.utils import remove_duplicate_cols
+from src.schema import record_memory, get_schema, get_indexes
 
 # setup loggers
 logger = logging.getLogger()
@@ -56,7 +57,220 @@ def load_vmware_data_into_db(df_vmware, user, password, db_name, host, port, cre
             pass
 
 
-# Load AMPs data into database table
+# Create the VMware/ESXi table and keep the connection open, used when loading the data batch by batch
+def create_vrops_table(user, password, db_name, host, port, create_table_query):
+    # Connect to SQL Server
+    conn = pyodbc.connect(
+        f"DRIVER={{SQL Server}};SERVER={host},{port};DATABASE={db_name};UID={user};PWD={password}"
+    )
+    cursor = conn.cursor()
+    logger.info("Connection established.")
+
+    # Create table
+    cursor.execute(create_table_query)
+    conn.commit()
+    logger.info("Table created for vROps batch loading.")
+
+    cursor.fast_executemany = True
+    return conn, cursor
+
+
+# staging copy of a fixed VMware/ESXi query, dbo.{table_name} -> dbo.{table_name}_staging
+def staging_query(query, table_name):
+    return query.replace(f'dbo.{table_name}', f'dbo.{table_name}_staging')
+
+
+# replace dbo.{table_name} with the fully loaded staging table, the old table stays readable until then
+def swap_staging_table(conn, cursor, table_name, staging_name=None):
+    staging_name = staging_name or f'{table_name}_staging'
+    cursor.execute(f"""
+        IF OBJECT_ID('dbo.{table_name}', 'U') IS NOT NULL DROP TABLE dbo.{table_name};
+        EXEC sp_rename 'dbo.{staging_name}', '{table_name}';
+    """)
+    conn.commit()
+
+
+# drop a staging table left by a failed load
+def drop_staging_table(conn, cursor, staging_name):
+    try:
+        conn.rollback()
+        cursor.execute(f"IF OBJECT_ID('dbo.{staging_name}', 'U') IS NOT NULL DROP TABLE dbo.{staging_name};")
+        conn.commit()
+    except Exception as e:
+        logger.info(f"Could not drop {staging_name}: {e}")
+
+
+# Insert one batch of VMware/ESXi rows using an open connection (from create_vrops_table)
+def insert_vrops_batch(conn, cursor, df_batch, insert_sql_query):
+    # Replace NaN with None
+    df_batch = df_batch.where(pd.notnull(df_batch), None)
+    df_batch = df_batch.replace({np.nan: None})
+
+    # Convert to list of tuples (each row is a tuple of native Python types)
+    data = [tuple(row) for row in df_batch.itertuples(index=False, name=None)]
+
+    cursor.executemany(insert_sql_query, data)
+    conn.commit()
+    logger.info(f"Batch insert completed for {len(data)} rows.")
+    return len(data)
+
+
+# pandas dtype -> SQL Server column type, used by the dynamic CREATE TABLE generator when the types are not sized
+# from the data (staged pages, where a later page can hold longer text or larger numbers than the first one)
+sql_types = {
+    "object": "NVARCHAR(MAX)",
+    "category": "NVARCHAR(MAX)",
+    "float64": "FLOAT",
+    "float32": "REAL",
+    "int64": "BIGINT",
+    "int32": "INT",
+    "int16": "SMALLINT",
+    "int8": "SMALLINT",
+    "Int64": "BIGINT",
+    "Int32": "INT",
+    "Int16": "SMALLINT",
+    "Int8": "SMALLINT",
+    "bool": "BIT",
+    "datetime64[ns]": "DATETIME2"
+}
+
+# schema type -> SQL Server column type, when the schema says more than the pandas dtype
+schema_sql_types = {
+    "datetime": "DATETIME2",
+    "date": "DATE"
+}
+
+# integer types from the smallest, with the range they hold
+int_sql_types = [
+    ("TINYINT", 0, 255),
+    ("SMALLINT", -2 ** 15, 2 ** 15 - 1),
+    ("INT", -2 ** 31, 2 ** 31 - 1),
+    ("BIGINT", -2 ** 63, 2 ** 63 - 1)
+]
+# longest NVARCHAR(n), longer text is NVARCHAR(MAX)
+max_nvarchar_length = 4000
+# longest NVARCHAR(n) an index can be declared on (1700 bytes index key)
+max_index_length = 850
+# float columns with at most this many decimals (e.g. sizes rounded to 2) are DECIMAL, FLOAT otherwise
+max_decimal_scale = 4
+
+
+# DECIMAL(p, s) holding every value, None when the values need more decimals (or are not finite)
+def decimal_sql_type(values):
+    if values.size == 0 or not np.isfinite(values).all():
+        return None
+    for scale in range(max_decimal_scale + 1):
+        if np.array_equal(np.round(values, scale), values):
+            precision = len(str(int(np.abs(values).max()))) + scale
+            return f"DECIMAL({precision}, {scale})" if precision <= 38 else None
+    return None
+
+
+# Smallest SQL Server type holding the values of a column: integer range, decimals, date vs datetime, longest text
+# schema_type (from the schema registry) decides for the date and datetime columns
+def sized_sql_type(series, schema_type=None):
+    if schema_type in schema_sql_types:
+        return schema_sql_types[schema_type]
+    values = series.dropna()
+    if pd.api.types.is_bool_dtype(series):
+        return "BIT"
+    if pd.api.types.is_integer_dtype(series):
+        if values.empty:
+            return "INT"
+        low, high = int(values.min()), int(values.max())
+        return next(name for name, min_value, max_value in int_sql_types if min_value <= low and high <= max_value)
+    if pd.api.types.is_float_dtype(series):
+        return decimal_sql_type(values.to_numpy(dtype='float64')) or sql_types.get(str(series.dtype), "FLOAT")
+    if pd.api.types.is_datetime64_any_dtype(series):
+        # only midnights: the column holds dates
+        if not values.empty and (values == values.dt.normalize()).all():
+            return "DATE"
+        return "DATETIME2"
+    # text (object, category): longest value, in UTF-16 code units as NVARCHAR(n) counts them
+    # (a character outside the BMP, like most emoji, is one Python character but takes two)
+    length = int(values.astype(str).str.encode('utf-16-le').str.len().max()) // 2 if not values.empty else 1
+    return f"NVARCHAR({max(length, 1)})" if length <= max_nvarchar_length else "NVARCHAR(MAX)"
+
+
+# an index key cannot be NVARCHAR(MAX) or longer than 1700 bytes
+def indexable(sql_type):
+    if not sql_type.startswith("NVARCHAR("):
+        return True
+    length = sql_type[len("NVARCHAR("):-1]
+    return length != "MAX" and int(length) <= max_index_length
+
+
+# Generate the CREATE TABLE statement (drop if exists) by inspecting the DataFrame structure
+# schema ({lowercased column: type}, from the schema registry) decides the type of the columns it declares,
+# sized: types sized from the data (sized_sql_type), otherwise from the dtype only (sql_types)
+# indexes: columns indexed in the CREATE TABLE itself, so the index exists as soon as the table is loaded
+def generate_create_table_statement(df, table_name, schema=None, indexes=None, sized=True):
+    schema = schema or {}
+    indexed = {str(col).lower() for col in indexes or []}
+    create_stmt = f"IF OBJECT_ID('dbo.{table_name}', 'U') IS NOT NULL DROP TABLE dbo.{table_name};\nCREATE TABLE dbo.{table_name} (\n"
+    index_stmt = ""
+    
+    # Creating create table statement for each 
+    for col in df.columns:
+        schema_type = schema.get(str(col).lower())
+        if sized:
+            sql_type = sized_sql_type(df[col], schema_type)
+        else:
+            sql_type = schema_sql_types.get(schema_type) or sql_types.get(str(df[col].dtype), "NVARCHAR(MAX)")
+        create_stmt += f"    [{col}] {sql_type},\n"
+
+        if str(col).lower() in indexed:
+            indexed.discard(str(col).lower())
+            if indexable(sql_type):
+                index_stmt += f"    INDEX [IX_{table_name}_{col}] ([{col}]),\n"
+            else:
+                logger.info(f"Index on {table_name}.{col} skipped: {sql_type} is too long for an index key")
+    if indexed:
+        logger.info(f"Index columns not in {table_name}: {sorted(indexed)}")
+    create_stmt = (create_stmt + index_stmt).rstrip(",\n") + "\n);"
+    return create_stmt
+
+
+# CREATE TABLE (drop if exists) and INSERT queries for a table with fixed columns, [(column, SQL type)] in table order
+# (the VMware/ESXi tables, from CompiledTransform.sql_columns), indexes are declared in the CREATE TABLE
+def generate_table_queries(columns, table_name, indexes=None):
+    lines = [f"    [{column}] {sql_type}" for column, sql_type in columns]
+    names = [column for column, _ in columns]
+    for column in indexes or []:
+        if column not in names:
+            raise ValueError(f"Index column {column} is not a column of {table_name}")
+        lines.append(f"    INDEX [IX_{table_name}_{column}] ([{column}])")
+    create_table_query = (f"IF OBJECT_ID('dbo.{table_name}', 'U') IS NOT NULL DROP TABLE dbo.{table_name};\n\n"
+                          f"CREATE TABLE dbo.{table_name} (\n" + ",\n".join(lines) + "\n);")
+    insert_sql_query = (f"INSERT INTO dbo.{table_name} ({', '.join(f'[{column}]' for column in names)}) "
+                        f"VALUES ({','.join('?' * len(names))})")
+    return create_table_query, insert_sql_query
+
+
+# Insert the DataFrame rows into the table in chunks (columns in table order)
+def insert_dataframe(conn, cursor, df, table_name, chunk_size=1000):
+    # Replace NaN/NaT/NA with None (as object, so categorical and nullable int columns take None as well)
+    df = df.astype(object).where(pd.notnull(df), None)
+
+    # Convert to list of tuples (each row is a tuple of native Python types)
+    data = [tuple(row) for row in df.itertuples(index=False, name=None)]
+
+    # Prepare insert statement (columns by name, a page does not have to hold every column of the table)
+    placeholders = ",".join(["?"] * len(df.columns))
+    columns = ",".join(f"[{col}]" for col in df.columns)
+    insert_sql = f"INSERT INTO dbo.{table_name} ({columns}) VALUES ({placeholders})"
+
+    # Batch insert
+    cursor.fast_executemany = True
+    for i in range(0, len(data), chunk_size):
+        logger.info(f'range: {i}')
+        chunk = data[i:i+chunk_size]
+        cursor.executemany(insert_sql, chunk)
+        conn.commit()
+    return len(data)
+
+
+# Load AMPs data into database table, returns True when the table was loaded
 def load_amps_data_into_db(df_view, view_name, user, password, db_name, host, port):
     start_time = time.time()
     try:
@@ -72,63 +286,23 @@ def load_amps_data_into_db(df_view, view_name, user, password, db_name, host, po
 
         # remove duplicate columns before creating table
         remove_duplicate_cols(df_view)
+
+        # the frame is typed where it was created (apply_schema), its size as loaded goes to the memory report
+        record_memory(view_name, df_view)
         
-        # Generate CREATE TABLE statement
-        table_name = view_name
-        columns = df_view.columns
-        sql_types = {
-            "object": "NVARCHAR(MAX)",
-            "float64": "FLOAT",
-            "int64": "INT",
-            "bool": "BIT",
-            "datetime64[ns]": "DATETIME"
-        }
-    
-        create_stmt = f"IF OBJECT_ID('dbo.{table_name}', 'U') IS NOT NULL DROP TABLE dbo.{table_name};\nCREATE TABLE dbo.{table_name} (\n"
-        
-        # Creating create table statement for each 
-        for col in columns:
-            dtype = str(df_view[col].dtype)
-            sql_type = sql_types.get(dtype, "NVARCHAR(MAX)")
-            create_stmt += f"    [{col}] {sql_type},\n"
-        create_stmt = create_stmt.rstrip(",\n") + "\n);"
-    
         # Create table
-        cursor.execute(create_stmt)
+        cursor.execute(generate_create_table_statement(df_view, view_name, get_schema(view_name), get_indexes(view_name)))
         conn.commit()
         logger.info("Table created.")
     
-        # Replace NaN with None
-        df_view = df_view.where(pd.notnull(df_view), None)
-        df_view = df_view.replace({np.nan: None})
-    
-        
-        # Convert to list of tuples (each row is a tuple of native Python types)
-        data = [tuple(row) for row in df_view.itertuples(index=False, name=None)]
-    
-        
-        # Prepare insert statement
-        placeholders = ",".join(["?"] * len(columns))
-        insert_sql = f"INSERT INTO dbo.{table_name} VALUES ({placeholders})"
-    
-        
         # Batch insert
-        cursor.fast_executemany = True
-        
-        chunk_size = 1000  # You can adjust this based on available memory
-        for i in range(0, len(data), chunk_size):
-            logger.info(f'range: {i}')
-            chunk = data[i:i+chunk_size]
-            cursor.executemany(insert_sql, chunk)
-            conn.commit()
-    
-        # cursor.executemany(insert_sql, data)
-        # conn.commit()
+        insert_dataframe(conn, cursor, df_view, view_name)
         logger.info("Batch insert completed.")
+        return True
     
     except Exception as e:
         logger.info("Error:", e)
-        
+        return False
     
     finally:
         end_time = time.time() -start_time
@@ -141,29 +315,121 @@ def load_amps_data_into_db(df_view, view_name, user, password, db_name, host, po
             pass
 
 
-# Run Custom Query database table
-def run_custom_query(query, user, password, db_name, host, port):
-    
+# text for a column staged as NVARCHAR: whole floats (ints with nulls in the page) without the '.0', None for nulls
+def as_text(series):
+    def to_text(value):
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+    return series.astype(object).map(to_text, na_action='ignore')
+
+
+# Turn a FLOAT staging column into NVARCHAR(MAX) once a page brings text in it, keeping the rows staged so far
+# (a plain ALTER COLUMN converts floats with 6 significant digits): the staged numbers get the text as_text gives them,
+# the same text as the numbers of the later pages, through a temp table of their distinct values,
+# the column then moves to the end of the table
+def widen_to_text(conn, cursor, staging_name, column):
+    text_column = f'{column}__text'
+    cursor.execute(f"ALTER TABLE dbo.{staging_name} ADD [{text_column}] NVARCHAR(MAX);")
+    cursor.execute(f"SELECT DISTINCT [{column}] FROM dbo.{staging_name} WHERE [{column}] IS NOT NULL;")
+    values = [row[0] for row in cursor.fetchall()]
+    if values:
+        cursor.execute("CREATE TABLE #widen_values (value FLOAT PRIMARY KEY, text NVARCHAR(MAX));")
+        cursor.fast_executemany = True
+        cursor.executemany("INSERT INTO #widen_values (value, text) VALUES (?, ?)",
+                           list(zip(values, as_text(pd.Series(values, dtype='float64')))))
+        cursor.execute(f"""
+            UPDATE staged SET [{text_column}] = widen_values.text
+            FROM dbo.{staging_name} AS staged JOIN #widen_values AS widen_values ON staged.[{column}] = widen_values.value;
+            DROP TABLE #widen_values;
+        """)
+    cursor.execute(f"""
+        ALTER TABLE dbo.{staging_name} DROP COLUMN [{column}];
+        EXEC sp_rename 'dbo.{staging_name}.{text_column}', '{column}', 'COLUMN';
+    """)
+    conn.commit()
+
+
+# Load a view page by page: every DataFrame from frames is appended to dbo.{view_name}_staging as it arrives,
+# and the staging table replaces dbo.{view_name} once every page is loaded (the old table stays readable meanwhile)
+# the table types come from the dtypes of the first frame (not sized from its values, as later pages can hold
+# longer text or larger numbers), and the staging table is widened for what later pages bring:
+# a column first seen in a later page is added, a number column that gets text in a later page becomes NVARCHAR
+def load_amps_pages_into_db(frames, view_name, user, password, db_name, host, port):
+    start_time = time.time()
+    staging_name = f'{view_name}_staging'
+    total_rows = 0
+    conn = cursor = None
     try:
         # Connect to SQL Server
         conn = pyodbc.connect(
             f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={host};DATABASE={db_name};UID={user};PWD={password}"
         )
         cursor = conn.cursor()
-        logger.info("Database Connection established to run custom query.")
-    
-        # Run query
-        cursor.execute(query)
-        conn.commit()
+        logger.info("Database Connection established.")
+
+        # staged column -> 'number' (FLOAT), 'text' (NVARCHAR) or 'other' (BIT, DATETIME2...)
+        column_kinds = None
+        for df_page in frames:
+            # remove duplicate columns before creating table
+            remove_duplicate_cols(df_page)
+
+            # the page is typed where it was created (apply_schema), its size as loaded goes to the memory report
+            record_memory(view_name, df_page)
+
+            if column_kinds is None:
+                # a later page can have nulls in an int column, so numbers are staged as FLOAT
+                column_kinds = {col: column_kind(df_page[col]) for col in df_page.columns}
+                numeric_cols = [col for col, kind in column_kinds.items() if kind == 'number']
+                df_page[numeric_cols] = df_page[numeric_cols].astype(float)
+                cursor.execute(generate_create_table_statement(df_page, staging_name, get_schema(view_name), sized=False))
+                conn.commit()
+                logger.info(f"Staging table created for {view_name}.")
+            else:
+                for col in df_page.columns:
+                    kind = column_kinds.get(col)
+                    if kind is None:
+                        # column first seen in this page
+                        kind = column_kind(df_page[col])
+                        sql_type = "FLOAT" if kind == 'number' else sql_types.get(str(df_page[col].dtype), "NVARCHAR(MAX)")
+                        cursor.execute(f"ALTER TABLE dbo.{staging_name} ADD [{col}] {sql_type};")
+                        conn.commit()
+                        column_kinds[col] = kind
+                        logger.info(f"{view_name}: column {col} first seen after the first page, added as {sql_type}")
+                    elif kind == 'number':
+                        numbers = pd.to_numeric(df_page[col], errors='coerce')
+                        if (numbers.isna() & df_page[col].notna()).any():
+                            # text in a number column: the column becomes text instead of nulling the text
+                            widen_to_text(conn, cursor, staging_name, col)
+                            column_kinds[col] = 'text'
+                            logger.info(f"{view_name}: column {col} has text after the first page, staged as NVARCHAR(MAX)")
+                        else:
+                            df_page[col] = numbers.astype(float)
+
+            # text columns get str values, so numbers in them are not converted by SQL Server (6 significant digits)
+            for col in df_page.columns:
+                if column_kinds[col] == 'text':
+                    df_page[col] = as_text(df_page[col])
+
+            total_rows += insert_dataframe(conn, cursor, df_page, staging_name)
+            logger.info(f"Staged {total_rows} rows for {view_name}")
+
+        if column_kinds is None:
+            logger.info(f"No pages received for {view_name}, table left unchanged.")
+            return
+
+        # Finalize: swap the staging table in
+        swap_staging_table(conn, cursor, view_name, staging_name)
+        logger.info(f"Streaming load completed for {view_name}: {total_rows} rows.")
 
-    
-        logger.info("Query completed.")
-    
     except Exception as e:
-        logger.info("Error:", e)
-        
-    
+        # the view is not loaded at all rather than partially, dbo.{view_name} keeps its previous content
+        logger.error(f"Error while streaming {view_name} into database, table left unchanged: {e}")
+        drop_staging_table(conn, cursor, staging_name)
+
     finally:
+        end_time = time.time() -start_time
+        logger.info(f'Time taken to complete data loading: {end_time}')
         try:
             cursor.close()
             conn.close()
@@ -171,10 +437,46 @@ def run_custom_query(query, user, password, db_name, host, port):
         except:
             pass
 
-# Query to create indexes
-# this will be used for creating the index for the columns as our most of the columns having Max length
-## and we can not create the index for a column with Max length
-def create_index(table, column, user, password, db_name, host, port):
+
+# staged kind of a column: 'number' (staged as FLOAT), 'text' (NVARCHAR) or 'other'
+def column_kind(series):
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return 'number'
+    if series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(series):
+        return 'text'
+    return 'other'
+
+
+# Row count and checksum of a table's content ('rows:checksum'), None when the table does not exist
+# used to notice a table that was changed or reloaded since it was last loaded from a file
+def get_table_checksum(table_name, user, password, db_name, host, port):
+    try:
+        # Connect to SQL Server
+        conn = pyodbc.connect(
+            f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={host};DATABASE={db_name};UID={user};PWD={password}"
+        )
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT OBJECT_ID('dbo.{table_name}', 'U')")
+        if cursor.fetchone()[0] is None:
+            return None
+        cursor.execute(f"SELECT COUNT_BIG(*), CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM dbo.{table_name}")
+        rows, checksum = cursor.fetchone()
+        return f'{rows}:{checksum}'
+
+    except Exception as e:
+        logger.info(f"Error while computing checksum of {table_name}: {e}")
+        return None
+
+    finally:
+        try:
+            cursor.close()
+            conn.close()
+        except:
+            pass
+
+
+# Run Custom Query database table
+def run_custom_query(query, user, password, db_name, host, port):
     
     try:
         # Connect to SQL Server
@@ -182,30 +484,10 @@ def create_index(table, column, user, password, db_name, host, port):
             f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={host};DATABASE={db_name};UID={user};PWD={password}"
         )
         cursor = conn.cursor()
-        logger.info(f"Database Connection established to create index for {table}.{column}")
+        logger.info("Database Connection established to run custom query.")
     
-        # get the max lenght of column
-        len_query = f"""
-                SELECT MAX(LEN([{column}])) AS MaxLength
-                    FROM dbo.{table};
-                """
-        
-        cursor.execute(len_query)
-        max_len = cursor.fetchall()[0][0] if cursor.fetchall()[0][0] > 255 else 255
-
-        # Alter  column with change in its length
-        alter_query = f"""
-        ALTER TABLE dbo.{table}
-        ALTER COLUMN [{column}] VARCHAR({max_len});
-        """
-        cursor.execute(alter_query)
-
-        # create index query
-        create_index_query = f"""
-                CREATE INDEX IX_{table}_{column} ON EOSLdatastore.dbo.{table}([{column}]);
-        """
-        cursor.execute(create_index_query)
-        
+        # Run query
+        cursor.execute(query)
         conn.commit()
 
     
@@ -221,4 +503,4 @@ def create_index(table, column, user, password, db_name, host, port):
             conn.close()
             logger.info(" Connection closed.")
         except:
-            pass
\ No newline at end of file
+            pass
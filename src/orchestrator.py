@@ -0,0 +1,83 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# logging setup
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# Declare a task for run_tasks, it only starts once every task in depends_on has succeeded
+def task(name, func, *args, depends_on=(), **kwargs):
+    return {'name': name, 'func': func, 'args': args, 'kwargs': kwargs, 'depends_on': list(depends_on)}
+
+
+# run one task and time it, a failing task is reported instead of raised
+def run_timed(task_def):
+    start_time = time.time()
+    try:
+        logger.info(f"Task {task_def['name']} started")
+        task_def['func'](*task_def['args'], **task_def['kwargs'])
+        status, error = 'ok', None
+    except Exception as e:
+        logger.exception(f"Task {task_def['name']} failed: {e}")
+        status, error = 'failed', str(e)
+    elapsed = time.time() - start_time
+    logger.info(f"Task {task_def['name']} finished ({status}) in {elapsed:.2f} seconds")
+    return {'status': status, 'seconds': elapsed, 'error': error}
+
+
+# Run the tasks on a thread pool, independent tasks run concurrently (at most max_workers at a time)
+# a failed task only skips the tasks that depend on it, returns {name: {'status', 'seconds', 'error'}}
+def run_tasks(tasks, max_workers=4):
+    start_time = time.time()
+    names = [t['name'] for t in tasks]
+    if len(set(names)) != len(names):
+        raise ValueError(f'Duplicate task names: {names}')
+    for t in tasks:
+        unknown = [dep for dep in t['depends_on'] if dep not in names]
+        if unknown:
+            raise ValueError(f"Task {t['name']} depends on unknown tasks: {unknown}")
+
+    results = {}
+    pending = {t['name']: t for t in tasks}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            # skip tasks whose dependencies failed, repeat until nothing else gets skipped
+            skipped = True
+            while skipped:
+                skipped = False
+                for name, t in list(pending.items()):
+                    failed_deps = [dep for dep in t['depends_on'] if results.get(dep, {}).get('status') in ('failed', 'skipped')]
+                    if failed_deps:
+                        logger.info(f'Task {name} skipped, dependencies did not succeed: {failed_deps}')
+                        results[name] = {'status': 'skipped', 'seconds': 0.0, 'error': f'dependencies failed: {failed_deps}'}
+                        del pending[name]
+                        skipped = True
+
+            # start every task whose dependencies are done
+            for name, t in list(pending.items()):
+                if all(results.get(dep, {}).get('status') == 'ok' for dep in t['depends_on']):
+                    running[pool.submit(run_timed, t)] = name
+                    del pending[name]
+
+            if not running:
+                # what is left only waits on itself (dependency cycle)
+                for name in pending:
+                    logger.error(f'Task {name} skipped, dependency cycle')
+                    results[name] = {'status': 'skipped', 'seconds': 0.0, 'error': 'dependency cycle'}
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    # per task wall time summary
+    total = time.time() - start_time
+    logger.info(f'Run finished in {total:.2f} seconds ({max_workers} workers)')
+    for name in names:
+        result = results[name]
+        logger.info(f"    {name:<20} {result['status']:<8} {result['seconds']:>9.2f}s" + (f"  {result['error']}" if result['error'] else ''))
+    return results
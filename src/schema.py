@@ -0,0 +1,217 @@
+import sys
+import time
+import logging
+import threading
+import psutil
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# logging setup
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# Schema registry: {table: {column: type}}, applied where the frames of a table are created (parser dtypes, per page,
+# per report, right after the builders) so the untyped frame of a whole table is never held in memory
+# types: 'string', 'category' (low cardinality text), 'int' / 'float' (downcast to the smallest type holding the values),
+# 'datetime', 'date' (datetime without the time part, created as DATE)
+# column names are matched case-insensitively, as the loader lowercases them (remove_duplicate_cols)
+schema_types = ('string', 'category', 'int', 'float', 'datetime', 'date')
+
+table_schemas = {}
+# the schemas as declared (column names as in the source files), for the parser dtypes
+declared_schemas = {}
+# {table: [columns]} indexed when the table is created
+table_indexes = {}
+# undeclared text columns with at most this share of distinct values become categoricals (None = off)
+category_ratio = None
+# {table: [rows loaded, bytes untyped, bytes typed]}: rows summed over every frame loaded into the table,
+# sizes summed over every frame apply_schema typed for the table
+memory_report = {}
+_report_lock = threading.Lock()
+
+
+# replace the registry, called once by main.py with the schemas from config.py
+def configure_schemas(schemas, ratio=None, indexes=None):
+    global table_schemas, declared_schemas, category_ratio, table_indexes
+    for table, schema in schemas.items():
+        unknown = {column: column_type for column, column_type in schema.items() if column_type not in schema_types}
+        if unknown:
+            raise ValueError(f'Unknown column types in schema of {table}: {unknown}')
+    table_schemas = {table: {str(column).lower(): column_type for column, column_type in schema.items()} for table, schema in schemas.items()}
+    declared_schemas = schemas
+    category_ratio = ratio
+    table_indexes = indexes or {}
+
+
+# declared {lowercased column: type} of a table, empty when the table has no schema
+def get_schema(table_name):
+    return table_schemas.get(table_name, {})
+
+
+# columns to index when the table is created
+def get_indexes(table_name):
+    return table_indexes.get(table_name, [])
+
+
+# dtype argument for read_csv / read_excel: the text columns of the table parsed straight into their type
+# (a category column is never built as Python strings), numbers and dates are finished by apply_schema
+# pass it to src.utils.read_csv rather than pd.read_csv, which keeps the nulls of 'str' columns under pyarrow
+def parser_dtypes(table_name):
+    parser_types = {'string': 'str', 'category': 'category'}
+    return {column: parser_types[column_type] for column, column_type in declared_schemas.get(table_name, {}).items()
+            if column_type in parser_types}
+
+
+# smallest integer type holding the values, nullable (Int8...) when the column has nulls
+def downcast_int(numbers):
+    if not numbers.isna().any():
+        return pd.to_numeric(numbers, downcast='integer')
+    valid = numbers.dropna()
+    for dtype in ('Int8', 'Int16', 'Int32', 'Int64'):
+        info = np.iinfo(dtype.lower())
+        if valid.empty or (valid.min() >= info.min and valid.max() <= info.max):
+            return numbers.astype(dtype)
+    return numbers
+
+
+# float32 only when every value survives the round trip, so the loaded numbers do not change
+def downcast_float(numbers):
+    numbers = numbers.astype('float64')
+    small = numbers.astype('float32')
+    if np.array_equal(small.to_numpy(dtype='float64'), numbers.to_numpy(), equal_nan=True):
+        return small
+    return numbers
+
+
+# convert one column to its declared type, unparsable values become null
+def convert_column(series, column_type):
+    if column_type == 'string':
+        return series.where(series.isna(), series.astype(str))
+    if column_type == 'category':
+        return series.astype('category')
+    if column_type == 'int':
+        numbers = pd.to_numeric(series, errors='coerce')
+        # fractional values cannot be stored as int, keep them as float
+        if (numbers.dropna() % 1 != 0).any():
+            logger.info(f'Column {series.name} declared int has fractional values, kept as float')
+            return downcast_float(numbers)
+        return downcast_int(numbers)
+    if column_type == 'float':
+        return downcast_float(pd.to_numeric(series, errors='coerce'))
+    if column_type == 'datetime':
+        return pd.to_datetime(series, errors='coerce')
+    if column_type == 'date':
+        return pd.to_datetime(series, errors='coerce').dt.normalize()
+    return series
+
+
+# text column with few distinct values (lists/dicts in a column are left alone)
+def is_low_cardinality(series, ratio):
+    if series.dtype != object or series.empty:
+        return False
+    try:
+        return series.nunique(dropna=True) <= ratio * len(series)
+    except TypeError:
+        return False
+
+
+# bytes of a categorical column read untyped: the object column of its values, counted as memory_usage(deep=True)
+# counts an object column (one pointer and one Python object per row, nulls as float NaN)
+def object_memory(series):
+    codes = series.cat.codes.to_numpy()
+    sizes = np.array([sys.getsizeof(value) for value in series.cat.categories], dtype='int64')
+    valid = codes[codes >= 0]
+    return 8 * len(codes) + int(sizes[valid].sum()) + (len(codes) - len(valid)) * sys.getsizeof(np.nan)
+
+
+# memory_usage(deep=True) of df as it would be without the schema: the columns the parser already read as
+# categoricals (parser_dtypes) are counted as object columns, the others as they are before apply_schema
+def untyped_memory(df):
+    usage = df.memory_usage(deep=True).to_numpy()
+    # usage[0] is the index
+    for position, dtype in enumerate(df.dtypes):
+        if isinstance(dtype, pd.CategoricalDtype):
+            usage[position + 1] = object_memory(df.iloc[:, position])
+    return int(usage.sum())
+
+
+# Apply the schema of table_name to df (in place) and record its size untyped vs typed, returns df
+def apply_schema(df, table_name):
+    start_time = time.time()
+    schema = get_schema(table_name)
+    before = untyped_memory(df)
+
+    for column in df.columns:
+        column_type = schema.get(str(column).lower())
+        if column_type is not None:
+            df[column] = convert_column(df[column], column_type)
+        elif category_ratio and is_low_cardinality(df[column], category_ratio):
+            df[column] = df[column].astype('category')
+
+    after = int(df.memory_usage(deep=True).sum())
+    # tables are typed by several tasks at once
+    with _report_lock:
+        totals = memory_report.setdefault(table_name, [0, 0, 0])
+        totals[1] += before
+        totals[2] += after
+    logger.info(f'Schema applied to {table_name} ({len(df)} rows) in {time.time() - start_time:.2f} seconds: '
+                f'{before / 1024 ** 2:.1f} MB untyped -> {after / 1024 ** 2:.1f} MB')
+    return df
+
+
+# pd.concat that keeps categorical columns categorical: pd.concat turns a column into object as soon as
+# the frames have different categories, so the categories are unioned first
+def concat_frames(frames, **kwargs):
+    frames = list(frames)
+    categorical = {column for df in frames for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)}
+    for column in categorical:
+        try:
+            parts = [df[column] if isinstance(df[column].dtype, pd.CategoricalDtype) else df[column].astype('category')
+                     for df in frames if column in df.columns and df[column].notna().any()]
+            if not parts:
+                continue
+            dtype = pd.CategoricalDtype(union_categoricals(parts, ignore_order=True).categories)
+        except TypeError:
+            # values that can not be categories (lists...), the column ends up object
+            continue
+        for df in frames:
+            if column in df.columns:
+                df[column] = df[column].astype(dtype)
+            else:
+                df[column] = pd.Categorical([None] * len(df), dtype=dtype)
+    return pd.concat(frames, **kwargs)
+
+
+# high-water mark of the process memory in bytes: peak working set on Windows, max RSS elsewhere
+def peak_memory():
+    info = psutil.Process().memory_info()
+    if hasattr(info, 'peak_wset'):
+        return info.peak_wset
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# record the size of a frame as it is loaded into table_name
+def record_memory(table_name, df):
+    size = int(df.memory_usage(deep=True).sum())
+    # tables are loaded by several tasks at once
+    with _report_lock:
+        memory_report.setdefault(table_name, [0, 0, 0])[0] += len(df)
+    logger.info(f'{table_name}: {len(df)} rows, {size / 1024 ** 2:.1f} MB in memory, '
+                f'process peak so far {peak_memory() / 1024 ** 2:.1f} MB')
+
+
+# log the memory saved per table by the schemas (size of the frames untyped vs typed) and the peak memory of the process
+def log_memory_report():
+    total_before = total_after = 0
+    for table, (rows, before, after) in sorted(memory_report.items()):
+        total_before += before
+        total_after += after
+        saved = (1 - after / before) * 100 if before else 0
+        logger.info(f'Memory {table}: {rows} rows, {before / 1024 ** 2:.1f} MB untyped -> {after / 1024 ** 2:.1f} MB ({saved:.0f}% saved)')
+    logger.info(f'Memory all tables: {total_before / 1024 ** 2:.1f} MB untyped -> {total_after / 1024 ** 2:.1f} MB '
+                f'({(total_before - total_after) / 1024 ** 2:.1f} MB saved), process peak: {peak_memory() / 1024 ** 2:.1f} MB')
@@ -0,0 +1,253 @@
+import os
+import time
+import queue
+import logging
+import threading
+import pandas as pd
+
+# logging setup
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# Snapshot writer: the processed DataFrames are exported (parquet, csv or xlsx) by a background thread,
+# so the transforms only pay for a copy of the frame instead of the file write
+# a frame that cannot be written as parquet (e.g. mixed types in a column) falls back to csv
+# streamed snapshots (submit_batch / finish) are written batch by batch into one file, so the batches of a streamed
+# extraction are never held in memory together
+class SnapshotWriter:
+    def __init__(self, directory='data/processed', file_format='xlsx', sources=None, max_pending=4):
+        if file_format not in ('parquet', 'csv', 'xlsx'):
+            raise ValueError(f'Unknown snapshot format: {file_format}')
+        self.directory = directory
+        self.file_format = file_format
+        # {source: False} turns the snapshots of a source off, sources not listed are written
+        self.sources = sources or {}
+        # submit blocks while max_pending snapshots wait, so snapshots cannot pile up in memory
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+        # {name: SnapshotStream} open streamed snapshots, only used by the writer thread
+        self._streams = {}
+        self.written = []
+        self.failed = []
+
+    def enabled(self, source):
+        return self.sources.get(source, True)
+
+    def _put(self, job):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='snapshot-writer', daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+
+    # queue a copy of df to be written as {directory}/{name}.{format}
+    def submit(self, source, name, df):
+        if not self.enabled(source):
+            return
+        # the caller keeps changing its frame after the snapshot
+        self._put(('write', name, df.copy()))
+
+    # queue a copy of df to be appended to the streamed snapshot {directory}/{name}.{format}
+    def submit_batch(self, source, name, df):
+        if not self.enabled(source):
+            return
+        self._put(('append', name, df.copy()))
+
+    # close the streamed snapshot name, keep=False removes it (the streamed extraction failed)
+    def finish(self, source, name, keep=True):
+        if not self.enabled(source):
+            return
+        self._put(('finish' if keep else 'discard', name, None))
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    # streams left open are closed with what they have
+                    for name in list(self._streams):
+                        self._finish(name)
+                    return
+                action, name, df = job
+                if action == 'write':
+                    self._write(name, df)
+                elif action == 'append':
+                    self._append(name, df)
+                else:
+                    self._finish(name, keep=action == 'finish')
+            finally:
+                self._queue.task_done()
+
+    def _write(self, name, df):
+        start_time = time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        file_format = self.file_format
+        try:
+            if file_format == 'parquet':
+                try:
+                    path = os.path.join(self.directory, f'{name}.parquet')
+                    df.to_parquet(path, index=False)
+                except Exception as e:
+                    logger.info(f'Snapshot {name} cannot be written as parquet ({e}), writing csv')
+                    file_format = 'csv'
+            if file_format == 'csv':
+                path = os.path.join(self.directory, f'{name}.csv')
+                df.to_csv(path, index=False)
+            elif file_format == 'xlsx':
+                path = os.path.join(self.directory, f'{name}.xlsx')
+                write_excel(df, path)
+            self.written.append(path)
+            logger.info(f'Snapshot {path} written in {time.time() - start_time:.2f} seconds')
+        except Exception as e:
+            self.failed.append(name)
+            logger.info(f'Failed to write snapshot {name}: {e}')
+
+    def _append(self, name, df):
+        stream = self._streams.get(name)
+        if stream is None:
+            os.makedirs(self.directory, exist_ok=True)
+            stream = self._streams[name] = SnapshotStream(self.directory, name, self.file_format)
+        if stream.failed:
+            return
+        try:
+            stream.append(df)
+        except Exception as e:
+            stream.failed = True
+            logger.info(f'Failed to append to snapshot {name}, the rest of its batches are skipped: {e}')
+
+    def _finish(self, name, keep=True):
+        stream = self._streams.pop(name, None)
+        if stream is None:
+            return
+        try:
+            stream.close()
+        except Exception as e:
+            stream.failed = True
+            logger.info(f'Failed to close snapshot {name}: {e}')
+        if stream.failed or not keep:
+            # a partial snapshot is not left behind
+            if os.path.exists(stream.path):
+                os.remove(stream.path)
+            if stream.failed:
+                self.failed.append(name)
+            return
+        self.written.append(stream.path)
+        logger.info(f'Snapshot {stream.path} written ({stream.rows} rows, {stream.batches} batches)')
+
+    # wait for the queued snapshots and stop the writer thread
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join()
+        logger.info(f'Snapshots written: {len(self.written)}, failed: {self.failed}')
+
+
+# xlsx sheet written row by row with xlsxwriter in constant_memory mode (every row is flushed once the next one starts,
+# so the rows are written in order: pandas' to_excel writes column by column, which loses all but the last column
+# in that mode), openpyxl through pandas otherwise
+class ExcelSheet:
+    def __init__(self, path):
+        try:
+            import xlsxwriter
+        except ImportError:
+            xlsxwriter = None
+        self.rows = 0
+        self._header = False
+        if xlsxwriter is not None:
+            self._book = xlsxwriter.Workbook(path, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+            self._sheet = self._book.add_worksheet()
+            self._writer = None
+        else:
+            self._writer = pd.ExcelWriter(path, engine='openpyxl')
+
+    # write the rows of df after the rows written so far (the header comes from the first frame)
+    def append(self, df):
+        if self._writer is not None:
+            df.to_excel(self._writer, index=False, header=not self._header, startrow=self.rows + 1 if self._header else 0)
+        else:
+            if not self._header:
+                self._sheet.write_row(0, 0, [str(column) for column in df.columns])
+            # nulls (NaN, NaT, NA) as empty cells
+            values = df.astype(object).where(df.notna(), None)
+            for offset, row in enumerate(values.itertuples(index=False, name=None)):
+                self._sheet.write_row(self.rows + 1 + offset, 0, row)
+        self._header = True
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        else:
+            self._book.close()
+
+
+def write_excel(df, path):
+    sheet = ExcelSheet(path)
+    sheet.append(df)
+    sheet.close()
+
+
+# One snapshot file written batch by batch (in order, by the writer thread): csv is appended to, parquet gets a
+# row group per batch (cast to the types of the first batch), xlsx rows are written after the previous batch
+class SnapshotStream:
+    def __init__(self, directory, name, file_format):
+        self.path = os.path.join(directory, f'{name}.{file_format}')
+        self.file_format = file_format
+        self.rows = 0
+        self.batches = 0
+        self.failed = False
+        self._writer = None
+
+    def append(self, df):
+        if self.file_format == 'csv':
+            df.to_csv(self.path, mode='a' if self.batches else 'w', header=not self.batches, index=False)
+        elif self.file_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                # a column with only nulls in the first batch is typed as text, for the values of the later batches
+                # (without the pandas metadata, which would still give the inferred type)
+                schema = pa.schema([field.with_type(pa.string()) if table.column(i).null_count == len(table) else field
+                                    for i, field in enumerate(table.schema)])
+                self._writer = pq.ParquetWriter(self.path, schema)
+            # batches are cast to the types of the file (numbers in a text column become text)
+            self._writer.write_table(table.replace_schema_metadata(None).cast(self._writer.schema))
+        else:
+            if self._writer is None:
+                self._writer = ExcelSheet(self.path)
+            self._writer.append(df)
+        self.rows += len(df)
+        self.batches += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+# writer shared by the transforms and main.py, replaced by configure_snapshots
+snapshot_writer = SnapshotWriter()
+
+def configure_snapshots(directory='data/processed', file_format='xlsx', sources=None, max_pending=4):
+    global snapshot_writer
+    snapshot_writer.close()
+    snapshot_writer = SnapshotWriter(directory, file_format, sources, max_pending)
+    return snapshot_writer
+
+def save_snapshot(source, name, df):
+    snapshot_writer.submit(source, name, df)
+
+# append one batch of a streamed extraction to the snapshot name, finish_snapshot closes it
+def save_snapshot_batch(source, name, df):
+    snapshot_writer.submit_batch(source, name, df)
+
+def finish_snapshot(source, name, keep=True):
+    snapshot_writer.finish(source, name, keep)
+
+def close_snapshots():
+    snapshot_writer.close()
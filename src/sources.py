@@ -0,0 +1,90 @@
+import os
+import glob
+import time
+import logging
+import pandas as pd
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from src.utils import excel_engine, read_csv
+
+# logging setup
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# File sources: paths() lists the files to read, access() is entered around every read (in the reading thread)
+# UNCFileSource reads from network shares as a service account, LocalDirectorySource stands in for it on any OS
+
+# files on UNC shares, read while impersonating the service account
+class UNCFileSource:
+    def __init__(self, file_paths, username, domain, password):
+        self.file_paths = list(file_paths)
+        self.username = username
+        self.domain = domain
+        self.password = password
+
+    def paths(self):
+        return self.file_paths
+
+    # impersonation only applies to the calling thread, so every reading thread logs on by itself
+    @contextmanager
+    def access(self):
+        import win32security
+        import win32con
+        # Logon and impersonate
+        handle = win32security.LogonUser(
+            self.username,
+            self.domain,
+            self.password,
+            win32con.LOGON32_LOGON_NEW_CREDENTIALS,
+            win32con.LOGON32_PROVIDER_WINNT50
+        )
+        win32security.ImpersonateLoggedOnUser(handle)
+        try:
+            yield
+        finally:
+            # Revert impersonation
+            win32security.RevertToSelf()
+            handle.Close()
+
+
+# files in a local directory (copies of the share files, for tests and benchmarks)
+class LocalDirectorySource:
+    def __init__(self, directory, pattern='*.csv'):
+        self.directory = directory
+        self.pattern = pattern
+
+    def paths(self):
+        return sorted(glob.glob(os.path.join(self.directory, self.pattern)))
+
+    @contextmanager
+    def access(self):
+        yield
+
+
+# Read every CSV of a source on a thread pool, only the columns in dtypes and with those types
+# returns the dataframes in the order of source.paths()
+def read_csv_files(source, dtypes, max_workers=4):
+    start_time = time.time()
+
+    def read_file(path):
+        with source.access():
+            return read_csv(path, usecols=list(dtypes), dtype=dtypes)
+
+    paths = source.paths()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(paths)))) as pool:
+        dataframes = list(pool.map(read_file, paths))
+    logger.info(f'Read {len(dataframes)} files ({sum(len(df) for df in dataframes)} rows) in {time.time() - start_time:.2f} seconds')
+    return dataframes
+
+
+# Read every sheet of a workbook, the workbook is opened once and its sheets are parsed one after another
+# (parsing holds the GIL, so threads only add overhead), calamine parses several times faster than openpyxl
+# declared dtypes keep a column the same type in every sheet, returns {sheet_name: DataFrame} in workbook order
+def read_excel_sheets(path, dtypes=None, engine=excel_engine):
+    start_time = time.time()
+    with pd.ExcelFile(path, engine=engine) as book:
+        frames = {sheet_name: book.parse(sheet_name, dtype=dtypes) for sheet_name in book.sheet_names}
+    logger.info(f'Read {len(frames)} sheets ({sum(len(df) for df in frames.values())} rows) of {path} with {engine} '
+                f'in {time.time() - start_time:.2f} seconds')
+    return frames
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+
+# logging setup
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# Open (and create if needed) the local vROps resource state store
+# one row per resource identifier with its last fetched properties, their hash and the fetch time
+def open_resource_state(state_path):
+    os.makedirs(os.path.dirname(state_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(state_path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS resource_state (
+            resource_id TEXT PRIMARY KEY,
+            resource_kind TEXT NOT NULL,
+            property_hash TEXT NOT NULL,
+            properties TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    """)
+    conn.commit()
+    return conn
+
+
+# hash of a resource's properties, independent of the order vROps returns them in
+def hash_properties(properties):
+    content = json.dumps(sorted((item['name'], str(item['value'])) for item in properties))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+# Get cached properties fetched within max_age seconds, {resource_id: [{'name', 'value'}]}
+def load_fresh_properties(conn, resource_kind, max_age):
+    cutoff = time.time() - max_age
+    rows = conn.execute(
+        "SELECT resource_id, properties FROM resource_state WHERE resource_kind = ? AND fetched_at >= ?",
+        (resource_kind, cutoff)
+    ).fetchall()
+    return {resource_id: json.loads(properties) for resource_id, properties in rows}
+
+
+# Save freshly fetched properties, list of (resource_id, [{'name', 'value'}])
+def save_properties(conn, resource_kind, fetched):
+    if not fetched:
+        return 0
+    now = time.time()
+    ids = [resource_id for resource_id, _ in fetched]
+    # sqlite limits the number of bound parameters, so look up the old hashes in chunks
+    old_hashes = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i+500]
+        rows = conn.execute(
+            f"SELECT resource_id, property_hash FROM resource_state WHERE resource_id IN ({','.join('?' * len(chunk))})",
+            chunk
+        ).fetchall()
+        old_hashes.update(rows)
+
+    rows = []
+    changed = 0
+    for resource_id, properties in fetched:
+        property_hash = hash_properties(properties)
+        if resource_id in old_hashes and old_hashes[resource_id] != property_hash:
+            changed += 1
+        rows.append((resource_id, resource_kind, property_hash, json.dumps(properties), now))
+
+    conn.executemany("""
+        INSERT INTO resource_state (resource_id, resource_kind, property_hash, properties, fetched_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(resource_id) DO UPDATE SET
+            resource_kind = excluded.resource_kind,
+            property_hash = excluded.property_hash,
+            properties = excluded.properties,
+            fetched_at = excluded.fetched_at
+    """, rows)
+    conn.commit()
+    new = len([resource_id for resource_id in ids if resource_id not in old_hashes])
+    logger.info(f'Saved properties for {len(rows)} {resource_kind} resources ({new} new, {changed} changed)')
+    return len(rows)
+
+
+# Open (and create if needed) the registry of files loaded into tables
+# one row per table with the hash of the file it was loaded from and the table checksum right after the load
+def open_load_registry(registry_path):
+    os.makedirs(os.path.dirname(registry_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(registry_path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS loaded_files (
+            table_name TEXT PRIMARY KEY,
+            file_path TEXT NOT NULL,
+            file_hash TEXT NOT NULL,
+            table_checksum TEXT NOT NULL,
+            loaded_at REAL NOT NULL
+        )
+    """)
+    conn.commit()
+    return conn
+
+
+# Get the last load of a table, {'file_path', 'file_hash', 'table_checksum', 'loaded_at'} or None
+def get_loaded_file(conn, table_name):
+    row = conn.execute(
+        "SELECT file_path, file_hash, table_checksum, loaded_at FROM loaded_files WHERE table_name = ?",
+        (table_name,)
+    ).fetchone()
+    if row is None:
+        return None
+    return dict(zip(('file_path', 'file_hash', 'table_checksum', 'loaded_at'), row))
+
+
+# Record a successful load of file_path into table_name
+def save_loaded_file(conn, table_name, file_path, file_hash, table_checksum):
+    conn.execute("""
+        INSERT INTO loaded_files (table_name, file_path, file_hash, table_checksum, loaded_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(table_name) DO UPDATE SET
+            file_path = excluded.file_path,
+            file_hash = excluded.file_hash,
+            table_checksum = excluded.table_checksum,
+            loaded_at = excluded.loaded_at
+    """, (table_name, file_path, file_hash, table_checksum, time.time()))
+    conn.commit()
@@ -2,129 +2,248 @@ import numpy as np
 import pandas as pd
 import json
 import logging
-from src.utils import convert_into_tb
+from io import StringIO
+from src.utils import read_csv
+from src.units import to_tb, unit_bytes
+from src.snapshots import save_snapshot
+from src.schema import apply_schema, parser_dtypes, concat_frames
 
 # setup loggers
 logger = logging.getLogger()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# transform VSphere data
-def transform_vsphere_string(st):
-    try:
-        st = json.loads(st)
-        return [f"<{i['category']}-{i['name']}>" for i in st]
-    except:
-        return "none"
-
-# Convert each VM's property list into dictionary
-def flatten_vrops_data(metric_names, results, resourceKind='VirtualMachine'):
-    # Flatten the data
-    flattened_data = []
-    # for vm_props in res:
-    logger.info('Start flattening the data for {resourceKind}')
-    for vm_props in results:
-        # if item['data'][0]['name'] in metric_names:
-        vm_dict = {item['name']: item['value'] for item in vm_props['data'] if item['name'] in metric_names} 
-        flattened_data.append(vm_dict)
-    
-    # return flatten data
-    return flattened_data
-
-# Transform Virtual Machine Data
-def transform_vmware_data(flatten_vmware_data, vmware_column_mapping):
-    logger.info('Start Transforming VirtualMachine data')
-    # convert the data into dataframe
-    df_vmware = pd.DataFrame(flatten_vmware_data)
-
-    # rename columns
-    df_vmware.rename(columns=vmware_column_mapping, inplace=True)
-    
-    # preserve order
-    df_vmware = df_vmware[vmware_column_mapping.values()]
-
-    # apply transformation on vSphere
-    df_vmware['Vsphere Tags'] = df_vmware['Vsphere'].apply(transform_vsphere_string)
-    df_vmware.drop(columns = ['Vsphere'], inplace=True)
+# orjson decodes several times faster than json, used when it is installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
-    # Memory in KB, converting in MB
-    df_vmware["Memory"] = df_vmware['Memory'].astype(float) / (1024**2)
 
-    # Convert Memory Utilization from GB to TB
-    df_vmware['Memory Utilization'] = round(df_vmware['Memory Utilization'].astype(float) / (1024**2), 2)
+# decode every tag payload with a single JSON call (as one array), falls back to decoding them one by one
+# when a payload is not valid JSON (that payload gives None)
+def decode_tag_payloads(payloads):
+    if not payloads:
+        return []
+    try:
+        decoded = json_loads('[' + ','.join(payloads) + ']')
+        if len(decoded) == len(payloads):
+            return decoded
+    except ValueError:
+        pass
+    decoded = []
+    for payload in payloads:
+        try:
+            decoded.append(json_loads(payload))
+        except ValueError:
+            decoded.append(None)
+    return decoded
+
+
+# vROps resource id of every resource, carried by flatten_vrops_data next to the spec sources (it is not a table column)
+resource_id_column = 'Resource ID'
+
+
+# transform VSphere data: the tag JSON of every VM into its DB form "['<category-name>', ...]" ("none" when it can not be parsed)
+# with resource_ids, also returns the tags as a normalized (Resource ID, [labels.name], Category, Tag) frame keyed on
+# the resource id (unique and never null, unlike the VM name), labels is an optional column copied next to it; otherwise None
+def parse_vsphere_tags(tag_json, resource_ids=None, labels=None):
+    values = tag_json.tolist()
+    positions = [i for i, value in enumerate(values) if isinstance(value, str)]
+    db_tags = ['none'] * len(values)
+    ids = resource_ids.tolist() if resource_ids is not None else None
+    label_values = labels.tolist() if labels is not None else None
+    rows = []
+
+    for i, tags in zip(positions, decode_tag_payloads([values[i] for i in positions])):
+        if not isinstance(tags, list):
+            continue
+        try:
+            db_tags[i] = str([f"<{tag['category']}-{tag['name']}>" for tag in tags])
+        except (TypeError, KeyError):
+            continue
+        if ids is not None:
+            key = (ids[i], label_values[i]) if label_values is not None else (ids[i],)
+            rows.extend(key + (tag['category'], tag['name']) for tag in tags)
+
+    tags_df = None
+    if ids is not None:
+        columns = [resource_id_column] + ([labels.name] if labels is not None else []) + ['Category', 'Tag']
+        tags_df = pd.DataFrame(rows, columns=columns)
+    return pd.Series(db_tags, index=tag_json.index, dtype=object), tags_df
+
+# Flatten each resource's property list straight into columns
+# column_mapping gives the columns (vROps key -> final column name, in table order), a key not in metric_names stays empty
+# returns {final column name: list of values}, one value per resource (NaN when the resource has no such property)
+# plus the vROps id of every resource under resource_id_column
+def flatten_vrops_data(metric_names, results, column_mapping, resourceKind='VirtualMachine'):
+    logger.info(f'Start flattening the data for {resourceKind}')
+    wanted = set(metric_names)
+    # vROps key -> column position
+    column_index = {key: i for i, key in enumerate(column_mapping) if key in wanted}
+    columns = [[np.nan] * len(results) for _ in column_mapping]
+
+    for row, vm_props in enumerate(results):
+        for item in vm_props['data']:
+            i = column_index.get(item['name'])
+            if i is not None:
+                columns[i][row] = item['value']
 
-    # total disk in GB converting into TB
-    df_vmware['Total Disk Space'] = round(df_vmware['Total Disk Space'].astype(float) / 1024, 2)
+    # return flatten data
+    flatten_data = dict(zip(column_mapping.values(), columns))
+    flatten_data[resource_id_column] = [vm_props.get('vm_id') for vm_props in results]
+    return flatten_data
+
+# Transform specs (vmware_transform_spec / esxi_transform_spec in config.py), one entry per output column in table order:
+#   column: output column name
+#   source: vROps key the column is read from (several columns can read the same key)
+#   dtype: 'float' converts the values to numbers (unparsable values become null), implied by the numeric steps below
+#   sql_type: column type in the generated table, FLOAT for numeric columns and NVARCHAR(255) otherwise by default
+#   split: (separator, index) keeps one part of a delimited string
+#   parse: name of a column parser (column_parsers), its frame is keyed on the vROps resource id,
+#   label: output column copied into the parser's frame next to the resource id
+#   minus: output column subtracted from the value, unit: (from, to) storage unit conversion,
+#   scale: divide by this number, round: decimals (applied in this order)
+column_parsers = {
+    'vsphere_tags': parse_vsphere_tags
+}
+spec_keys = {'column', 'source', 'dtype', 'split', 'parse', 'label', 'minus', 'unit', 'scale', 'round', 'sql_type'}
+numeric_keys = ('minus', 'unit', 'scale', 'round')
+spec_dtypes = ('float',)
+
+
+# one part of a delimited string, null for anything else (same as .str.split(separator).str[index])
+def split_part(value, separator, index):
+    if not isinstance(value, str):
+        return np.nan
+    parts = value.split(separator)
+    return parts[index] if -len(parts) <= index < len(parts) else np.nan
+
+
+# spec entry producing numbers
+def is_numeric_entry(entry):
+    return entry.get('dtype') == 'float' or any(key in entry for key in numeric_keys)
+
+
+# compile one spec entry into a function building the column from the flattened source columns
+def compile_column(entry, previous_columns):
+    unknown = set(entry) - spec_keys
+    if unknown or 'column' not in entry:
+        raise ValueError(f'Invalid transform spec entry {entry}: unknown keys {unknown}' if unknown else f'Transform spec entry without column: {entry}')
+    for key in ('minus', 'label'):
+        if key in entry and entry[key] not in previous_columns:
+            raise ValueError(f"Transform spec {entry['column']}: {key} column {entry[key]} must come before it")
+    for unit in entry.get('unit', ()):
+        if unit not in unit_bytes:
+            raise ValueError(f"Transform spec {entry['column']}: unknown unit {unit}")
+    if entry.get('dtype') not in (None,) + spec_dtypes:
+        raise ValueError(f"Transform spec {entry['column']}: unknown dtype {entry['dtype']} (known: {spec_dtypes})")
+    if 'parse' in entry and entry['parse'] not in column_parsers:
+        raise ValueError(f"Transform spec {entry['column']}: unknown parser {entry['parse']} (known: {sorted(column_parsers)})")
+
+    source = entry.get('source')
+    parser = column_parsers[entry['parse']] if 'parse' in entry else None
+    numeric = is_numeric_entry(entry)
+
+    def build(source_columns, out, rows, frames):
+        values = source_columns[source] if source in source_columns else [np.nan] * rows
+        if parser is not None:
+            if frames is None:
+                parsed, _ = parser(pd.Series(values, dtype=object))
+                return parsed.tolist()
+            resource_ids = pd.Series(source_columns.get(resource_id_column, [np.nan] * rows), dtype=object)
+            labels = pd.Series(out[entry['label']], name=entry['label']) if 'label' in entry else None
+            parsed, frames[entry['column']] = parser(pd.Series(values, dtype=object), resource_ids, labels)
+            return parsed.tolist()
+        if 'split' in entry:
+            separator, index = entry['split']
+            values = [split_part(value, separator, index) for value in values]
+        if not numeric:
+            return values
+
+        # numeric steps work in place on one float array
+        array = np.asarray(pd.to_numeric(values, errors='coerce'), dtype='float64')
+        if 'minus' in entry:
+            np.subtract(array, out[entry['minus']], out=array)
+        if 'unit' in entry:
+            from_unit, to_unit = entry['unit']
+            np.multiply(array, float(unit_bytes[from_unit]), out=array)
+            np.divide(array, float(unit_bytes[to_unit]), out=array)
+        if 'scale' in entry:
+            np.divide(array, float(entry['scale']), out=array)
+        if 'round' in entry:
+            np.round(array, entry['round'], out=array)
+        return array
+
+    return build
+
+
+# Transform spec compiled once per resource kind: every output column is built straight from the flattened
+# source columns and the DataFrame is created once, in table order
+# available: the vROps keys that are fetched (properties and metrics), a source outside them would stay empty
+# sql_columns: (column, SQL type) in table order, the generated table and insert follow the spec (generate_table_queries)
+class CompiledTransform:
+    def __init__(self, spec, resourceKind, available=None):
+        self.resourceKind = resourceKind
+        self.columns = []
+        self.steps = []
+        self.sql_columns = []
+        for entry in spec:
+            if entry.get('column') in self.columns:
+                raise ValueError(f"Transform spec for {resourceKind}: column {entry['column']} is defined twice")
+            self.steps.append((entry['column'], compile_column(entry, self.columns)))
+            self.columns.append(entry['column'])
+            self.sql_columns.append((entry['column'], entry.get('sql_type') or ('FLOAT' if is_numeric_entry(entry) else 'NVARCHAR(255)')))
+        # vROps key -> key, the columns flatten_vrops_data has to produce for this transform
+        self.source_mapping = {entry['source']: entry['source'] for entry in spec if 'source' in entry}
+        if available is not None:
+            missing = [source for source in self.source_mapping if source not in set(available)]
+            if missing:
+                raise ValueError(f'Transform spec for {resourceKind} reads keys that are not fetched '
+                                 f'(add them to the properties or metrics names): {missing}')
+
+    # returns (DataFrame, {column: frame}), the frames of the parsed columns are only built when frames is True
+    def __call__(self, source_columns, frames=False):
+        rows = len(next(iter(source_columns.values()), []))
+        out = {}
+        parsed_frames = {} if frames else None
+        for column, build in self.steps:
+            out[column] = build(source_columns, out, rows, parsed_frames)
+        return pd.DataFrame(out, columns=self.columns), parsed_frames or {}
+
+
+def compile_transform_spec(spec, resourceKind='VirtualMachine', available=None):
+    return CompiledTransform(spec, resourceKind, available)
 
-    # Disk Space/Utilization in GB converting into TB
-    df_vmware['Disk Utlization (TB)'] = round(df_vmware['Disk Utlization (TB)'].astype(float) / 1024, 2)
 
-    # Calculate disk capacity remaining and convert into TB(from GB)
-    df_vmware['Disk Capacity'] = df_vmware['Disk Capacity'] - df_vmware['Disk Utlization (TB)'] 
-    df_vmware['Disk Capacity'] = round(df_vmware['Disk Capacity'] / 1024, 2) # convvert into tb
-    df_vmware.rename(columns={"Disk Capacity": "Disk Capacity Remaining"}, inplace=True)
+# Transform Virtual Machine Data
+# every column is built by the compiled vmware_transform_spec
+# with tags_frame, returns (df_vmware, tags_df) where tags_df has one (Resource ID, VM Name, Category, Tag) row per vSphere tag
+def transform_vmware_data(flatten_vmware_data, vmware_transform, snapshot=True, tags_frame=False):
+    logger.info('Start Transforming VirtualMachine data')
+    df_vmware, frames = vmware_transform(flatten_vmware_data, frames=tags_frame)
 
-    # round off CPU usage
-    df_vmware['CPU Usage'] =  round(df_vmware['CPU Usage'], 4)
-    
-    # Save as Excel file
-    # Save the data as excel file
-    df_vmware.to_excel('data/processed/new_fetched_vm.xlsx', index=False)
-    logger.info("VirtualMachine Data Saved as Excel File")
+    # Save a snapshot of the data, written in the background (skipped for streamed batches, as each batch would overwrite the file)
+    if snapshot:
+        save_snapshot('vmware', 'new_fetched_vm', df_vmware)
     
-    # Change type for Vsphere type (For DB loading only, as list type not supported in sql server)
-    df_vmware['Vsphere Tags'] =  df_vmware['Vsphere Tags'].astype(str)
     logger.info("Transforming VirtualMachine Data Completed.")
 
     # return dataframe
+    if tags_frame:
+        return df_vmware, frames.get('Vsphere Tags')
     return df_vmware
 
 
 # Transform ESXi Host Data
-def transform_esxi_data(flatten_esxi_data, esxi_column_mapping):
-    logger.info('Start Transforming VirtualMachine data')
-    # convert the data into dataframe
-    df_esxi = pd.DataFrame(flatten_esxi_data)
-
-    # rename columns
-    df_esxi.rename(columns=esxi_column_mapping, inplace=True)
-    
-    # preserve order
-    df_esxi = df_esxi[esxi_column_mapping.values()]
-
-
-    # transform Mgm IP column by having the last item from the ip list
-    df_esxi['Mgm IP'] = df_esxi['Mgm IP'].str.split(',').str[-1]
-    
-    # Transform Datastore Disk Space unit from bytes to TB 
-    df_esxi['Datastore Disk Space'] = (df_esxi['Datastore Disk Space'].astype(float) / (1024**4)).round(2)
-    
-    # make Host CPU usage % round by 2
-    df_esxi['Host CPU Usage %'] = df_esxi['Host CPU Usage %'].round(2)
-
-    # TransforHost Memory | GBm Host Memory Allocated(MB) into GB
-    df_esxi['Host Memory | GB'] = (df_esxi['Host Memory | GB'].astype(float) / (1024 ** 2)).round(2) 
-
-    # round off the Memory Reserve perc
-    df_esxi['Host Mem Usage %'] = df_esxi['Host Mem Usage %'].round(2)
-
-    # round off the Memory Reserve perc
-    df_esxi['Memory Reserved %'] = df_esxi['Memory Reserved %'].round(2)
-
-    # Convert System Uptime (sec) into Day(s)
-    df_esxi['System|Uptime (Day(s))'] = (df_esxi['System|Uptime (Day(s))'] / (60*60*24)).round(2)
-
-    # get and store the sub domain name from the domain name in new column
-    df_esxi['SD_Name'] = df_esxi['Name'].str.split('.').str[0]
-
-    # Convert Disk Utilization  (GB) into (TB)
-    df_esxi['Disk Utilization'] = (df_esxi['Disk Utilization | GB'] / (1024)).round(2)
-    df_esxi.drop(columns=['Disk Utilization | GB'], inplace=True)
-
-
-    # Save as Excel file
-    # Save the data as excel file
-    df_esxi.to_excel('data/processed/new_fetched_esxi.xlsx', index=False)
-    logger.info("ESXi Host Data Saved as Excel File")
+# every column is built by the compiled esxi_transform_spec
+def transform_esxi_data(flatten_esxi_data, esxi_transform, snapshot=True):
+    logger.info('Start Transforming ESXi Host data')
+    df_esxi, _ = esxi_transform(flatten_esxi_data)
+
+    # Save a snapshot of the data, written in the background (skipped for streamed batches, as each batch would overwrite the file)
+    if snapshot:
+        save_snapshot('esxi', 'new_fetched_esxi', df_esxi)
     
     logger.info("Transforming ESXi Host Data Completed.")
 
@@ -136,12 +255,12 @@ def transform_esxi_data(flatten_esxi_data, esxi_column_mapping):
 def transform_nas_data(dataframes, master_df):
     logger.info('Start Transforming NAS data')
     
-    # concatenate all the dataframes
-    nas_df = pd.concat(dataframes)
+    # concatenate all the dataframes (the unit and cluster columns are read as categoricals)
+    nas_df = concat_frames(dataframes)
 
-    # Convert the Units in TB, Apply the function row-wise
-    nas_df['Allocated'] = nas_df.apply(lambda row: convert_into_tb(row['Allocated Size'], row['Allocated Unit']), axis=1)
-    nas_df['Used'] = nas_df.apply(lambda row: convert_into_tb(row['Used Size'], row['Used Unit']), axis=1)
+    # Convert the Units in TB (unit column per row, unknown units become null)
+    nas_df['Allocated'] = to_tb(nas_df['Allocated Size'], nas_df['Allocated Unit'])
+    nas_df['Used'] = to_tb(nas_df['Used Size'], nas_df['Used Unit'])
 
     # rename columns for nas df
     nas_df.rename(columns={'APP-IDs from Share Descriptions': 'APP-ID'}, inplace=True)
@@ -170,10 +289,8 @@ def transform_nas_data(dataframes, master_df):
     # Step 2: Explode the list into separate rows
     new_df = new_df.explode('Clients').reset_index(drop=True)
 
-    # Save as Excel file
-    # Save the data as excel file
-    new_df.to_excel('data/processed/merged_nas_report.xlsx', index=False)
-    logger.info("NAS Data Saved as Excel File")
+    # Save a snapshot of the data, written in the background
+    save_snapshot('nas', 'merged_nas_report', new_df)
     
     logger.info("Transforming NAS Data Completed.")
 
@@ -185,8 +302,8 @@ def transform_nas_data(dataframes, master_df):
 def transform_aiops_data(aiops_df, master_df):
     logger.info('Transforming AIOPS(SAN) data Initialized...')
     # transform data
-    aiops_df['Total Size (TB)'] = (aiops_df['total_size']/(1024**4)).round(2)
-    aiops_df['Used (TB)'] = (aiops_df['allocated_size']/(1024**4)).round(2)
+    aiops_df['Total Size (TB)'] = to_tb(aiops_df['total_size'], 'b')
+    aiops_df['Used (TB)'] = to_tb(aiops_df['allocated_size'], 'b')
     aiops_df.drop(columns=['id','allocated_size','total_size'], inplace=True)
     # rename columns
     aiops_df.rename(columns = {"name":"StorageGroupName"}, inplace= True)
@@ -194,8 +311,8 @@ def transform_aiops_data(aiops_df, master_df):
     # modify master_df
     master_df.drop(columns=['TotalSize(TB)', 'Used(TB)'],inplace=True)
     merged_aiops_df = pd.merge(aiops_df, master_df,on='StorageGroupName', how='left')
-    # save the excel file as well
-    merged_aiops_df.to_excel('data/processed/merged_aiops.xlsx', index=False)
+    # save a snapshot as well
+    save_snapshot('aiops', 'merged_aiops', merged_aiops_df)
 
     logger.info("Transforming AIOPS(SAN) Data Completed.")
 
@@ -210,8 +327,8 @@ def transform_ibm_data(ibm_df, master_df):
     ibm_df = ibm_df[['name', 'san_capacity_bytes', 'used_san_capacity_bytes']]
     
     # convert capacity into TB and store it in new columns  
-    ibm_df['Total Size (TB)'] = round(ibm_df['san_capacity_bytes'] / (1024**4), 2)
-    ibm_df['Used (TB)'] = round(ibm_df['used_san_capacity_bytes'] / (1024**4), 2)
+    ibm_df['Total Size (TB)'] = to_tb(ibm_df['san_capacity_bytes'], 'b')
+    ibm_df['Used (TB)'] = to_tb(ibm_df['used_san_capacity_bytes'], 'b')
     # drop old bytes columns
     ibm_df.drop(columns=['san_capacity_bytes','used_san_capacity_bytes'], inplace=True)
 
@@ -221,8 +338,8 @@ def transform_ibm_data(ibm_df, master_df):
     # merge the ibm_df with the master_df to do vlookup on servername
     merged_ibm = pd.merge(ibm_df, master_df,on='ServerName', how='left')
     
-    # store transform file as excel
-    merged_ibm.to_excel('data/processed/merged_ibm.xlsx', index=False)
+    # store a snapshot of the transformed data
+    save_snapshot('ibm', 'merged_ibm', merged_ibm)
     
     logger.info("Transforming IBM(SAN) Data Completed.")
 
@@ -253,9 +370,43 @@ def transform_amps_data(df_view, view_type=None):
     
 
 
-
-
-
-
-
-
+# DPA reports fetched so far, keyed by (query_value, report_url), every CSV is parsed once when it arrives
+# so a retry pass only downloads and parses the reports that are still missing
+# with table_name, every report is parsed with the schema of that table (text columns typed by read_csv)
+class DPAReportStore:
+    def __init__(self, dtypes=None, table_name=None):
+        self.dtypes = dtypes
+        self.table_name = table_name
+        self.frames = {}
+
+    # parse and keep a fetched report {'query_value', 'report_url', 'report'}, a report that fails to parse stays missing
+    def add(self, report):
+        key = (report['query_value'], report['report_url'])
+        if key in self.frames:
+            return
+        try:
+            if self.table_name:
+                frame = read_csv(StringIO(report['report']), dtype={**(self.dtypes or {}), **parser_dtypes(self.table_name)})
+                self.frames[key] = apply_schema(frame, self.table_name)
+            else:
+                self.frames[key] = read_csv(StringIO(report['report']), dtype=self.dtypes)
+        except Exception as e:
+            logger.info(f"Failed to parse report CSV for {report['query_value']}: {e}")
+
+    def add_all(self, reports):
+        for report in reports:
+            self.add(report)
+
+    # report urls ({'query_value', 'report_url'}) not fetched yet
+    def missing(self, report_urls):
+        return [i for i in report_urls if (i['query_value'], i['report_url']) not in self.frames]
+
+    # all reports as one frame, rows repeated across reports are dropped
+    def to_frame(self):
+        if not self.frames:
+            return pd.DataFrame()
+        final_df = concat_frames(self.frames.values(), ignore_index=True)
+        total = len(final_df)
+        final_df = final_df.drop_duplicates(ignore_index=True)
+        logger.info(f"{len(self.frames)} reports converted to DataFrame: {len(final_df)} rows ({total - len(final_df)} duplicates dropped)")
+        return final_df
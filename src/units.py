@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+# bytes per storage unit (the unit codes used in the NAS reports)
+unit_bytes = {
+    'b': 1,                   # bytes
+    'k': 1024,                # kilobytes
+    'M': 1024 ** 2,           # megabytes
+    'G': 1024 ** 3,           # gigabytes
+    'T': 1024 ** 4,           # terabytes
+    'P': 1024 ** 5            # petabytes
+}
+
+
+# Convert a column of sizes from unit to to_unit, vectorized
+# unit is one code for the whole column or a column of codes (one per row), unknown codes give null instead of raising
+# same arithmetic as convert_into_tb: value * bytes per unit / bytes per to_unit, then rounded to decimals (None = no rounding)
+def convert_units(values, unit='b', to_unit='T', decimals=2):
+    index = values.index if isinstance(values, pd.Series) else None
+    numbers = pd.to_numeric(values, errors='coerce')
+    numbers = np.asarray(numbers, dtype='float64')
+
+    if isinstance(unit, str):
+        if unit not in unit_bytes:
+            raise ValueError(f'Unknown unit: {unit}')
+        multiplier = float(unit_bytes[unit])
+    else:
+        # per row unit column -> multiplier array, NaN for unknown units
+        multiplier = pd.Series(np.asarray(unit, dtype=object)).map(unit_bytes).to_numpy(dtype='float64')
+
+    result = numbers * multiplier / unit_bytes[to_unit]
+    if decimals is not None:
+        result = np.round(result, decimals)
+    return pd.Series(result, index=index) if index is not None else result
+
+
+# Convert a column of sizes into TB, rounded to 2 decimals
+def to_tb(values, unit='b', decimals=2):
+    return convert_units(values, unit, 'T', decimals)
@@ -3,12 +3,43 @@ import numpy as np
 import requests
 import logging
 import json
+import time
 import base64
+import threading
+import pandas as pd
 from pandas import json_normalize
 from dotenv import load_dotenv
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from src.units import unit_bytes
+
+# pyarrow parses CSV multithreaded, fall back to the C parser when it is not installed
+try:
+    import pyarrow
+    csv_engine = 'pyarrow'
+except ImportError:
+    csv_engine = 'c'
+
+
+# pd.read_csv with csv_engine, where the text columns of dtype ('str') keep their nulls as with the C parser:
+# pyarrow turns the empty cells of a 'str' column into the text 'None', so they are parsed as pandas 'string'
+# (nulls stay NA) and turned back into object columns with NaN
+def read_csv(source, dtype=None, **kwargs):
+    text_columns = [column for column, column_type in (dtype or {}).items() if column_type in ('str', str)] if csv_engine == 'pyarrow' else []
+    if text_columns:
+        dtype = {column: 'string' if column in text_columns else column_type for column, column_type in dtype.items()}
+    df = pd.read_csv(source, dtype=dtype, engine=csv_engine, **kwargs)
+    for column in text_columns:
+        if column in df.columns:
+            df[column] = df[column].astype(object).where(df[column].notna(), np.nan)
+    return df
 
+# calamine (Rust) parses xlsx several times faster than openpyxl, used when python-calamine is installed
+try:
+    import python_calamine
+    excel_engine = 'calamine'
+except ImportError:
+    excel_engine = 'openpyxl'
 
 # logging setup
 logger = logging.getLogger()
@@ -16,8 +47,21 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 
 
-# get vrops tokem
-def get_vrops_auth_token(username, password, auth_url):
+# Each acquire_*_token makes the login request and returns (token, expires_at epoch seconds or None)
+# it raises on failure, the get_*_auth_token wrappers log the error and return None instead
+
+# get expiry (exp claim) from a JWT token, None if the token is not a JWT
+def get_jwt_expiry(token):
+    try:
+        payload = token.split(' ')[-1].split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload)).get('exp'))
+    except Exception:
+        return None
+
+
+# acquire vrops token
+def acquire_vrops_token(username, password, auth_url, session=requests):
     # Header & Payload
     headers = {
     'Content-Type': 'application/json',
@@ -29,20 +73,26 @@ def get_vrops_auth_token(username, password, auth_url):
         "password": password,
     }
 
-    try:
-        # Make the POST request to acquire token
-        response = requests.post(auth_url, headers=headers, data=json.dumps(payload), verify=False)
-        response.raise_for_status()
-        # Extract token from response 
-        token = response.json().get('token')
-
-        if token:
-            logging.info(f"Token acquired: {token}")
-            return f'OpsToken  {token}'
-        else:
-            logging.error("No token Recieved.")
-            raise Exception("Authentication failed. No token received.")
+    # Make the POST request to acquire token
+    response = session.post(auth_url, headers=headers, data=json.dumps(payload), verify=False)
+    response.raise_for_status()
+    # Extract token from response 
+    body = response.json()
+    token = body.get('token')
+    if not token:
+        logging.error("No token Recieved.")
+        raise Exception("Authentication failed. No token received.")
+
+    logging.info(f"Token acquired: {token}")
+    # validity is the expiry in epoch milliseconds
+    validity = body.get('validity')
+    return f'OpsToken  {token}', (validity / 1000 if validity else None)
+
 
+# get vrops tokem
+def get_vrops_auth_token(username, password, auth_url):
+    try:
+        return acquire_vrops_token(username, password, auth_url)[0]
     except requests.exceptions.RequestException as req_exc:
         logging.error(f"Login failed: {req_exc}")
         return None
@@ -50,8 +100,8 @@ def get_vrops_auth_token(username, password, auth_url):
         logging.error(f'Unabel to fetch the token: {exception}')
 
 
-# Get AMPs Auth-tokem
-def get_amps_auth_token(username, password, login_url, portal_url):
+# acquire AMPs token
+def acquire_amps_token(username, password, login_url, portal_url, session=requests):
     # Headers & Payload
     payload = {
                 "username": username,
@@ -64,20 +114,23 @@ def get_amps_auth_token(username, password, login_url, portal_url):
                 "Content-Type": "application/json; charset=utf-8"
             }
 
-    try:
-        # Make the POST request to acquire token
-        response = requests.post(login_url, json=payload, headers=headers, verify=False)  # verify = False for staging only not recommended for prod
-        response.raise_for_status()
-        # Extract token from response
-        token = response.json().get("token")
-
-        if token:
-            logging.info("AMPS login successful. Token acquired.")
-            return f"Bearer {token}"
-        else:
-            logging.error("No token Recieved.")
-            raise Exception("Authentication failed. No token received.")
+    # Make the POST request to acquire token
+    response = session.post(login_url, json=payload, headers=headers, verify=False)  # verify = False for staging only not recommended for prod
+    response.raise_for_status()
+    # Extract token from response
+    token = response.json().get("token")
+    if not token:
+        logging.error("No token Recieved.")
+        raise Exception("Authentication failed. No token received.")
+
+    logging.info("AMPS login successful. Token acquired.")
+    return f"Bearer {token}", get_jwt_expiry(token)
+
 
+# Get AMPs Auth-tokem
+def get_amps_auth_token(username, password, login_url, portal_url):
+    try:
+        return acquire_amps_token(username, password, login_url, portal_url)[0]
     except requests.exceptions.RequestException as req_exc:
         logging.error(f"Login failed: {req_exc}")
         return None
@@ -85,8 +138,8 @@ def get_amps_auth_token(username, password, login_url, portal_url):
         logging.error(f'Unabel to fetch the token: {exception}')
 
 
-# Get AIOPS Auth-tokem to fetch SAN storage data
-def get_aiops_auth_token(client_id, client_secret, auth_url):
+# acquire AIOPS token
+def acquire_aiops_token(client_id, client_secret, auth_url, session=requests):
     # Header and data
     headers = {
         'Content-Type': 'application/x-www-form-urlencoded',
@@ -98,21 +151,26 @@ def get_aiops_auth_token(client_id, client_secret, auth_url):
         "client_secret": client_secret
     }
 
+    # Make the POST request to acquire token
+    response =  session.post(auth_url, headers=headers, data=data, verify=False)  # verify = False for staging only not recommended for prod
+    response.raise_for_status()
+    # Extract token from response
+    body = response.json()
+    token = body.get("access_token")
+    if not token:
+        logging.error("No token Recieved.")
+        raise Exception("Authentication failed. No token received.")
+
+    logging.info("AIOPS login successful. Token acquired.")
+    # OAuth response, expires_in is in seconds
+    expires_in = body.get("expires_in")
+    return f"Bearer {token}", (time.time() + float(expires_in) if expires_in else get_jwt_expiry(token))
 
-    try:
-        # Make the POST request to acquire token
-        response =  requests.post(auth_url, headers=headers, data=data, verify=False)  # verify = False for staging only not recommended for prod
-        response.raise_for_status()
-        # Extract token from response
-        token = response.json().get("access_token")
-
-        if token:
-            logging.info("AIOPS login successful. Token acquired.")
-            return f"Bearer {token}"
-        else:
-            logging.error("No token Recieved.")
-            raise Exception("Authentication failed. No token received.")
 
+# Get AIOPS Auth-tokem to fetch SAN storage data
+def get_aiops_auth_token(client_id, client_secret, auth_url):
+    try:
+        return acquire_aiops_token(client_id, client_secret, auth_url)[0]
     except requests.exceptions.RequestException as req_exc:
         logging.error(f"Login failed: {req_exc}")
         return None
@@ -120,28 +178,31 @@ def get_aiops_auth_token(client_id, client_secret, auth_url):
         logging.error(f'Unabel to fetch the token: {exception}')
 
 
-# Get DELL Auth-tokem to fetch SAN storage data
-def get_ibm_auth_token(api_key, auth_url):
+# acquire IBM token
+def acquire_ibm_token(api_key, auth_url, session=requests):
     # Header
     headers = {
         "accept": "application/json",
         "x-api-key": api_key
     }
 
-    try:
-        # Make the POST request to acquire token
-        response =  requests.post(auth_url, headers=headers, verify=False)  # verify = False for staging only not recommended for prod
-        response.raise_for_status()
-        # Extract token from response
-        token = response.json().get('result').get('token')
-
-        if token:
-            logging.info("IBM login successful. Token acquired.")
-            return f"{token}"
-        else:
-            logging.error("No token Recieved.")
-            raise Exception("Authentication failed. No token received.")
+    # Make the POST request to acquire token
+    response =  session.post(auth_url, headers=headers, verify=False)  # verify = False for staging only not recommended for prod
+    response.raise_for_status()
+    # Extract token from response
+    token = response.json().get('result').get('token')
+    if not token:
+        logging.error("No token Recieved.")
+        raise Exception("Authentication failed. No token received.")
+
+    logging.info("IBM login successful. Token acquired.")
+    return f"{token}", get_jwt_expiry(token)
+
 
+# Get DELL Auth-tokem to fetch SAN storage data
+def get_ibm_auth_token(api_key, auth_url):
+    try:
+        return acquire_ibm_token(api_key, auth_url)[0]
     except requests.exceptions.RequestException as req_exc:
         logging.error(f"Login failed: {req_exc}")
         return None
@@ -149,6 +210,80 @@ def get_ibm_auth_token(api_key, auth_url):
         logging.error(f'Unabel to fetch the token: {exception}')
 
 
+# Token for one source, cached with its expiry and refreshed refresh_margin seconds before it expires
+# acquire is called with a pooled session and returns (token, expires_at or None), default_ttl is used when no expiry is known
+class TokenSource:
+    def __init__(self, name, acquire, session, default_ttl=3600, refresh_margin=300):
+        self.name = name
+        self.acquire = acquire
+        self.session = session
+        self.default_ttl = default_ttl
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self.expires_at = 0
+        self.logins = 0
+        self._lock = threading.Lock()
+
+    def needs_refresh(self):
+        return self.token is None or time.time() >= self.expires_at - self.refresh_margin
+
+    # get a valid token, logging in again when it is about to expire
+    def get(self):
+        with self._lock:
+            if self.needs_refresh():
+                self._login()
+            return self.token
+
+    # log in again after a 401, unless another request already replaced the stale token
+    def refresh(self, stale=None):
+        with self._lock:
+            if stale is None or stale == self.token:
+                logger.info(f'Token for {self.name} rejected, re-authenticating')
+                self._login()
+            return self.token
+
+    def _login(self):
+        token, expires_at = self.acquire(self.session)
+        self.token = token
+        self.expires_at = expires_at or time.time() + self.default_ttl
+        self.logins += 1
+        logger.info(f'Token for {self.name} valid for {(self.expires_at - time.time()) / 60:.0f} minutes')
+
+
+# Caches the tokens of every source (vROps, AMPs, AIOPS, IBM) over one pooled session
+class TokenManager:
+    def __init__(self, refresh_margin=300):
+        self.refresh_margin = refresh_margin
+        self.session = requests.Session()
+        self.sources = {}
+
+    def register(self, name, acquire, default_ttl=3600):
+        self.sources[name] = TokenSource(name, acquire, self.session, default_ttl, self.refresh_margin)
+        return self.sources[name]
+
+    def source(self, name):
+        return self.sources[name]
+
+    def get(self, name):
+        return self.sources[name].get()
+
+
+# get the token string from a plain token or a TokenSource
+def resolve_token(token):
+    return token.get() if isinstance(token, TokenSource) else token
+
+
+# Make a request with the token in auth_header, on 401 re-authenticate once (TokenSource only) and repeat it
+def request_with_token(method, url, token, session=requests, auth_header='Authorization', headers=None, **kwargs):
+    headers = dict(headers or {})
+    headers[auth_header] = resolve_token(token)
+    response = session.request(method, url, headers=headers, **kwargs)
+    if response.status_code == 401 and isinstance(token, TokenSource):
+        headers[auth_header] = token.refresh(stale=headers[auth_header])
+        response = session.request(method, url, headers=headers, **kwargs)
+    return response
+
+
 
 # Convert columns with data list type into json
 def convert_lists_to_json(df):    
@@ -221,20 +356,10 @@ def remove_duplicate_cols(df):
     # drop duplicate columns
     df.drop(columns = [org_cols[drop_indice] for drop_indice in drop_indices], inplace=True)
 
-# convert the data(bytes) into TB for data stoage columns
+# convert the data(bytes) into TB for data stoage columns (one value, see src/units.py for whole columns)
 def convert_into_tb(value, unit='T'):
-
-    units = {
-        'b': 1,               # bytes
-        'k': 1024,                # kilobytes to bytes
-        'M': 1024 ** 2,           # megabytes to bytes
-        'G': 1024 ** 3,           # gigabytes to bytes
-        'T': 1024 ** 4,           # terabytes to bytes
-        'P': 1024 ** 5            # petabytes to bytes
-        }
-
     # convert into bytes
-    bytes_value = value * units[unit]
+    bytes_value = value * unit_bytes[unit]
     # Convert bytes to TB
     tb_value = bytes_value / (1024 ** 4)
     return round(tb_value,2)
\ No newline at end of file
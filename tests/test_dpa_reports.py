@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+import src.utils
+from config import dpa_report_dtypes, table_schemas
+from src.schema import configure_schemas
+from src.transform import DPAReportStore
+
+
+# the C parser and pyarrow when it is installed (the engine used when it is)
+def available_engines():
+    engines = ['c']
+    try:
+        import pyarrow
+        engines.append('pyarrow')
+    except ImportError:
+        pass
+    return engines
+
+
+report = {'query_value': 'ava1', 'report_url': 'url1',
+          'report': 'Server,Client,Status\nava1,client1,Success\n,client2,Failed\nava1,,Success\n'}
+
+
+@pytest.mark.parametrize('table_name', [None, 'avamar_servers'])
+@pytest.mark.parametrize('engine', available_engines())
+def test_missing_server_stays_null(monkeypatch, engine, table_name):
+    monkeypatch.setattr(src.utils, 'csv_engine', engine)
+    configure_schemas(table_schemas)
+    store = DPAReportStore(dpa_report_dtypes, table_name)
+    store.add(report)
+    df = store.to_frame()
+
+    assert df['Server'].isna().tolist() == [False, True, False]
+    assert 'None' not in df['Server'].astype(object).tolist()
+    assert set(df['Server'].dropna()) == {'ava1'}
@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+
+import src.utils
+from config import nas_csv_dtypes
+from src.snapshots import configure_snapshots
+from src.sources import LocalDirectorySource, read_csv_files
+from src.transform import transform_nas_data
+
+
+# the C parser and pyarrow when it is installed (the engine used when it is)
+def available_engines():
+    engines = ['c']
+    try:
+        import pyarrow
+        engines.append('pyarrow')
+    except ImportError:
+        pass
+    return engines
+
+
+@pytest.fixture(autouse=True)
+def no_snapshots():
+    configure_snapshots(sources={'nas': False})
+    yield
+    configure_snapshots()
+
+
+# a share report with empty APP-ID and Clients cells, and the master sheet giving the APP-ID of one of the paths
+@pytest.fixture
+def nas_share(tmp_path):
+    (tmp_path / 'share.csv').write_text(
+        'Path,Allocated Size,Allocated Unit,Used Size,Used Unit,APP-IDs from Share Descriptions,Clients,Cluster\n'
+        '/ifs/a,1,T,0.5,T,APP1,host1 host2,cl1\n'
+        '/ifs/b,2,T,1,T,,host3,cl1\n'
+        '/ifs/c,512,G,256,G,,,cl2\n'
+    )
+    master_df = pd.DataFrame({'Path': ['/ifs/b'], 'APP-ID': ['MASTER'], 'Frame Name': ['frame1']})
+    return LocalDirectorySource(str(tmp_path)), master_df
+
+
+@pytest.mark.parametrize('engine', available_engines())
+def test_empty_text_cells_stay_null(monkeypatch, nas_share, engine):
+    monkeypatch.setattr(src.utils, 'csv_engine', engine)
+    source, _ = nas_share
+    [df] = read_csv_files(source, nas_csv_dtypes, 1)
+    assert df['APP-IDs from Share Descriptions'].tolist()[0] == 'APP1'
+    assert df['APP-IDs from Share Descriptions'].iloc[1:].isna().all()
+    assert df['Clients'].isna().tolist() == [False, False, True]
+
+
+@pytest.mark.parametrize('engine', available_engines())
+def test_master_app_id_fallback(monkeypatch, nas_share, engine):
+    monkeypatch.setattr(src.utils, 'csv_engine', engine)
+    source, master_df = nas_share
+    nas_df = transform_nas_data(read_csv_files(source, nas_csv_dtypes, 1), master_df)
+
+    app_ids = nas_df.groupby('Path')['APP-ID'].first()
+    assert app_ids['/ifs/a'] == 'APP1'
+    assert app_ids['/ifs/b'] == 'MASTER'
+    assert pd.isna(app_ids['/ifs/c'])
+    assert 'None' not in nas_df[['Path', 'APP-ID', 'Clients']].astype(str).values